@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks and a load test for storage and bot handlers (python -m bench.<module>)."""
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Timing helpers and JSON result files shared by the benchmarks."""
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(values: list, p: float) -> float:
+    """p-th percentile (0..100) with linear interpolation; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(latencies: list, allocations: list | None = None) -> dict:
+    """Latency list in seconds (+ optional bytes per call) -> p50/p99/mean in ms."""
+    out = {
+        "n": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 4) if latencies else 0.0,
+        "max_ms": round(max(latencies) * 1000, 4) if latencies else 0.0,
+    }
+    if allocations:
+        out["alloc_p50_bytes"] = int(percentile(allocations, 50))
+        out["alloc_p99_bytes"] = int(percentile(allocations, 99))
+    return out
+
+
+def timed(fn, *args):
+    """(result, seconds) of one call."""
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def allocated(fn, *args) -> int:
+    """Peak bytes allocated during one call (tracemalloc must be running)."""
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    return max(0, peak - before)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def write_results(path: Path | None, name: str, params: dict, results: list) -> dict:
+    """Save results with enough metadata to compare runs; print them if no path is given."""
+    report = {
+        "benchmark": name,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path is None:
+        print(text)
+    else:
+        Path(path).write_text(text, encoding="utf-8")
+        print(f"Results written to {path}")
+    return report
+
+
+def parse_sizes(text: str) -> list[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Synthetic data: N chats x M users x K bets per chat, written through a storage backend.
+
+    python -m bench.datasets --chats 20 --users 50 --bets 10000 --out /tmp/betbot-data
+"""
+import argparse
+import random
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import storage
+
+TEAMS = ["Спартак", "ЦСКА", "Зенит", "Локомотив", "Динамо", "Real Madrid", "Barcelona", "Arsenal", "Bayern", "Milan"]
+MARKETS = ["Победа", "Ничья", "Тотал больше 2.5", "Обе забьют", "Фора -1", "Win", "Over 2.5"]
+
+# Первый chat_id синтетических чатов: отрицательные, как у групп в Telegram
+FIRST_CHAT_ID = -1001000000000
+
+
+def chat_ids(chats: int) -> list[int]:
+    return [FIRST_CHAT_ID - i for i in range(chats)]
+
+
+def user_ids(users: int) -> list[int]:
+    return [100_000 + i for i in range(users)]
+
+
+def generate(chats: int, users: int, bets: int, active_share: float = 0.1, seed: int = 1) -> tuple[dict, list]:
+    """(users, bets) in the layout storage.import_data expects. Same seed -> same data."""
+    rnd = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    all_users: dict = {}
+    all_bets: list = []
+    uids = user_ids(users)
+    for chat_id in chat_ids(chats):
+        all_users[str(chat_id)] = {
+            str(uid): {"user_id": uid, "username": f"user{uid}", "balance": rnd.randint(0, 30_000)} for uid in uids
+        }
+        for bet_id in range(1, bets + 1):
+            bet = {
+                "id": bet_id,
+                "chat_id": chat_id,
+                "user_id": rnd.choice(uids),
+                "description": f"{rnd.choice(MARKETS)} {rnd.choice(TEAMS)} — {rnd.choice(TEAMS)}",
+                "rate": round(rnd.uniform(1.1, 5.0), 2),
+                "sum": rnd.randint(10, 2000),
+                "status": "active",
+            }
+            # Активные — в основном самые свежие, как в жизни
+            if bet_id <= bets * (1 - active_share):
+                settled_by = bet["user_id"]
+                bet.update(
+                    status=rnd.choice(("won", "lost")),
+                    settled_at=(start + timedelta(minutes=bet_id)).isoformat(),
+                    settled_by_user_id=settled_by,
+                    settled_by_username=f"user{settled_by}",
+                )
+            all_bets.append(bet)
+    return all_users, all_bets
+
+
+def build(backend_name: str, chats: int, users: int, bets: int, data_dir: Path | None = None, seed: int = 1) -> Path:
+    """Generate a dataset into data_dir (a fresh temp dir by default) and return the directory."""
+    data_dir = Path(data_dir or tempfile.mkdtemp(prefix="betbot-bench-"))
+    backend = storage.create_backend(backend_name, data_dir)
+    try:
+        backend.import_data(*generate(chats, users, bets, seed=seed))
+    finally:
+        backend.close()
+    return data_dir
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=storage.BACKENDS, default="json")
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--users", type=int, default=50, help="users per chat")
+    parser.add_argument("--bets", type=int, default=1000, help="bets per chat")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", type=Path, default=None, help="data directory (default: new temp dir)")
+    args = parser.parse_args(argv)
+    path = build(args.backend, args.chats, args.users, args.bets, args.out, args.seed)
+    print(f"Dataset written to {path}")
+
+
+if __name__ == "__main__":
+    main()
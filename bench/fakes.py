@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Fake Update/CallbackQuery objects and a stub bot, so handlers run without Telegram.
+
+Фейки повторяют только то, чем пользуются хендлеры bot.py. Всё, что бот
+«отправляет», попадает в StubBot.calls; latency имитирует задержку API.
+С chat_limit/global_limit StubBot ведёт себя как Telegram при флуде: лишние
+сообщения за секунду получают RetryAfter (429) и считаются в rejected.
+"""
+import asyncio
+import itertools
+import math
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from telegram.error import RetryAfter
+
+_message_ids = itertools.count(1)
+
+
+@dataclass
+class FakeUser:
+    id: int
+    username: str = ""
+    first_name: str = "Тест"
+
+
+@dataclass
+class FakeChat:
+    id: int
+    type: str = "group"
+
+
+class StubBot:
+    """Records every Bot API call instead of sending it; optionally enforces flood limits."""
+
+    def __init__(self, latency: float = 0.0, chat_limit: int = 0, global_limit: int = 0, window: float = 1.0):
+        self.latency = latency
+        self.calls: list[tuple[str, dict]] = []
+        # Не больше chat_limit сообщений в чат и global_limit всего за window секунд (0 — без лимита)
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.window = window
+        self.rejected = 0
+        self._sent: deque = deque()
+        self._sent_by_chat: dict[int, deque] = {}
+
+    def _check_flood(self, chat_id: int) -> None:
+        now = time.monotonic()
+        for sent, limit in ((self._sent, self.global_limit), (self._sent_by_chat.setdefault(chat_id, deque()), self.chat_limit)):
+            while sent and now - sent[0] >= self.window:
+                sent.popleft()
+            if limit and len(sent) >= limit:
+                self.rejected += 1
+                raise RetryAfter(max(1, math.ceil(self.window - (now - sent[0]))))
+        self._sent.append(now)
+        self._sent_by_chat[chat_id].append(now)
+
+    async def _call(self, method: str, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if "chat_id" in kwargs and (self.chat_limit or self.global_limit):
+            self._check_flood(kwargs["chat_id"])
+        self.calls.append((method, kwargs))
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None, **kwargs):
+        await self._call("send_message", chat_id=chat_id, text=text, reply_markup=reply_markup, **kwargs)
+        return FakeMessage(self, FakeChat(chat_id), text=text, reply_markup=reply_markup)
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int, reply_markup=None, **kwargs):
+        await self._call(
+            "edit_message_text", chat_id=chat_id, message_id=message_id, text=text, reply_markup=reply_markup, **kwargs
+        )
+        return True
+
+    async def answer_callback_query(self, callback_query_id: str, text: str | None = None, show_alert: bool = False, **kwargs):
+        await self._call("answer_callback_query", callback_query_id=callback_query_id, text=text, show_alert=show_alert)
+        return True
+
+    def count(self, method: str) -> int:
+        return sum(1 for name, _ in self.calls if name == method)
+
+
+class FakeMessage:
+    def __init__(self, bot: StubBot, chat: FakeChat, text: str = "", from_user: FakeUser | None = None, reply_markup=None):
+        self._bot = bot
+        self.chat = chat
+        self.chat_id = chat.id
+        self.message_id = next(_message_ids)
+        self.text = text
+        self.from_user = from_user
+        self.reply_markup = reply_markup
+        self.message_thread_id = None
+        self.is_topic_message = False
+
+    def get_bot(self):
+        return self._bot
+
+    async def reply_text(self, text: str, reply_markup=None, **kwargs):
+        return await self._bot.send_message(self.chat.id, text, reply_markup=reply_markup, **kwargs)
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        await self._bot.edit_message_text(text, self.chat.id, self.message_id, reply_markup=reply_markup, **kwargs)
+        self.text, self.reply_markup = text, reply_markup
+        return self
+
+
+class FakeCallbackQuery:
+    def __init__(self, bot: StubBot, from_user: FakeUser, message: FakeMessage, data: str):
+        self._bot = bot
+        self.id = str(next(_message_ids))
+        self.from_user = from_user
+        self.message = message
+        self.data = data
+
+    def get_bot(self):
+        return self._bot
+
+    async def answer(self, text: str | None = None, show_alert: bool = False, **kwargs):
+        return await self._bot.answer_callback_query(self.id, text=text, show_alert=show_alert, **kwargs)
+
+    async def edit_message_text(self, text: str, reply_markup=None, **kwargs):
+        return await self.message.edit_text(text, reply_markup=reply_markup, **kwargs)
+
+
+@dataclass
+class FakeUpdate:
+    effective_user: FakeUser
+    effective_chat: FakeChat
+    message: FakeMessage | None = None
+    callback_query: FakeCallbackQuery | None = None
+
+    @property
+    def effective_message(self) -> FakeMessage | None:
+        return self.message or (self.callback_query.message if self.callback_query else None)
+
+
+@dataclass
+class FakeContext:
+    bot: StubBot
+    args: list = field(default_factory=list)
+    bot_data: dict = field(default_factory=dict)
+    chat_data: dict = field(default_factory=dict)
+    user_data: dict = field(default_factory=dict)
+
+
+def command(bot: StubBot, chat_id: int, user_id: int, text: str) -> FakeUpdate:
+    """Update for a command message like '/bet Спартак | 2 | 100'."""
+    user = FakeUser(user_id, username=f"user{user_id}")
+    chat = FakeChat(chat_id)
+    return FakeUpdate(user, chat, message=FakeMessage(bot, chat, text=text, from_user=user))
+
+
+def callback(bot: StubBot, chat_id: int, user_id: int, data: str, message_text: str = "") -> FakeUpdate:
+    """Update for a tap on an inline button with callback_data=data."""
+    user = FakeUser(user_id, username=f"user{user_id}")
+    chat = FakeChat(chat_id)
+    message = FakeMessage(bot, chat, text=message_text)
+    return FakeUpdate(user, chat, callback_query=FakeCallbackQuery(bot, user, message, data))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""End-to-end latency of the bot handlers on a stub bot (no network).
+
+    python -m bench.handlers_bench --backend json --bets 10000 --out handlers.json
+
+Хендлеры вызываются по одному (без конкуренции), так что это время одного
+апдейта от входа в хендлер до того, как его ответы встали в очередь отправки
+(sender.py), включая пул потоков хранилища: столько хендлер держит слот
+concurrent_updates. Сами ответы уходят после — их темп и лимиты Telegram
+гоняет loadtest. Для каждого хендлера также считается число вызовов Bot API.
+"""
+import argparse
+import asyncio
+import random
+import shutil
+import time
+from pathlib import Path
+
+import bot
+import sender
+import storage
+from storage import aio as astorage
+
+from . import datasets, fakes
+from .common import summarize, write_results
+
+
+async def _bet(stub, rnd, chat_id, user_id):
+    await bot.cmd_bet(fakes.command(stub, chat_id, user_id, f"/bet {rnd.choice(datasets.TEAMS)} | 1.9 | 10"), fakes.FakeContext(stub))
+
+
+async def _bets(stub, rnd, chat_id, user_id):
+    await bot.cmd_bets(fakes.command(stub, chat_id, user_id, "/bets"), fakes.FakeContext(stub))
+
+
+async def _settle(stub, rnd, chat_id, user_id):
+    active = await astorage.get_user_bets(chat_id, user_id, status="active", limit=1)
+    if not active:
+        # Нечего закрывать — сначала ставка, как сделал бы пользователь
+        await _bet(stub, rnd, chat_id, user_id)
+        active = await astorage.get_user_bets(chat_id, user_id, status="active", limit=1)
+    data = f"settle_{active[0]['id']}_{rnd.choice(('win', 'lost'))}"
+    await bot.settle_bet_callback(fakes.callback(stub, chat_id, user_id, data, "Твои ставки:"), fakes.FakeContext(stub))
+
+
+async def _bets_page(stub, rnd, chat_id, user_id):
+    # Вторая страница /bets: ставки старше самой новой
+    newest = await astorage.get_user_bets(chat_id, user_id, limit=1)
+    data = f"bets_{user_id}_b{newest[0]['id']}" if newest else f"bets_{user_id}_b1"
+    await bot.bets_page_callback(fakes.callback(stub, chat_id, user_id, data, "Твои ставки:"), fakes.FakeContext(stub))
+
+
+async def _active(stub, rnd, chat_id, user_id):
+    await bot.cmd_active(fakes.command(stub, chat_id, user_id, "/active"), fakes.FakeContext(stub))
+
+
+async def _top(stub, rnd, chat_id, user_id):
+    await bot.cmd_top(fakes.command(stub, chat_id, user_id, "/top"), fakes.FakeContext(stub))
+
+
+async def _balance(stub, rnd, chat_id, user_id):
+    await bot.cmd_balance(fakes.command(stub, chat_id, user_id, "/balance"), fakes.FakeContext(stub))
+
+
+async def _stats(stub, rnd, chat_id, user_id):
+    await bot.cmd_stats(fakes.command(stub, chat_id, user_id, "/stats"), fakes.FakeContext(stub))
+
+
+async def _chatstats(stub, rnd, chat_id, user_id):
+    await bot.cmd_chatstats(fakes.command(stub, chat_id, user_id, "/chatstats"), fakes.FakeContext(stub))
+
+
+async def _find(stub, rnd, chat_id, user_id):
+    # Половина запросов — из двух слов: пересечение списков индекса
+    words = rnd.choice(datasets.TEAMS).split() + (rnd.choice(datasets.MARKETS).split()[:1] if rnd.random() < 0.5 else [])
+    text = "/find " + " ".join(words)
+    await bot.cmd_find(fakes.command(stub, chat_id, user_id, text), fakes.FakeContext(stub, args=words))
+
+
+async def _find_page(stub, rnd, chat_id, user_id):
+    # Вторая страница /find по одной команде
+    team = rnd.choice(datasets.TEAMS)
+    newest, _, _ = await astorage.find_bets(chat_id, team, limit=1)
+    data = f"find_b{newest[0]['id']}" if newest else "find_b1"
+    await bot.find_page_callback(fakes.callback(stub, chat_id, user_id, data, bot.FIND_HEADER + team), fakes.FakeContext(stub))
+
+
+HANDLERS = {
+    "cmd_bet": _bet,
+    "cmd_bets": _bets,
+    "settle_bet_callback": _settle,
+    "bets_page_callback": _bets_page,
+    "cmd_active": _active,
+    "cmd_top": _top,
+    "cmd_balance": _balance,
+    "cmd_stats": _stats,
+    "cmd_chatstats": _chatstats,
+    "cmd_find": _find,
+    "find_page_callback": _find_page,
+}
+
+
+async def run(backend_name: str, chats: int, users: int, bets: int, iterations: int, latency: float, seed: int = 1) -> list:
+    data_dir = datasets.build(backend_name, chats, users, bets, seed=seed)
+    rnd = random.Random(seed)
+    chat_list, user_list = datasets.chat_ids(chats), datasets.user_ids(users)
+    results = []
+    try:
+        storage.set_backend(storage.create_backend(backend_name, data_dir))
+        await astorage.start()
+        try:
+            for name, handler in HANDLERS.items():
+                stub = fakes.StubBot(latency)
+                sender.get_outbox(stub, global_rate=0, chat_rate=0)
+                latencies = []
+                for _ in range(iterations):
+                    chat_id, user_id = rnd.choice(chat_list), rnd.choice(user_list)
+                    start = time.perf_counter()
+                    await handler(stub, rnd, chat_id, user_id)
+                    latencies.append(time.perf_counter() - start)
+                await sender.close_outboxes()  # дослать очередь, чтобы посчитать вызовы
+                results.append({
+                    "handler": name,
+                    "bets_per_chat": bets,
+                    "api_calls_per_update": round(len(stub.calls) / iterations, 2),
+                    **summarize(latencies),
+                })
+                print(f"{backend_name:6} {name:22} p50={results[-1]['p50_ms']:.3f}ms p99={results[-1]['p99_ms']:.3f}ms")
+        finally:
+            await sender.close_outboxes()
+            await astorage.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=storage.BACKENDS, default="json")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50, help="users per chat")
+    parser.add_argument("--bets", type=int, default=1000, help="bets per chat")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency, seconds")
+    parser.add_argument("--out", type=Path, default=None, help="JSON file for results (default: print)")
+    args = parser.parse_args(argv)
+    results = asyncio.run(run(args.backend, args.chats, args.users, args.bets, args.iterations, args.api_latency))
+    write_results(args.out, "handlers", {k: v for k, v in vars(args).items() if k != "out"}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Open-loop load test: a mixed stream of updates at a fixed rate against the handlers.
+
+    python -m bench.loadtest --backend json --rate 200 --duration 30 --out load.json
+
+Апдейты приходят по расписанию (Пуассоновский поток с заданной частотой)
+независимо от того, успел ли бот ответить на предыдущие, как в жизни.
+Задержка считается от запланированного момента прихода, поэтому очередь
+перед ботом видна в p99, а не прячется. Одновременно обрабатывается не
+больше --concurrency апдейтов, как с BOT_CONCURRENT_UPDATES.
+
+С --chat-limit/--global-limit заглушка отвечает 429, как Telegram при флуде:
+
+    python -m bench.loadtest --chats 3 --rate 100 --chat-limit 3 --global-limit 30
+
+очередь отправки (sender.py) получает те же лимиты и должна уложиться в них
+без единого 429 — иначе прогон завершается с ошибкой. Хендлеры не ждут
+отправки, так что задержка апдейтов не растёт из-за чата, упёршегося в
+лимит; сколько ответы ждали очереди, видно в метриках betbot_outbox_*.
+Без этих флагов очередь отправки работает без лимитов.
+"""
+import argparse
+import asyncio
+import random
+import shutil
+import time
+from pathlib import Path
+
+import sender
+import storage
+from storage import aio as astorage
+
+from . import datasets, fakes
+from .common import summarize, write_results
+from .handlers_bench import HANDLERS
+
+# Доля каждого хендлера в потоке апдейтов
+DEFAULT_MIX = {
+    "cmd_bet": 25,
+    "settle_bet_callback": 20,
+    "cmd_bets": 20,
+    "cmd_balance": 15,
+    "cmd_top": 10,
+    "cmd_active": 10,
+}
+
+
+def parse_mix(text: str) -> dict:
+    """'cmd_bet=3,cmd_top=1' -> {'cmd_bet': 3, 'cmd_top': 1}."""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in HANDLERS:
+            raise argparse.ArgumentTypeError(f"unknown handler: {name.strip()}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def run(
+    backend_name: str,
+    chats: int,
+    users: int,
+    bets: int,
+    rate: float,
+    duration: float,
+    concurrency: int,
+    mix: dict,
+    api_latency: float,
+    seed: int = 1,
+    chat_limit: int = 0,
+    global_limit: int = 0,
+) -> dict:
+    data_dir = datasets.build(backend_name, chats, users, bets, seed=seed)
+    rnd = random.Random(seed)
+    chat_list, user_list = datasets.chat_ids(chats), datasets.user_ids(users)
+    names, weights = list(mix), list(mix.values())
+    stub = fakes.StubBot(api_latency, chat_limit=chat_limit, global_limit=global_limit)
+    # Очередь отправки держит те же лимиты, что и заглушка; без симуляции лимитов меряем сам бот
+    outbox_limits = {"global_rate": global_limit, "chat_rate": chat_limit}
+    slots = asyncio.Semaphore(concurrency)
+    latencies: dict[str, list] = {name: [] for name in names}
+    errors: dict[str, int] = {}
+
+    async def one(name: str, scheduled: float, chat_id: int, user_id: int, handler_rnd: random.Random):
+        async with slots:
+            try:
+                await HANDLERS[name](stub, handler_rnd, chat_id, user_id)
+            except Exception as e:  # noqa: BLE001 — считаем, а не падаем
+                key = f"{name}: {type(e).__name__}"
+                errors[key] = errors.get(key, 0) + 1
+                return
+        latencies[name].append(time.perf_counter() - scheduled)
+
+    try:
+        storage.set_backend(storage.create_backend(backend_name, data_dir))
+        await astorage.start()
+        sender.get_outbox(stub, **outbox_limits)
+        tasks = []
+        started = time.perf_counter()
+        next_at = started
+        try:
+            while next_at - started < duration:
+                delay = next_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                name = rnd.choices(names, weights)[0]
+                tasks.append(asyncio.create_task(one(
+                    name, next_at, rnd.choice(chat_list), rnd.choice(user_list), random.Random(rnd.random())
+                )))
+                next_at += rnd.expovariate(rate)
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+            outbox = sender.get_outbox(stub)
+        finally:
+            await sender.close_outboxes(timeout=None)
+            await astorage.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    everything = [t for values in latencies.values() for t in values]
+    return {
+        "sent": len(tasks),
+        "completed": len(everything),
+        "errors": errors,
+        "target_rate": rate,
+        "achieved_rate": round(len(everything) / elapsed, 2),
+        "elapsed_s": round(elapsed, 3),
+        "api_calls": len(stub.calls),
+        "rejected_429": stub.rejected,
+        "outbox": dict(outbox.stats),
+        "all": summarize(everything),
+        "by_handler": {name: summarize(values) for name, values in latencies.items() if values},
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=storage.BACKENDS, default="json")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=50, help="users per chat")
+    parser.add_argument("--bets", type=int, default=1000, help="bets per chat")
+    parser.add_argument("--rate", type=float, default=100.0, help="updates per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=32, help="like BOT_CONCURRENT_UPDATES")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="handler=weight,... (default: typical chat)")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="simulated Bot API latency, seconds")
+    parser.add_argument("--chat-limit", type=int, default=0, help="simulated Telegram limit: messages per chat per second")
+    parser.add_argument("--global-limit", type=int, default=0, help="simulated Telegram limit: messages per second")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", type=Path, default=None, help="JSON file for results (default: print)")
+    args = parser.parse_args(argv)
+    report = asyncio.run(run(
+        args.backend, args.chats, args.users, args.bets, args.rate, args.duration,
+        args.concurrency, args.mix, args.api_latency, args.seed, args.chat_limit, args.global_limit,
+    ))
+    s = report["all"]
+    print(
+        f"{args.backend}: {report['completed']}/{report['sent']} updates, {report['achieved_rate']}/s "
+        f"(target {args.rate}/s), p50={s['p50_ms']:.1f}ms p99={s['p99_ms']:.1f}ms, errors={sum(report['errors'].values())}, 429s={report['rejected_429']}"
+    )
+    write_results(args.out, "loadtest", {k: v for k, v in vars(args).items() if k != "out"}, [report])
+    if report["rejected_429"]:
+        raise SystemExit(f"outbox went over the simulated limits: {report['rejected_429']} x 429")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Cold start of the JSON backend: snapshot.json against snapshot.bin.
+
+    python -m bench.startup --sizes 1000,10000,100000 --out startup.json
+
+Для каждого размера (ставок в чате) данные генерируются один раз, затем
+для каждого формата снимки переписываются (binsnap.convert) и --repeats раз
+замеряется: запуск хранилища, первое обращение к каждому чату (загрузка
+шарда) и первая «настоящая» команда — /top и первая страница /bets.
+Плюс пик памяти на загрузку всех чатов, сколько памяти на ставку остаётся
+занято, когда разобраны все ставки (resident_bytes_per_bet), и размер
+снимков на диске.
+"""
+import argparse
+import shutil
+import tracemalloc
+from pathlib import Path
+
+from storage import binsnap
+from storage.json_backend import JsonStorage
+
+from . import datasets
+from .common import allocated, parse_sizes, summarize, timed, write_results
+
+FORMATS = ("json", "bin")
+
+
+def _first_access(backend: JsonStorage, chats: list[int]) -> None:
+    for chat_id in chats:
+        backend.get_leaderboard_version(chat_id)
+
+
+def _first_commands(backend: JsonStorage, chats: list[int], user_id: int) -> None:
+    for chat_id in chats:
+        backend.get_top_balances(chat_id, 15)
+        backend.get_user_bets_page(chat_id, user_id)
+
+
+def _touch_all(backend: JsonStorage, chats: list[int], users: list[int]) -> None:
+    for chat_id in chats:
+        for user_id in users:
+            backend.get_user_bets(chat_id, user_id)
+
+
+def bench_size(chats: int, users: int, size: int, repeats: int) -> list:
+    data_dir = datasets.build("json", chats, users, size)
+    chat_ids = datasets.chat_ids(chats)
+    user_ids = datasets.user_ids(users)
+    user_id = user_ids[0]
+    results = []
+    try:
+        for snapshot_format in FORMATS:
+            binsnap.convert(data_dir, snapshot_format)
+            disk = sum(f.stat().st_size for f in data_dir.glob(f"chats/*/snapshot.{snapshot_format}"))
+            starts, loads, commands = [], [], []
+            for _ in range(repeats):
+                backend = JsonStorage(data_dir, snapshot_format=snapshot_format)
+                starts.append(timed(backend.start)[1])
+                loads.append(timed(_first_access, backend, chat_ids)[1])
+                commands.append(timed(_first_commands, backend, chat_ids, user_id)[1])
+                backend.close()
+            backend = JsonStorage(data_dir, snapshot_format=snapshot_format)
+            backend.start()
+            tracemalloc.start()
+            try:
+                memory = allocated(_first_access, backend, chat_ids)
+                _touch_all(backend, chat_ids, user_ids)
+                resident = tracemalloc.get_traced_memory()[0] / (chats * size)
+            finally:
+                tracemalloc.stop()
+                backend.close()
+            for name, latencies in (("start", starts), ("load_all_chats", loads), ("first_commands", commands)):
+                results.append({
+                    "fn": name,
+                    "format": snapshot_format,
+                    "size": size,
+                    "snapshot_bytes": disk,
+                    "load_peak_bytes": memory,
+                    "resident_bytes_per_bet": int(resident),
+                    **summarize(latencies),
+                })
+                print(f"{snapshot_format:4} size={size:<8} {name:15} p50={results[-1]['p50_ms']:.3f}ms")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=parse_sizes, default=[1000, 10000, 100000], help="bets per chat, comma separated")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50, help="users per chat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--out", type=Path, default=None, help="JSON file for results (default: print)")
+    args = parser.parse_args(argv)
+    results = []
+    for size in args.sizes:
+        results += bench_size(args.chats, args.users, size, args.repeats)
+    write_results(args.out, "startup", {k: v for k, v in vars(args).items() if k != "out"}, results)
+
+
+if __name__ == "__main__":
+    main()
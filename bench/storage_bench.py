@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Latency (p50/p99) and allocations of every public storage function at several data sizes.
+
+    python -m bench.storage_bench --backend json --sizes 1000,10000,100000 --out storage.json
+
+size — ставок в каждом чате; чатов и пользователей задают --chats и --users.
+Каждая функция вызывается --iterations раз на случайных чатах и пользователях
+(замер времени), затем ещё раз под tracemalloc (замер памяти).
+"""
+import argparse
+import random
+import shutil
+import tracemalloc
+from collections import deque
+from pathlib import Path
+
+import storage
+
+from . import datasets
+from .common import allocated, parse_sizes, summarize, timed, write_results
+
+
+class Workload:
+    """Random arguments for storage calls over one generated dataset."""
+
+    def __init__(self, chats: int, users: int, bets: int, seed: int = 1):
+        self.rnd = random.Random(seed)
+        self.chats = datasets.chat_ids(chats)
+        self.users = datasets.user_ids(users)
+        self.bets = bets
+        self.created: deque = deque()  # (chat_id, bet_id) активных ставок, созданных бенчмарком
+
+    def chat(self) -> int:
+        return self.rnd.choice(self.chats)
+
+    def user(self) -> int:
+        return self.rnd.choice(self.users)
+
+    def bet_id(self) -> int:
+        return self.rnd.randint(1, max(1, self.bets))
+
+    def create_bet(self):
+        chat_id = self.chat()
+        bet = storage.create_bet(chat_id, self.user(), "Бенчмарк Спартак — Зенит", 2.0, 1)
+        if bet:
+            self.created.append((chat_id, bet["id"]))
+
+    def settle_bet(self):
+        if self.created:
+            chat_id, bet_id = self.created.popleft()
+        else:
+            chat_id, bet_id = self.chat(), self.bet_id()
+        storage.settle_bet(chat_id, bet_id, self.rnd.random() < 0.5, 1, "bench")
+
+
+# Имя -> функция от Workload, делающая один вызов storage
+OPERATIONS = {
+    "get_user": lambda w: storage.get_user(w.chat(), w.user()),
+    "get_balance": lambda w: storage.get_balance(w.chat(), w.user()),
+    "update_balance": lambda w: storage.update_balance(w.chat(), w.user(), 1),
+    "create_bet": Workload.create_bet,
+    "get_bet": lambda w: storage.get_bet(w.chat(), w.bet_id()),
+    "get_user_bets": lambda w: storage.get_user_bets(w.chat(), w.user()),
+    "get_user_bets_top20": lambda w: storage.get_user_bets(w.chat(), w.user(), limit=20),
+    "settle_bet": Workload.settle_bet,
+    "get_all_active_bets": lambda w: storage.get_all_active_bets(w.chat()),
+    "get_all_users_balances": lambda w: storage.get_all_users_balances(w.chat()),
+    "get_top_balances": lambda w: storage.get_top_balances(w.chat(), 15),
+    "get_rank": lambda w: storage.get_rank(w.chat(), w.user()),
+    "get_leaderboard_version": lambda w: storage.get_leaderboard_version(w.chat()),
+    "reset_all_balances_to_initial": lambda w: storage.reset_all_balances_to_initial(w.chat()),
+}
+
+
+def bench_size(backend_name: str, chats: int, users: int, size: int, iterations: int, alloc_iterations: int, only=None):
+    data_dir = datasets.build(backend_name, chats, users, size)
+    results = []
+    try:
+        backend = storage.create_backend(backend_name, data_dir)
+        storage.set_backend(backend)
+        work = Workload(chats, users, size)
+        # Холодный старт: запуск и первое обращение к каждому чату
+        _, load_time = timed(storage.start)
+        cold = []
+        for chat_id in work.chats:
+            _, t = timed(storage.get_leaderboard_version, chat_id)
+            cold.append(t)
+        results.append({"fn": "start", "size": size, **summarize([load_time])})
+        results.append({"fn": "first_access", "size": size, **summarize(cold)})
+
+        for name, op in OPERATIONS.items():
+            if only and name not in only:
+                continue
+            latencies = [timed(op, work)[1] for _ in range(iterations)]
+            tracemalloc.start()
+            try:
+                allocations = [allocated(op, work) for _ in range(alloc_iterations)]
+            finally:
+                tracemalloc.stop()
+            results.append({"fn": name, "size": size, **summarize(latencies, allocations)})
+            print(f"{backend_name:6} size={size:<8} {name:30} p50={results[-1]['p50_ms']:.3f}ms p99={results[-1]['p99_ms']:.3f}ms")
+        storage.close()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return results
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=storage.BACKENDS, default="json")
+    parser.add_argument("--sizes", type=parse_sizes, default=[100, 1000, 10000], help="bets per chat, comma separated")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50, help="users per chat")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--alloc-iterations", type=int, default=100)
+    parser.add_argument("--only", type=lambda s: set(s.split(",")), default=None, help="comma separated function names")
+    parser.add_argument("--out", type=Path, default=None, help="JSON file for results (default: print)")
+    args = parser.parse_args(argv)
+    results = []
+    for size in args.sizes:
+        results += bench_size(args.backend, args.chats, args.users, size, args.iterations, args.alloc_iterations, args.only)
+    params = {k: sorted(v) if isinstance(v, set) else v for k, v in vars(args).items() if k != "out"}
+    write_results(args.out, "storage", params, results)
+
+
+if __name__ == "__main__":
+    main()
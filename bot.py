@@ -2,9 +2,10 @@
 """Telegram bot for friends betting — 10000 rubles each, track bets, rates and sums."""
 import os
 import re
+from collections import OrderedDict
 from pathlib import Path
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Chat, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
@@ -19,7 +20,52 @@ try:
 except ImportError:
     pass
 
-import storage
+import cluster
+import metrics
+import sender
+import webhook
+from storage import aio as astorage
+from storage.stats import summary as stats_summary
+
+
+# polling — бот сам спрашивает Telegram об апдейтах; webhook — Telegram присылает их на WEBHOOK_URL (см. webhook.py)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Сколько апдейтов обрабатывать одновременно (изменения в одном чате всё равно идут по очереди)
+CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "32"))
+# Telegram user id тех, кому доступна /perf (через запятую)
+ADMIN_IDS = {int(x) for x in os.environ.get("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+
+# Хендлеры не ждут, пока Telegram примет ответ: вызов ставится в очередь
+# отправки (sender.py), и слот concurrent_updates освобождается сразу, даже
+# если чат упёрся в свой лимит. Ошибки отправки очередь печатает сама.
+
+
+async def _reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup=None) -> None:
+    """Сообщение в чат апдейта — через очередь отправки (sender.py), чтобы не упереться в лимиты Telegram.
+
+    Как message.reply_text(): в группах отвечает на сообщение с командой, в
+    форуме — в ту же тему.
+    """
+    chat, message = update.effective_chat, update.effective_message
+    thread_id = reply_to = None
+    if message is not None:
+        thread_id = message.message_thread_id if message.is_topic_message else None
+        reply_to = message.message_id if chat.type != Chat.PRIVATE else None
+    await sender.get_outbox(context.bot).send(
+        chat.id, text, reply_markup=reply_markup, message_thread_id=thread_id, reply_to=reply_to, wait=False
+    )
+
+
+async def _answer(context: ContextTypes.DEFAULT_TYPE, query, text: str | None = None, show_alert: bool = False) -> None:
+    """Ответ на нажатие кнопки — самая срочная полоса очереди."""
+    await sender.get_outbox(context.bot).answer(query.id, text, show_alert, wait=False)
+
+
+async def _edit(context: ContextTypes.DEFAULT_TYPE, query, text: str, reply_markup=None) -> None:
+    """Правка сообщения с кнопкой; несколько правок подряд уходят одной."""
+    message = query.message
+    await sender.get_outbox(context.bot).edit(message.chat.id, message.message_id, text, reply_markup, wait=False)
 
 
 def get_token():
@@ -32,9 +78,10 @@ def get_token():
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     chat_id = update.effective_chat.id
-    u = storage.get_user(chat_id, user.id, user.username or "")
+    u = await astorage.get_user(chat_id, user.id, user.username or "")
     balance = u["balance"]
-    await update.message.reply_text(
+    await _reply(
+        update, context,
         "Здорова, лудик. Сейчас попробуем сохранить твои бабки, но оставить интерес. Погнали...\n\n"
         f"Привет, {user.first_name or 'друг'}!\n\n"
         f"У тебя на счёте {balance:,} ₽. Можно делать ставки.\n\n"
@@ -43,8 +90,11 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/bet описание | коэффициент | сумма — сделать ставку\n"
         "/bets — мои ставки (кнопки «Сыграло» / «Не сыграло»)\n"
         "/active — все нерассчитанные ставки в чате\n"
+        "/find слова — поиск ставок по описанию\n"
         "/top — таблица по балансам\n"
         "/results — подвести итоги и сбросить балансы до 10 000 ₽\n"
+        "/history — прошлые раунды\n"
+        "/stats — моя статистика, /chatstats — статистика чата\n"
         "/help — полное руководство по боту"
     )
 
@@ -59,19 +109,28 @@ HELP_TEXT = """📖 Руководство по боту «Ставки с др
 
 /start — регистрация и стартовый баланс 10 000 ₽
 
-/balance — показать текущий баланс
+/balance — показать текущий баланс и место в таблице
 
 /bet описание | коэффициент | сумма — сделать ставку
 Пример: /bet Победа Спартака | 2.0 | 500
 
-/bets — список своих ставок. У активных ставок есть кнопки «✅ Сыграло» и «❌ Не сыграло» — нажмите, чтобы закрыть ставку.
+/bets — список своих ставок, по 10 на странице (листать — кнопками «◀ Новее» / «Старее ▶»). У активных ставок есть кнопки «✅ Сыграло» и «❌ Не сыграло» — нажмите, чтобы закрыть ставку.
 
-/active — показать все нерассчитанные ставки в чате (кто поставил, на что, коэффициент и сумма)
+/active — показать все нерассчитанные ставки в чате (кто поставил, на что, коэффициент и сумма), по 15 на странице
+
+/find слова — найти ставки чата по описанию: например, /find Спартак покажет все ставки, где упоминается «Спартак» («Спартака», «Спартаку» тоже подходят). Если слов несколько — нужны все. Ищутся все ставки чата, включая прошлые раунды; новые первыми, по 10 на странице.
 
 /top — таблица участников по балансу
 
 /results — подвести итоги раунда (показать результаты), затем по запросу обнулить балансы — у всех снова по 10 000 ₽. Сначала появится вопрос «Обнулить балансы?» с кнопками Да/Нет.
 
+/history — прошлые раунды: кто победил и сколько было участников
+/history N — итоговая таблица раунда N и твои ставки в нём
+
+/stats — твоя статистика за раунд: сколько ставок и на какую сумму, процент сыгравших, итог и ROI, лучший выигрыш и серии
+
+/chatstats — то же по всему чату, плюс лучший выигрыш и самая длинная серия побед
+
 /help — это руководство
 
 ━━━━━━━━━━━━━━━━━━━━
@@ -88,14 +147,18 @@ HELP_TEXT = """📖 Руководство по боту «Ставки с др
 
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(HELP_TEXT)
+    await _reply(update, context, HELP_TEXT)
 
 
 async def cmd_balance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    balance = storage.get_balance(chat_id, user_id)
-    await update.message.reply_text(f"Твой баланс: {balance:,} ₽")
+    balance = await astorage.get_balance(chat_id, user_id)
+    rank = await astorage.get_rank(chat_id, user_id)
+    text = f"Твой баланс: {balance:,} ₽"
+    if rank:
+        text += f"\nМесто в таблице: {rank[0]} из {rank[1]}"
+    await _reply(update, context, text)
 
 
 async def cmd_bet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -105,91 +168,144 @@ async def cmd_bet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # /bet description | rate | sum
     parts = re.split(r"\s*\|\s*", text.replace("/bet", "").strip(), maxsplit=2)
     if len(parts) != 3:
-        await update.message.reply_text(
+        await _reply(
+            update, context,
             "Формат: /bet описание | коэффициент | сумма\n"
             "Пример: /bet Победа Спартака | 2.0 | 500"
         )
         return
     desc, rate_str, sum_str = (p.strip() for p in parts)
     if not desc:
-        await update.message.reply_text("Укажи описание ставки.")
+        await _reply(update, context, "Укажи описание ставки.")
         return
     try:
         rate = float(rate_str.replace(",", "."))
         if rate < 1.01:
-            await update.message.reply_text("Коэффициент должен быть больше 1 (например 2.0).")
+            await _reply(update, context, "Коэффициент должен быть больше 1 (например 2.0).")
             return
     except ValueError:
-        await update.message.reply_text("Коэффициент — число (например 2.0 или 1.5).")
+        await _reply(update, context, "Коэффициент — число (например 2.0 или 1.5).")
         return
     try:
         sum_rub = int(sum_str.replace(" ", ""))
         if sum_rub < 1:
-            await update.message.reply_text("Сумма должна быть больше 0.")
+            await _reply(update, context, "Сумма должна быть больше 0.")
             return
     except ValueError:
-        await update.message.reply_text("Сумма — целое число рублей.")
+        await _reply(update, context, "Сумма — целое число рублей.")
         return
 
-    bet = storage.create_bet(chat_id, user_id, desc, rate, sum_rub)
+    bet = await astorage.create_bet(chat_id, user_id, desc, rate, sum_rub)
     if bet is None:
-        balance = storage.get_balance(chat_id, user_id)
-        await update.message.reply_text(
+        balance = await astorage.get_balance(chat_id, user_id)
+        await _reply(
+            update, context,
             f"Недостаточно средств. Твой баланс: {balance:,} ₽"
         )
         return
     potential = int(bet["sum"] * bet["rate"])
-    await update.message.reply_text(
+    await _reply(
+        update, context,
         f"Ставка принята.\n"
         f"Описание: {bet['description']}\n"
         f"Коэффициент: {bet['rate']}\n"
         f"Сумма: {bet['sum']:,} ₽\n"
         f"Потенциальный выигрыш: {potential:,} ₽\n"
-        f"Баланс после ставки: {storage.get_balance(chat_id, user_id):,} ₽"
+        f"Баланс после ставки: {await astorage.get_balance(chat_id, user_id):,} ₽"
     )
 
 
-def _format_bets_message(chat_id: int, user_id: int) -> tuple[str, InlineKeyboardMarkup | None]:
-    """Формирует текст списка ставок и клавиатуру для активных (до 15 шт.)."""
-    bets = storage.get_user_bets(chat_id, user_id)[:20]
+# Сколько ставок на одной странице /bets, /active и /find
+BETS_PAGE = 10
+ACTIVE_PAGE = 15
+FIND_PAGE = 10
+
+
+def _parse_cursor(cursor: str) -> tuple[int | None, int | None]:
+    """Курсор из callback_data: b<id> — ставки старше id, a<id> — новее id."""
+    bet_id = int(cursor[1:])
+    return (bet_id, None) if cursor[0] == "b" else (None, bet_id)
+
+
+def _nav_row(prefix: str, bets: list, has_older: bool, has_newer: bool) -> list:
+    """Кнопки «◀ / ▶» страницы; в callback_data только номер крайней ставки страницы."""
+    row = []
+    if has_newer:
+        row.append(InlineKeyboardButton("◀ Новее", callback_data=f"{prefix}a{bets[0]['id']}"))
+    if has_older:
+        row.append(InlineKeyboardButton("Старее ▶", callback_data=f"{prefix}b{bets[-1]['id']}"))
+    return row
+
+
+def _format_bets_message(
+    bets: list, has_older: bool = False, has_newer: bool = False, owner_id: int = 0
+) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Формирует текст страницы ставок, кнопки для активных и кнопки листания."""
     lines = []
     keyboard_rows = []
+    # Номер, с которого начинается эта страница: после закрытия ставки перерисуем ровно её
+    anchor = f"_{bets[0]['id'] + 1}" if has_newer else ""
     for b in bets:
         status_emoji = {"active": "⏳", "won": "✅", "lost": "❌"}.get(b.get("status"), "?")
         potential = int(b["sum"] * b["rate"])
         lines.append(
             f"{status_emoji} #{b['id']} {b['description']} | кф. {b['rate']} | {b['sum']:,} ₽ (выигрыш {potential:,} ₽)"
         )
-        if b.get("status") == "active" and len(keyboard_rows) < 15:
+        if b.get("status") == "active":
             keyboard_rows.append([
-                InlineKeyboardButton("✅ Сыграло", callback_data=f"settle_{b['id']}_win"),
-                InlineKeyboardButton("❌ Не сыграло", callback_data=f"settle_{b['id']}_lost"),
+                InlineKeyboardButton("✅ Сыграло", callback_data=f"settle_{b['id']}_win{anchor}"),
+                InlineKeyboardButton("❌ Не сыграло", callback_data=f"settle_{b['id']}_lost{anchor}"),
             ])
+    nav = _nav_row(f"bets_{owner_id}_", bets, has_older, has_newer)
+    if nav:
+        keyboard_rows.append(nav)
     text = "Твои ставки:\n\n" + "\n".join(lines)
     keyboard = InlineKeyboardMarkup(keyboard_rows) if keyboard_rows else None
     return text, keyboard
 
 
+async def _edit_if_changed(context, query, text: str, keyboard: InlineKeyboardMarkup | None) -> None:
+    """Править сообщение, только если текст или кнопки стали другими: иначе это пустой запрос к API."""
+    message = query.message
+    if message is not None and message.text == text and message.reply_markup == keyboard:
+        return
+    await _edit(context, query, text, reply_markup=keyboard)
+
+
 async def cmd_bets(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
-    bets = storage.get_user_bets(chat_id, user_id)
+    bets, has_older, has_newer = await astorage.get_user_bets_page(chat_id, user_id, limit=BETS_PAGE)
     if not bets:
-        await update.message.reply_text("У тебя пока нет ставок.")
+        await _reply(update, context, "У тебя пока нет ставок.")
         return
-    text, keyboard = _format_bets_message(chat_id, user_id)
-    await update.message.reply_text(text, reply_markup=keyboard)
+    text, keyboard = _format_bets_message(bets, has_older, has_newer, user_id)
+    await _reply(update, context, text, reply_markup=keyboard)
 
 
-async def cmd_active(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показать все нерассчитанные (активные) ставки в чате."""
-    chat_id = update.effective_chat.id
-    active_bets = storage.get_all_active_bets(chat_id)
-    if not active_bets:
-        await update.message.reply_text("Нет нерассчитанных ставок. Все ставки закрыты.")
+async def bets_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листание /bets: callback_data bets_<user_id>_b<id> (старше) или bets_<user_id>_a<id> (новее)."""
+    query = update.callback_query
+    chat_id = query.message.chat.id if query.message else 0
+    _, owner, cursor = query.data.split("_")
+    user_id = int(owner)
+    if not query.from_user or query.from_user.id != user_id:
+        await _answer(context, query, "Это чужой список. Свои ставки — /bets.", show_alert=True)
+        return
+    await _answer(context, query)
+    before, after = _parse_cursor(cursor)
+    bets, has_older, has_newer = await astorage.get_user_bets_page(chat_id, user_id, before, after, BETS_PAGE)
+    if not bets:  # страница опустела (ставки ушли в архив) — показываем первую
+        bets, has_older, has_newer = await astorage.get_user_bets_page(chat_id, user_id, limit=BETS_PAGE)
+    if not bets:
+        await _edit_if_changed(context, query, "У тебя пока нет ставок.", None)
         return
+    await _edit_if_changed(context, query, *_format_bets_message(bets, has_older, has_newer, user_id))
+
+
+def _format_active_message(bets: list, has_older: bool, has_newer: bool) -> tuple[str, InlineKeyboardMarkup | None]:
     lines = ["⏳ Нерассчитанные ставки:\n"]
-    for b in active_bets[:30]:  # Ограничение до 30 ставок
+    for b in bets:
         author = f"@{b['username']}" if b.get("username") else f"ID{b['user_id']}"
         potential = int(b["sum"] * b["rate"])
         lines.append(
@@ -197,108 +313,413 @@ async def cmd_active(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
             f"   {b['description']}\n"
             f"   Коэффициент: {b['rate']} | Сумма: {b['sum']:,} ₽ | Выигрыш: {potential:,} ₽\n"
         )
-    await update.message.reply_text("\n".join(lines))
+    nav = _nav_row("active_", bets, has_older, has_newer)
+    # Без перевода строки в конце: Telegram его срезает, и _edit_if_changed не узнал бы свой же текст
+    return "\n".join(lines).rstrip("\n"), InlineKeyboardMarkup([nav]) if nav else None
 
 
-async def cmd_top(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+NO_ACTIVE_TEXT = "Нет нерассчитанных ставок. Все ставки закрыты."
+
+
+async def cmd_active(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Показать все нерассчитанные (активные) ставки в чате, по страницам."""
+    chat_id = update.effective_chat.id
+    bets, has_older, has_newer = await astorage.get_active_bets_page(chat_id, limit=ACTIVE_PAGE)
+    if not bets:
+        await _reply(update, context, NO_ACTIVE_TEXT)
+        return
+    text, keyboard = _format_active_message(bets, has_older, has_newer)
+    await _reply(update, context, text, reply_markup=keyboard)
+
+
+async def active_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листание /active: callback_data active_b<id> (старше) или active_a<id> (новее)."""
+    query = update.callback_query
+    chat_id = query.message.chat.id if query.message else 0
+    await _answer(context, query)
+    before, after = _parse_cursor(query.data.split("_")[1])
+    bets, has_older, has_newer = await astorage.get_active_bets_page(chat_id, before, after, ACTIVE_PAGE)
+    if not bets:  # пока листали, ставки на этой странице закрыли — показываем первую
+        bets, has_older, has_newer = await astorage.get_active_bets_page(chat_id, limit=ACTIVE_PAGE)
+    if not bets:
+        await _edit_if_changed(context, query, NO_ACTIVE_TEXT, None)
+        return
+    await _edit_if_changed(context, query, *_format_active_message(bets, has_older, has_newer))
+
+
+# Первая строка ответа /find; из неё же листание достаёт запрос (в callback_data он не влезет)
+FIND_HEADER = "🔎 Поиск: "
+FIND_USAGE = "Напиши, что искать: /find Спартак\nИщутся ставки чата, где есть все слова запроса."
+
+
+def _format_find_message(
+    query_text: str, bets: list, has_older: bool, has_newer: bool
+) -> tuple[str, InlineKeyboardMarkup | None]:
+    lines = [f"{FIND_HEADER}{query_text}\n"]
+    for b in bets:
+        status_emoji = {"active": "⏳", "won": "✅", "lost": "❌"}.get(b.get("status"), "?")
+        author = f"@{b['username']}" if b.get("username") else f"ID{b['user_id']}"
+        lines.append(f"{status_emoji} #{b['id']} {author}: {b['description']} | кф. {b['rate']} | {b['sum']:,} ₽")
+    nav = _nav_row("find_", bets, has_older, has_newer)
+    return "\n".join(lines), InlineKeyboardMarkup([nav]) if nav else None
+
+
+def _not_found_text(query_text: str) -> str:
+    return f"По запросу «{query_text}» ничего не нашлось."
+
+
+async def cmd_find(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ставки чата, в описании которых есть все слова запроса (storage/search.py), новые первыми."""
     chat_id = update.effective_chat.id
-    users = storage.get_all_users_balances(chat_id)
-    if not users:
-        await update.message.reply_text("Пока никого нет.")
+    query_text = " ".join(context.args or ())
+    if not query_text:
+        await _reply(update, context, FIND_USAGE)
+        return
+    bets, has_older, has_newer = await astorage.find_bets(chat_id, query_text, limit=FIND_PAGE)
+    if not bets:
+        await _reply(update, context, _not_found_text(query_text))
+        return
+    text, keyboard = _format_find_message(query_text, bets, has_older, has_newer)
+    await _reply(update, context, text, reply_markup=keyboard)
+
+
+async def find_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Листание /find: callback_data find_b<id> (старше) или find_a<id> (новее), запрос — из текста сообщения."""
+    query = update.callback_query
+    message = query.message
+    first_line = (message.text or "").split("\n", 1)[0] if message else ""
+    await _answer(context, query)
+    if not first_line.startswith(FIND_HEADER):
+        return
+    query_text = first_line[len(FIND_HEADER):]
+    before, after = _parse_cursor(query.data.split("_")[1])
+    bets, has_older, has_newer = await astorage.find_bets(message.chat.id, query_text, before, after, FIND_PAGE)
+    if not bets:  # ставки этой страницы ушли в архив — показываем первую
+        bets, has_older, has_newer = await astorage.find_bets(message.chat.id, query_text, limit=FIND_PAGE)
+    if not bets:
+        await _edit_if_changed(context, query, _not_found_text(query_text), None)
         return
-    users.sort(key=lambda x: x["balance"], reverse=True)
+    await _edit_if_changed(context, query, *_format_find_message(query_text, bets, has_older, has_newer))
+
+
+# Сколько строк показывать в /top
+TOP_SHOWN = 15
+# Готовые тексты /top и /results: (команда, chat_id) -> (версия таблицы балансов, текст).
+# Пока балансы в чате не менялись, версия та же и текст не пересобирается.
+_table_cache: OrderedDict = OrderedDict()
+TABLE_CACHE_SIZE = 1024
+
+
+def _format_table(users: list) -> list[str]:
     lines = []
-    for i, u in enumerate(users[:15], 1):
+    for i, u in enumerate(users, 1):
         name = f"@{u['username']}" if u["username"] else f"ID{u['user_id']}"
         lines.append(f"{i}. {name} — {u['balance']:,} ₽")
-    await update.message.reply_text("Балансы:\n\n" + "\n".join(lines))
+    return lines
+
+
+async def _cached_table(kind: str, chat_id: int, limit: int | None) -> str | None:
+    """Текст таблицы балансов из кэша или заново; None, если в чате никого нет."""
+    version = await astorage.get_leaderboard_version(chat_id)
+    key = (kind, chat_id)
+    cached = _table_cache.get(key)
+    if cached is not None and cached[0] == version:
+        _table_cache.move_to_end(key)
+        return cached[1]
+    users = await astorage.get_top_balances(chat_id, limit)
+    text = "\n".join(_format_table(users)) if users else None
+    _table_cache[key] = (version, text)
+    if len(_table_cache) > TABLE_CACHE_SIZE:
+        _table_cache.popitem(last=False)
+    return text
+
+
+async def cmd_top(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    table = await _cached_table("top", chat_id, TOP_SHOWN)
+    if table is None:
+        await _reply(update, context, "Пока никого нет.")
+        return
+    text = "Балансы:\n\n" + table
+    rank = await astorage.get_rank(chat_id, update.effective_user.id)
+    if rank and rank[0] > TOP_SHOWN:
+        text += f"\n\nТы на {rank[0]} месте из {rank[1]}."
+    await _reply(update, context, text)
 
 
 async def cmd_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Подвести итоги и спросить подтверждение перед обнулением балансов."""
     chat_id = update.effective_chat.id
-    users = storage.get_all_users_balances(chat_id)
-    if not users:
-        await update.message.reply_text("Нет участников. Итоги подводить нечего.")
+    table = await _cached_table("results", chat_id, None)
+    if table is None:
+        await _reply(update, context, "Нет участников. Итоги подводить нечего.")
         return
-    users.sort(key=lambda x: x["balance"], reverse=True)
-    lines = ["📊 Итоги раунда:\n"]
-    for i, u in enumerate(users, 1):
-        name = f"@{u['username']}" if u["username"] else f"ID{u['user_id']}"
-        lines.append(f"{i}. {name} — {u['balance']:,} ₽")
+    lines = ["📊 Итоги раунда:\n", table]
     lines.append("\nОбнулить балансы?")
+    # Номер раунда в кнопке: второе «Да» по тому же вопросу раунд уже не закроет
+    round_no = await astorage.get_round(chat_id)
     keyboard = InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("Да", callback_data=f"results_yes_{chat_id}"),
-            InlineKeyboardButton("Нет", callback_data=f"results_no_{chat_id}"),
+            InlineKeyboardButton("Да", callback_data=f"results_yes_{chat_id}_{round_no}"),
+            InlineKeyboardButton("Нет", callback_data=f"results_no_{chat_id}_{round_no}"),
         ]
     ])
-    await update.message.reply_text("\n".join(lines), reply_markup=keyboard)
+    await _reply(update, context, "\n".join(lines), reply_markup=keyboard)
 
 
 async def results_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка нажатия кнопки подтверждения обнуления балансов."""
     query = update.callback_query
-    await query.answer()
-    # callback_data: results_yes_<chat_id> или results_no_<chat_id>
+    # callback_data: results_yes_<chat_id>_<раунд> или results_no_<chat_id>_<раунд>
     parts = query.data.split("_")
-    if len(parts) < 3:
-        await query.answer("Ошибка данных.", show_alert=True)
+    if len(parts) < 4:
+        # Кнопка вопроса, заданного до номеров раундов в кнопках: какой раунд закрывать, неизвестно
+        await _answer(context, query, "Вопрос устарел — вызови /results ещё раз.", show_alert=True)
         return
-    chat_id = int(parts[2])
+    chat_id, round_no = int(parts[2]), int(parts[3])
     if query.data.startswith("results_no"):
-        await query.edit_message_text(
+        await _answer(context, query)
+        await _edit(
+            context, query,
             query.message.text + "\n\n❌ Отменено."
         )
         return
     if query.data.startswith("results_yes"):
-        count = storage.reset_all_balances_to_initial(chat_id)
-        await query.edit_message_text(
-            query.message.text + f"\n\n✅ Балансы сброшены. У всех {count} участников снова по 10 000 ₽. Новый раунд!"
+        count = await astorage.reset_all_balances_to_initial(chat_id, round_no)
+        if count is None:
+            await _answer(context, query, f"Раунд {round_no} уже закрыт.")
+            return
+        await _answer(context, query)
+        await _edit(
+            context, query,
+            query.message.text + f"\n\n✅ Балансы сброшены. У всех {count} участников снова по 10 000 ₽. Новый раунд!\n"
+            "Итоги сохранены — смотри /history."
         )
 
 
+# Сколько раундов показывать в /history и сколько своих ставок в /history N
+HISTORY_ROUNDS_SHOWN = 10
+HISTORY_BETS_SHOWN = 20
+
+
+async def cmd_history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Прошлые раунды чата: /history — список, /history N — таблица и свои ставки раунда N."""
+    chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
+    current = await astorage.get_round(chat_id)
+    if not context.args:
+        rounds = await astorage.get_rounds(chat_id)
+        if not rounds:
+            await _reply(update, context, f"Сейчас идёт раунд {current}. Закрытых раундов пока нет.")
+            return
+        lines = [f"📜 Прошлые раунды (сейчас идёт раунд {current}):\n"]
+        for r in rounds[:HISTORY_ROUNDS_SHOWN]:
+            standings = r["standings"]
+            when = r["closed_at"][:10]
+            if standings:
+                leader = standings[0]
+                name = f"@{leader['username']}" if leader["username"] else f"ID{leader['user_id']}"
+                lines.append(
+                    f"Раунд {r['round']} ({when}): 🏆 {name} — {leader['balance']:,} ₽, участников: {len(standings)}"
+                )
+            else:
+                lines.append(f"Раунд {r['round']} ({when}): без участников")
+        lines.append("\nПодробнее: /history N")
+        await _reply(update, context, "\n".join(lines))
+        return
+    try:
+        round_no = int(context.args[0])
+    except ValueError:
+        await _reply(update, context, "Номер раунда — целое число. Например: /history 1")
+        return
+    result = await astorage.get_round_standings(chat_id, round_no)
+    if result is None:
+        await _reply(update, context, f"Раунд {round_no} не найден. Сейчас идёт раунд {current}.")
+        return
+    lines = [f"📊 Итоги раунда {round_no} ({result['closed_at'][:10]}):\n"]
+    lines += _format_table(result["standings"]) or ["Участников не было."]
+    mine = next((row for row in result["standings"] if row["user_id"] == user_id and row.get("stats")), None)
+    if mine:
+        st = stats_summary(mine["stats"])
+        lines.append(f"\nТвоя статистика: сыграло {st['won']} из {st['settled']}, итог {st['profit']:+,} ₽")
+    bets = await astorage.get_archived_bets(chat_id, user_id, round_no, limit=HISTORY_BETS_SHOWN)
+    if bets:
+        lines.append("\nТвои ставки в этом раунде:")
+        for b in bets:
+            status_emoji = {"won": "✅", "lost": "❌"}.get(b.get("status"), "?")
+            lines.append(f"{status_emoji} #{b['id']} {b['description']} | кф. {b['rate']} | {b['sum']:,} ₽")
+    await _reply(update, context, "\n".join(lines))
+
+
 async def settle_bet_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Быстро закрыть ставку: Сыграло / Не сыграло из списка /bets."""
     query = update.callback_query
     user_id = query.from_user.id if query.from_user else 0
     chat_id = query.message.chat.id if query.message else 0
-    # callback_data: settle_<bet_id>_win или settle_<bet_id>_lost
+    # callback_data: settle_<bet_id>_win или settle_<bet_id>_lost, в конце может быть _<before> —
+    # с какого номера начиналась страница /bets (у старых сообщений его нет — первая страница)
     parts = query.data.split("_")
-    if len(parts) != 3:
-        await query.answer("Ошибка данных.", show_alert=True)
+    if len(parts) not in (3, 4):
+        await _answer(context, query, "Ошибка данных.", show_alert=True)
         return
     try:
         bet_id = int(parts[1])
+        before = int(parts[3]) if len(parts) == 4 else None
     except ValueError:
-        await query.answer("Неверный номер ставки.", show_alert=True)
+        await _answer(context, query, "Неверный номер ставки.", show_alert=True)
         return
     won = parts[2] == "win"
-    bet = storage.get_bet(chat_id, bet_id)
+    bet = await astorage.get_bet(chat_id, bet_id)
     if not bet:
-        await query.answer("Ставка не найдена.", show_alert=True)
+        await _answer(context, query, "Ставка не найдена.", show_alert=True)
         return
     if bet["user_id"] != user_id:
-        await query.answer("Можно закрывать только свои ставки.", show_alert=True)
+        await _answer(context, query, "Можно закрывать только свои ставки.", show_alert=True)
         return
     if bet.get("status") != "active":
-        await query.answer("Эта ставка уже закрыта.", show_alert=True)
+        await _answer(context, query, "Эта ставка уже закрыта.", show_alert=True)
         return
     username = (query.from_user.username or "") if query.from_user else ""
-    storage.settle_bet(chat_id, bet_id, won, settled_by_user_id=user_id, settled_by_username=username)
+    # Два быстрых нажатия на одну кнопку: закроет только первое
+    if not await astorage.settle_bet(chat_id, bet_id, won, settled_by_user_id=user_id, settled_by_username=username):
+        await _answer(context, query, "Эта ставка уже закрыта.", show_alert=True)
+        return
     payout = int(bet["sum"] * bet["rate"]) if won else 0
-    new_balance = storage.get_balance(chat_id, user_id)
+    new_balance = await astorage.get_balance(chat_id, user_id)
     if won:
-        await query.answer(f"Ставка #{bet_id} сыграла! +{payout:,} ₽. Баланс: {new_balance:,} ₽")
+        await _answer(context, query, f"Ставка #{bet_id} сыграла! +{payout:,} ₽. Баланс: {new_balance:,} ₽")
     else:
-        await query.answer(f"Ставка #{bet_id} не сыграла. Баланс: {new_balance:,} ₽")
-    text, keyboard = _format_bets_message(chat_id, user_id)
-    await query.edit_message_text(text, reply_markup=keyboard)
+        await _answer(context, query, f"Ставка #{bet_id} не сыграла. Баланс: {new_balance:,} ₽")
+    bets, has_older, has_newer = await astorage.get_user_bets_page(chat_id, user_id, before, limit=BETS_PAGE)
+    if bets:
+        await _edit_if_changed(context, query, *_format_bets_message(bets, has_older, has_newer, user_id))
+
+
+def _wins(n: int) -> str:
+    return f"{n} {_plural(n, 'победа', 'победы', 'побед')}"
+
+
+def _plural(n: int, one: str, few: str, many: str) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+def _format_stats(st: dict) -> list[str]:
+    """Общие строки /stats и /chatstats."""
+    lines = [f"Ставок: {st['bets']} на {st['staked']:,} ₽, закрыто {st['settled']}"]
+    if st["settled"]:
+        lines.append(f"Сыграло: {st['won']} из {st['settled']} ({st['win_rate']}%)")
+        lines.append(f"Выплаты: {st['returned']:,} ₽, итог: {st['profit']:+,} ₽ (ROI {st['roi']:+}%)")
+    return lines
+
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Статистика участника за текущий раунд (счётчики обновляются при каждой ставке, см. storage/stats.py)."""
+    chat_id = update.effective_chat.id
+    st = await astorage.get_user_stats(chat_id, update.effective_user.id)
+    current = await astorage.get_round(chat_id)
+    if not st["bets"] and not st["settled"]:
+        await _reply(update, context, f"В раунде {current} у тебя ещё нет ставок.")
+        return
+    lines = [f"📈 Твоя статистика за раунд {current}:\n"] + _format_stats(st)
+    if st["best_win"]:
+        lines.append(f"Лучший выигрыш: +{st['best_win']:,} ₽")
+    if st["streak"] > 0:
+        lines.append(f"Сейчас: {_wins(st['streak'])} подряд")
+    elif st["streak"] < 0:
+        lines.append(f"Сейчас: {-st['streak']} {_plural(-st['streak'], 'поражение', 'поражения', 'поражений')} подряд")
+    if st["best_streak"]:
+        lines.append(f"Лучшая серия: {_wins(st['best_streak'])} подряд")
+    await _reply(update, context, "\n".join(lines))
+
+
+async def cmd_chatstats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Статистика всего чата за текущий раунд."""
+    chat_id = update.effective_chat.id
+    st = await astorage.get_chat_stats(chat_id)
+    current = await astorage.get_round(chat_id)
+    if not st["bets"] and not st["settled"]:
+        await _reply(update, context, f"В раунде {current} ставок ещё не было.")
+        return
+    lines = [f"📊 Статистика чата за раунд {current}:\n"] + _format_stats(st)
+    if st["best_win"]:
+        name = f"@{st['best_win_username']}" if st["best_win_username"] else f"ID{st['best_win_user']}"
+        lines.append(f"🏆 Лучший выигрыш: +{st['best_win']:,} ₽ — {name}")
+    if st["best_streak"]:
+        name = f"@{st['best_streak_username']}" if st["best_streak_username"] else f"ID{st['best_streak_user']}"
+        lines.append(f"🔥 Лучшая серия: {_wins(st['best_streak'])} подряд — {name}")
+    await _reply(update, context, "\n".join(lines))
+
+
+async def cmd_perf(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Самые медленные места бота (только для ADMIN_IDS)."""
+    if update.effective_user.id not in ADMIN_IDS:
+        await _reply(update, context, "Команда доступна только админам бота.")
+        return
+    if not metrics.METRICS_ENABLED:
+        await _reply(update, context, "Метрики выключены (METRICS=0).")
+        return
+    lines = ["⏱ Самые медленные места (p99):\n"]
+    for kind, name, hist in metrics.slowest(10):
+        lines.append(
+            f"{kind}/{name}: {hist.count} выз., p50 {hist.quantile(0.5) * 1000:.1f} мс, "
+            f"p99 {hist.quantile(0.99) * 1000:.1f} мс, макс {hist.max * 1000:.1f} мс"
+            + (f", ошибок {hist.errors}" if hist.errors else "")
+        )
+    if len(lines) == 1:
+        lines.append("Пока нет данных.")
+    lines.append("\nДиск и JSON:")
+    for kind, (ops, nbytes, seconds) in metrics.io_stats().items():
+        lines.append(f"{kind}: {ops} оп., {nbytes / 1024:.0f} КБ, {seconds * 1000:.0f} мс")
+    outbox = sender.get_outbox(context.bot)
+    st = outbox.stats
+    lines.append(
+        f"\nОчередь отправки: ждут {outbox.pending}, отправлено {st['sent']}, "
+        f"повторов после 429 {st['retried']}, склеено правок {st['coalesced']}, "
+        f"просрочено ответов {st['dropped']}, ошибок {st['failed']}"
+    )
+    await _reply(update, context, "\n".join(lines))
+
+
+async def on_startup(app: Application) -> None:
+    """Подготовить хранилище: загрузить данные, запустить фоновую запись на диск."""
+    await astorage.start()
+    if metrics.METRICS_ENABLED:
+        metrics.start_exporter()
+
+
+async def on_stop(app: Application) -> None:
+    """Отправить то, что ещё стоит в очереди, пока HTTP-клиент бота не закрыт."""
+    await sender.close_outboxes()
+
+
+async def on_shutdown(app: Application) -> None:
+    """Дописать на диск всё, что ещё не сохранено."""
+    await astorage.close()
+    metrics.stop_exporter()
 
 
 def main() -> None:
     token = get_token()
-    app = Application.builder().token(token).build()
+    if cluster.BOT_WORKERS > 1 and cluster.WORKER_INDEX is None:
+        # Этот процесс — фронт: сам апдейты не обрабатывает, а раздаёт воркерам (см. cluster.py)
+        cluster.run(token, BOT_MODE, allowed_updates=Update.ALL_TYPES)
+        return
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if metrics.METRICS_ENABLED:
+        # Тот же пул соединений, что ставит PTB по умолчанию, плюс замер каждого запроса к Bot API
+        builder = builder.request(metrics.InstrumentedRequest(connection_pool_size=256))
+    app = builder.build()
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CommandHandler("balance", cmd_balance))
@@ -307,8 +728,22 @@ def main() -> None:
     app.add_handler(CommandHandler("active", cmd_active))
     app.add_handler(CommandHandler("top", cmd_top))
     app.add_handler(CommandHandler("results", cmd_results))
-    app.add_handler(CallbackQueryHandler(results_confirm_callback, pattern="^results_(yes|no)_-?\\d+$"))
-    app.add_handler(CallbackQueryHandler(settle_bet_callback, pattern="^settle_\\d+_(win|lost)$"))
+    app.add_handler(CommandHandler("history", cmd_history))
+    app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("chatstats", cmd_chatstats))
+    app.add_handler(CommandHandler("find", cmd_find))
+    app.add_handler(CallbackQueryHandler(results_confirm_callback, pattern="^results_(yes|no)_-?\\d+(_\\d+)?$"))
+    app.add_handler(CallbackQueryHandler(settle_bet_callback, pattern="^settle_\\d+_(win|lost)(_\\d+)?$"))
+    app.add_handler(CallbackQueryHandler(bets_page_callback, pattern="^bets_\\d+_[ab]\\d+$"))
+    app.add_handler(CallbackQueryHandler(active_page_callback, pattern="^active_[ab]\\d+$"))
+    app.add_handler(CallbackQueryHandler(find_page_callback, pattern="^find_[ab]\\d+$"))
+    app.add_handler(CommandHandler("perf", cmd_perf))
+    if metrics.METRICS_ENABLED:
+        metrics.instrument_storage()
+        metrics.instrument_application(app)
+    if BOT_MODE == "webhook":
+        webhook.run_application(app, allowed_updates=Update.ALL_TYPES)
+        return
     print("Bot running. Press Ctrl+C to stop.")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""Several bot processes: a front process routes updates by chat to BOT_WORKERS workers.
+
+Один процесс — одно ядро. С BOT_WORKERS=N (N > 1) `python bot.py` становится
+фронтом: сам получает апдейты (polling или webhook, как задано BOT_MODE),
+ничего не обрабатывает и пересылает каждый апдейт одному из N процессов-
+воркеров. Воркер — обычный бот в режиме webhook на 127.0.0.1:CLUSTER_PORT+i
+(см. webhook.py), фронт запускает и перезапускает их сам.
+
+Чат всегда попадает к одному и тому же воркеру, поэтому воркер — единственный
+владелец данных своих чатов и никакой блокировки между процессами не нужно.
+Владелец выбирается rendezvous-хешированием: воркер с наибольшим
+blake2b(chat_id, i). При смене N переезжает только около 1/N чатов, и
+каждый раз одни и те же. Менять N — только перезапуском фронта: все
+воркеры останавливаются (сохраняя данные на диск) раньше, чем новые
+начнут читать чаты.
+
+Воркеру очередь на CLUSTER_QUEUE_SIZE апдейтов. Когда она полна, фронт
+ждёт и перестаёт забирать апдейты у Telegram. Раз в CLUSTER_HEALTH_INTERVAL
+секунд фронт спрашивает у каждого воркера /healthz. Упавший или
+CLUSTER_HEALTH_FAILURES раз подряд не ответивший воркер перезапускается;
+его апдейты ждут в очереди.
+
+У каждого воркера свой лог закрытий (settlements-w<i>.jsonl), свой файл
+метрик (metrics-w<i>.prom) и 1/N от SEND_GLOBAL_RATE.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import sys
+import time
+from pathlib import Path
+
+import storage
+import webhook
+
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+# Номер воркера; задаёт фронт, у самого фронта и у одиночного бота его нет
+WORKER_INDEX = os.environ.get("BOT_WORKER_INDEX")
+CLUSTER_PORT = int(os.environ.get("CLUSTER_PORT", "8100"))
+CLUSTER_QUEUE_SIZE = int(os.environ.get("CLUSTER_QUEUE_SIZE", "1000"))
+CLUSTER_HEALTH_INTERVAL = float(os.environ.get("CLUSTER_HEALTH_INTERVAL", "5"))
+CLUSTER_HEALTH_FAILURES = int(os.environ.get("CLUSTER_HEALTH_FAILURES", "3"))
+# Сколько ждать, пока только что запущенный воркер начнёт отвечать
+CLUSTER_START_TIMEOUT = float(os.environ.get("CLUSTER_START_TIMEOUT", "60"))
+
+WORKER_PATH = "/update"
+# Соединений от фронта к каждому воркеру (апдейты одного воркера идут параллельно)
+CONNECTIONS_PER_WORKER = 4
+RECONNECT_DELAY = 0.5
+MAX_RESTART_DELAY = 30
+STOP_TIMEOUT = 30
+
+BOT_SCRIPT = Path(__file__).resolve().parent / "bot.py"
+
+
+def owner(key: int, workers: int) -> int:
+    """Worker that owns a chat: rendezvous hashing, stable across processes and restarts."""
+    best, best_weight = 0, b""
+    for i in range(workers):
+        weight = hashlib.blake2b(f"{key}:{i}".encode(), digest_size=8).digest()
+        if weight > best_weight:
+            best, best_weight = i, weight
+    return best
+
+
+def chat_key(update: dict) -> int:
+    """chat_id the update belongs to (user id for updates without a chat, 0 if neither)."""
+    for name, value in update.items():
+        if not isinstance(value, dict):
+            continue
+        # message, edited_message, my_chat_member... — у них chat; у callback_query — message.chat
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+    return 0
+
+
+def worker_env(index: int, workers: int, port: int, secret: str) -> dict:
+    """Environment of worker process index: webhook mode on localhost plus per-worker file names."""
+    env = dict(os.environ)
+    env.update(
+        BOT_MODE="webhook",
+        BOT_WORKER_INDEX=str(index),
+        WEBHOOK_URL="",  # регистрирует webhook в Telegram только фронт
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_PATH=WORKER_PATH,
+        WEBHOOK_SECRET=secret,
+        SETTLE_LOG_PREFIX=f"{env.get('SETTLE_LOG_PREFIX', 'settlements')}-w{index}",
+    )
+    env.pop("PORT", None)
+    # Лимит Telegram на весь бот делится между воркерами
+    global_rate = float(env.get("SEND_GLOBAL_RATE", "30"))
+    env["SEND_GLOBAL_RATE"] = str(global_rate / workers)
+    if env.get("METRICS_FILE"):
+        path = Path(env["METRICS_FILE"])
+        env["METRICS_FILE"] = str(path.with_name(f"{path.stem}-w{index}{path.suffix}"))
+    return env
+
+
+async def _http(port: int, method: str, path: str, body: bytes = b"", headers: dict | None = None,
+                conn: tuple | None = None) -> tuple[int, dict, tuple | None]:
+    """One HTTP/1.1 request to 127.0.0.1:port over conn (reader, writer) or a new connection.
+
+    Возвращает (status, headers, conn); conn — None, если сервер закрыл соединение.
+    """
+    if conn is None:
+        conn = await asyncio.open_connection("127.0.0.1", port)
+    reader, writer = conn
+    head = [f"{method} {path} HTTP/1.1", "Host: 127.0.0.1", f"Content-Length: {len(body)}"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    response_headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(response_headers.get("content-length") or 0))
+    if response_headers.get("connection", "").lower() == "close":
+        writer.close()
+        conn = None
+    return status, response_headers, conn
+
+
+class WorkerLink:
+    """Front side of one worker: its process, the queue of its updates and the connections to it."""
+
+    def __init__(self, index: int, workers: int, port: int, queue_size: int = CLUSTER_QUEUE_SIZE):
+        self.index = index
+        self.workers = workers
+        self.port = port
+        self.secret = secrets.token_hex(16)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.process: asyncio.subprocess.Process | None = None
+        self.healthy = False
+        self.restarts = 0
+        self.stats = {"forwarded": 0, "retried": 0, "dropped": 0}
+        self._started_at = 0.0
+        self._stopping = False
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        await self._spawn()
+        self._tasks = [asyncio.create_task(self._forward(), name=f"cluster-forward-{self.index}-{i}")
+                       for i in range(CONNECTIONS_PER_WORKER)]
+        self._tasks.append(asyncio.create_task(self._monitor(), name=f"cluster-monitor-{self.index}"))
+
+    async def _spawn(self) -> None:
+        env = worker_env(self.index, self.workers, self.port, self.secret)
+        self.process = await asyncio.create_subprocess_exec(sys.executable, str(BOT_SCRIPT), env=env)
+        self._started_at = time.monotonic()
+        self.healthy = False
+        print(f"cluster: worker {self.index} started (pid {self.process.pid}, port {self.port})")
+
+    async def _forward(self) -> None:
+        conn = None
+        headers = {"Content-Type": "application/json", webhook.SECRET_HEADER: self.secret}
+        while True:
+            update = await self.queue.get()
+            body = json.dumps(update).encode("utf-8")
+            try:
+                while True:  # пока воркер не примет апдейт
+                    try:
+                        status, response_headers, conn = await _http(self.port, "POST", WORKER_PATH, body, headers, conn)
+                    except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                        # Воркер перезапускается или закрыл простаивающее соединение — пробуем снова
+                        if conn is not None:
+                            conn[1].close()
+                        conn = None
+                        self.stats["retried"] += 1
+                        await asyncio.sleep(RECONNECT_DELAY)
+                        continue
+                    if status == 503:  # очередь воркера полна — ждём, как ждал бы Telegram
+                        self.stats["retried"] += 1
+                        await asyncio.sleep(float(response_headers.get("retry-after") or 1))
+                        continue
+                    if status == 200:
+                        self.stats["forwarded"] += 1
+                    else:
+                        self.stats["dropped"] += 1
+                        print(f"cluster: worker {self.index} rejected update {update.get('update_id')}: HTTP {status}")
+                    break
+            finally:
+                self.queue.task_done()
+
+    async def check(self) -> bool:
+        """GET /healthz on the worker."""
+        try:
+            status, _, conn = await asyncio.wait_for(
+                _http(self.port, "GET", "/healthz", headers={"Connection": "close"}), CLUSTER_HEALTH_INTERVAL
+            )
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return False
+        if conn is not None:
+            conn[1].close()
+        return status == 200
+
+    async def _monitor(self) -> None:
+        failures = 0
+        delay = 1
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(asyncio.shield(self.process.wait()), CLUSTER_HEALTH_INTERVAL)
+                reason = f"exited with code {self.process.returncode}"
+            except asyncio.TimeoutError:
+                if await self.check():
+                    self.healthy, failures, delay = True, 0, 1
+                    continue
+                if not self.healthy and time.monotonic() - self._started_at < CLUSTER_START_TIMEOUT:
+                    continue  # ещё запускается
+                self.healthy = False
+                failures += 1
+                if failures < CLUSTER_HEALTH_FAILURES:
+                    continue
+                reason = f"did not answer /healthz {failures} times"
+                self.process.kill()
+                await self.process.wait()
+            if self._stopping:
+                return
+            self.healthy = False
+            self.restarts += 1
+            print(f"cluster: worker {self.index} {reason}, restarting in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+            failures = 0
+            await self._spawn()
+
+    async def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Hand over queued updates, then SIGTERM the worker (it finishes its own queue and saves data)."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"cluster: worker {self.index}: {self.queue.qsize()} updates not delivered")
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+    def health(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "pid": self.process.pid if self.process else None,
+            "queued": self.queue.qsize(),
+            "restarts": self.restarts,
+            **self.stats,
+        }
+
+
+class Cluster:
+    """The front: WorkerLink per worker and routing of updates to them."""
+
+    def __init__(self, workers: int = BOT_WORKERS, port: int = CLUSTER_PORT, queue_size: int = CLUSTER_QUEUE_SIZE):
+        self.links = [WorkerLink(i, workers, port + i, queue_size) for i in range(workers)]
+
+    async def start(self) -> None:
+        for link in self.links:
+            await link.start()
+
+    async def route(self, update: dict) -> None:
+        """Queue the update for the chat's worker; waits while that worker's queue is full."""
+        await self.links[owner(chat_key(update), len(self.links))].queue.put(update)
+
+    def health(self) -> dict:
+        return {"workers": [link.health() for link in self.links]}
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(link.stop() for link in self.links))
+
+
+def _prepare_storage() -> None:
+    """Run one-time storage work (legacy migration, schema) before workers open it concurrently."""
+    backend = storage.get_backend()
+    backend.start()
+    backend.close()
+
+
+async def _poll(cluster: Cluster, token: str, allowed_updates) -> None:
+    from telegram import Bot
+    from telegram.error import TelegramError
+
+    stop = asyncio.create_task(webhook.wait_for_stop_signal())
+    async with Bot(token) as bot:
+        await bot.delete_webhook()
+        print(f"Bot running with {len(cluster.links)} workers. Press Ctrl+C to stop.")
+        offset = None
+        while not stop.done():
+            poll = asyncio.create_task(bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates))
+            await asyncio.wait({poll, stop}, return_when=asyncio.FIRST_COMPLETED)
+            if not poll.done():
+                poll.cancel()  # неподтверждённые апдейты Telegram отдаст при следующем запуске
+                break
+            try:
+                updates = poll.result()
+            except TelegramError as e:
+                print(f"cluster: getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await cluster.route(update.to_dict())
+                offset = update.update_id + 1
+        if offset is not None:
+            # Подтверждаем последние разобранные апдейты, не дожидаясь новых
+            await bot.get_updates(offset=offset, timeout=0)
+
+
+async def _serve_webhook(cluster: Cluster, token: str, allowed_updates) -> None:
+    from telegram import Bot
+
+    secret = webhook.server_secret()
+    server = webhook.WebhookServer(cluster.route, secret=secret, health=cluster.health)
+    await server.start()
+    try:
+        async with Bot(token) as bot:
+            if webhook.WEBHOOK_URL:
+                await bot.set_webhook(webhook.WEBHOOK_URL, secret_token=secret, allowed_updates=allowed_updates)
+            else:
+                print("WEBHOOK_URL is not set: webhook is not registered in Telegram, only local POSTs will arrive")
+        print(f"Bot running in webhook mode with {len(cluster.links)} workers. Press Ctrl+C to stop.")
+        await webhook.wait_for_stop_signal()
+    finally:
+        await server.stop()
+
+
+async def _run(token: str, mode: str, allowed_updates) -> None:
+    _prepare_storage()
+    cluster = Cluster()
+    await cluster.start()
+    try:
+        if mode == "webhook":
+            await _serve_webhook(cluster, token, allowed_updates)
+        else:
+            await _poll(cluster, token, allowed_updates)
+    finally:
+        await cluster.stop()
+
+
+def run(token: str, mode: str, allowed_updates=None) -> None:
+    """Run the front process until SIGINT/SIGTERM: receive updates and route them to BOT_WORKERS workers."""
+    try:
+        asyncio.run(_run(token, mode, allowed_updates))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""Low-overhead metrics: call counts, latency histograms and errors per handler, storage function and Bot API method.
+
+Обёртки замеряют каждый вызов (два perf_counter и инкремент под lock'ом),
+так что их можно не выключать в продакшене. Работа с диском считается в
+storage.journal.IO_STATS. Всё вместе раз в METRICS_INTERVAL секунд
+пишется в METRICS_FILE в текстовом формате Prometheus (для node_exporter
+textfile collector или просто cat), а админам показывается в /perf.
+"""
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from telegram.request import HTTPXRequest
+
+import storage
+from storage.journal import io_stats, write_atomic
+
+METRICS_ENABLED = os.environ.get("METRICS", "1") != "0"
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+METRICS_INTERVAL = float(os.environ.get("METRICS_INTERVAL", "15"))
+
+# Верхние границы корзин гистограммы, секунды; последняя корзина — всё, что больше
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Публичные функции storage, которые оборачиваются instrument_storage()
+STORAGE_FUNCTIONS = (
+    "get_user",
+    "update_balance",
+    "get_balance",
+    "create_bet",
+    "get_user_bets",
+    "get_user_bets_page",
+    "get_bet",
+    "settle_bet",
+    "get_all_users_balances",
+    "get_top_balances",
+    "get_rank",
+    "get_leaderboard_version",
+    "get_all_active_bets",
+    "get_active_bets_page",
+    "find_bets",
+    "reset_all_balances_to_initial",
+    "get_round",
+    "get_rounds",
+    "get_round_standings",
+    "get_archived_bets",
+    "get_user_stats",
+    "get_chat_stats",
+    "rebuild_stats",
+    "start",
+    "flush",
+    "close",
+)
+
+
+class Histogram:
+    """Latency distribution of one code path."""
+
+    __slots__ = ("buckets", "count", "total", "max", "errors")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate (upper bound of the bucket holding the q-th call, at most max)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+_lock = threading.Lock()
+# (вид, имя) -> Histogram; вид: handler, storage, telegram, outbox (ожидание в очереди sender.py)
+# или outbox_send (от постановки в очередь до ответа Bot API, с повторами после 429)
+_histograms: dict[tuple[str, str], Histogram] = {}
+
+
+def observe(kind: str, name: str, seconds: float, error: bool = False) -> None:
+    key = (kind, name)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = Histogram()
+        hist.observe(seconds, error)
+
+
+def timed(kind: str, name: str, fn):
+    """Wrap a sync or async function so every call is recorded under (kind, name)."""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                result = await fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(kind, name, time.perf_counter() - start, error)
+    else:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            error = True
+            try:
+                result = fn(*args, **kwargs)
+                error = False
+                return result
+            finally:
+                observe(kind, name, time.perf_counter() - start, error)
+    wrapper._metrics = True
+    return wrapper
+
+
+def instrument_storage() -> None:
+    """Replace public storage functions with timed wrappers (storage.aio looks them up by name)."""
+    for name in STORAGE_FUNCTIONS:
+        fn = getattr(storage, name)
+        if not getattr(fn, "_metrics", False):
+            setattr(storage, name, timed("storage", name, fn))
+
+
+def instrument_application(app) -> None:
+    """Time the callback of every handler already added to the application."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, "_metrics", False):
+                handler.callback = timed("handler", handler.callback.__name__, handler.callback)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API round trip under its method name (sendMessage, ...)."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        start = time.perf_counter()
+        error = True
+        try:
+            result = await super().do_request(url, method, *args, **kwargs)
+            error = False
+            return result
+        finally:
+            observe("telegram", url.rsplit("/", 1)[-1], time.perf_counter() - start, error)
+
+
+def snapshot() -> list[tuple[str, str, Histogram]]:
+    """Copies of all histograms, so they can be read without holding the lock."""
+    out = []
+    with _lock:
+        for (kind, name), hist in _histograms.items():
+            copy = Histogram()
+            copy.buckets = list(hist.buckets)
+            copy.count, copy.total, copy.max, copy.errors = hist.count, hist.total, hist.max, hist.errors
+            out.append((kind, name, copy))
+    return sorted(out, key=lambda item: item[:2])
+
+
+def slowest(limit: int = 10) -> list[tuple[str, str, Histogram]]:
+    """Code paths with the worst p99, slowest first."""
+    return sorted(snapshot(), key=lambda item: item[2].quantile(0.99), reverse=True)[:limit]
+
+
+# Семейства гистограмм в render(): вид, имя метрики, метка, описание, есть ли ошибки
+FAMILIES = (
+    ("handler", "betbot_handler", "name", "Latency of handler calls.", True),
+    ("storage", "betbot_storage", "name", "Latency of storage calls.", True),
+    ("telegram", "betbot_telegram", "name", "Latency of telegram calls.", True),
+    ("outbox", "betbot_outbox_wait", "lane", "Time outgoing calls waited in the send queue.", False),
+    ("outbox_send", "betbot_outbox_send", "lane", "Time from queueing an outgoing call to its result.", True),
+)
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format."""
+    lines = []
+    histograms = snapshot()
+    for kind, prefix, label, help_text, with_errors in FAMILIES:
+        rows = [(name, hist) for k, name, hist in histograms if k == kind]
+        if not rows:
+            continue
+        metric = f"{prefix}_seconds"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        for name, hist in rows:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), hist.buckets):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label}="{name}"}} {hist.total:.6f}')
+            lines.append(f'{metric}_count{{{label}="{name}"}} {hist.count}')
+        if with_errors:
+            lines += [f"# HELP {prefix}_errors_total Calls that failed.", f"# TYPE {prefix}_errors_total counter"]
+            lines += [f'{prefix}_errors_total{{{label}="{name}"}} {hist.errors}' for name, hist in rows]
+    io = io_stats()
+    for i, (suffix, help_text) in enumerate((
+        ("ops_total", "Disk and JSON operations."),
+        ("bytes_total", "Bytes read, written, parsed or serialized."),
+        ("seconds_total", "Time spent in these operations."),
+    )):
+        metric = f"betbot_io_{suffix}"
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{kind="{kind}"}} {stat[i]:g}' for kind, stat in io.items()]
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path: Path) -> None:
+    write_atomic(Path(path), render().encode("utf-8"), fsync=False)
+
+
+_stop = threading.Event()
+_exporter: threading.Thread | None = None
+_export_path: Path | None = None
+
+
+def _export_loop(path: Path, interval: float) -> None:
+    while not _stop.wait(interval):
+        try:
+            write_file(path)
+        except OSError as e:
+            print(f"metrics: can't write {path}: {e}")
+
+
+def start_exporter(path: str | Path | None = None, interval: float | None = None) -> None:
+    """Write the metrics file every interval seconds in a background thread (no-op without a path)."""
+    global _exporter, _export_path
+    path = path or METRICS_FILE
+    if not path or _exporter is not None:
+        return
+    _stop.clear()
+    _export_path = Path(path)
+    _exporter = threading.Thread(
+        target=_export_loop, args=(_export_path, interval or METRICS_INTERVAL), name="metrics-export", daemon=True
+    )
+    _exporter.start()
+
+
+def stop_exporter() -> None:
+    """Stop the export thread and write the file one last time."""
+    global _exporter
+    if _exporter is None:
+        return
+    _stop.set()
+    _exporter.join()
+    _exporter = None
+    try:
+        write_file(_export_path)
+    except OSError as e:
+        print(f"metrics: can't write {_export_path}: {e}")
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""Outgoing Bot API calls through one queue that stays within Telegram flood limits.
+
+Telegram пропускает от бота около 30 сообщений в секунду на всех и около
+одного в секунду (20 в минуту в группе) в один чат; сверх этого отвечает
+429 с retry_after. В финале матча все разом жмут «Сыграло» и зовут /top —
+без очереди бот ловит 429 и встаёт. Поэтому ответы на кнопки, правки и
+новые сообщения бот отправляет через Outbox:
+
+* два лимита: общий (SEND_GLOBAL_RATE в секунду) и свой у каждого чата
+  (SEND_CHAT_RATE в секунду), оба в скользящем окне, как у Telegram: даже
+  после паузы за любую секунду уходит не больше заданного;
+* три полосы по приоритету: ответы на нажатия кнопок (на них у Telegram
+  всего несколько секунд), правки сообщений, новые сообщения. Чат,
+  упёршийся в свой лимит, не задерживает остальные чаты;
+* 429 — не ошибка: чат (или вся отправка) ждёт retry_after, а вызов
+  встаёт в начало своей полосы;
+* несколько правок одного сообщения в очереди схлопываются в одну — уходит
+  только последнее состояние, а ждавшие получают её результат.
+
+В очереди не больше SEND_MAX_PENDING сообщений и правок: дальше хендлеры
+ждут места, и нагрузка упирается в очередь апдейтов, а не в таймауты.
+"""
+import asyncio
+import os
+from collections import deque
+from datetime import timedelta
+
+from telegram import ReplyParameters
+from telegram.error import BadRequest, RetryAfter
+
+import metrics
+
+SEND_GLOBAL_RATE = float(os.environ.get("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.environ.get("SEND_CHAT_RATE", "1"))
+SEND_MAX_PENDING = int(os.environ.get("SEND_MAX_PENDING", "1000"))
+# Сколько вызовов Bot API может идти одновременно
+SEND_CONCURRENCY = int(os.environ.get("SEND_CONCURRENCY", "16"))
+
+# Ответ на нажатие старше этого Telegram уже не примет — выбрасываем его из очереди
+ANSWER_TTL = 10.0
+MAX_RETRIES = 5
+# Ведра чатов, которые давно полны, забываем, когда их больше этого
+MAX_BUCKETS = 4096
+
+ANSWER, EDIT, SEND = 0, 1, 2
+LANE_NAMES = ("answer", "edit", "send")
+
+
+class RateLimit:
+    """At most rate calls per second (0 — no limit), counted over a sliding window.
+
+    Как и Telegram, считаем вызовы в скользящем окне: не больше limit за
+    window секунд, где limit — целая часть темпа (не меньше одного), а
+    window = limit / rate (темп 0.33 — один вызов в три секунды). Вызов
+    занимает место в окне с отправки до того, как пройдёт window после его
+    ответа: Telegram засчитывает сообщение где-то между ними, так что
+    задержки сети и цикла событий не сдвигают серию за лимит.
+
+    После 429 окно замирает на retry_after и вдвое сбавляет темп (не ниже
+    восьмой части заданного), а каждая удачная отправка понемногу его
+    возвращает: настоящий лимит Telegram бывает ниже того, что мы задали.
+    """
+
+    __slots__ = ("base_rate", "rate", "limit", "window", "inflight", "finished", "blocked_until")
+
+    def __init__(self, rate: float):
+        self.base_rate = rate
+        self.inflight = 0
+        self.finished: deque = deque()  # когда закончились последние вызовы, по порядку
+        self.blocked_until = 0.0
+        self._set_rate(rate)
+
+    def _set_rate(self, rate: float) -> None:
+        self.rate = rate
+        self.limit = max(1, int(rate))
+        self.window = self.limit / rate if rate else 0.0
+
+    def _expire(self, now: float) -> None:
+        while self.finished and (now - self.finished[0] >= self.window or len(self.finished) > self.limit):
+            self.finished.popleft()
+
+    def delay(self, now: float) -> float:
+        """Seconds until a call may start (0 — right now, inf — when a running call finishes)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if not self.rate:
+            return 0.0
+        self._expire(now)
+        over = self.inflight + len(self.finished) - self.limit
+        if over < 0:
+            return 0.0
+        if over >= len(self.finished):
+            return float("inf")
+        return self.finished[over] + self.window - now
+
+    def take(self) -> None:
+        self.inflight += 1
+
+    def done(self, now: float) -> None:
+        """The call started by take() got its answer."""
+        self.inflight -= 1
+        if self.rate:
+            self.finished.append(now)
+
+    def block(self, until: float) -> None:
+        """Got a 429: wait until `until`, then go at half the pace."""
+        self.blocked_until = max(self.blocked_until, until)
+        self._set_rate(max(self.base_rate / 8, self.rate / 2))
+
+    def recover(self) -> None:
+        if self.rate < self.base_rate:
+            self._set_rate(min(self.base_rate, self.rate + self.base_rate / 16))
+
+    def idle(self, now: float) -> bool:
+        self._expire(now)
+        return now >= self.blocked_until and not self.inflight and not self.finished
+
+
+class _Job:
+    __slots__ = ("lane", "chat_id", "method", "kwargs", "key", "future", "created", "attempts", "detached")
+
+    def __init__(self, lane: int, chat_id, method: str, kwargs: dict, key, future: asyncio.Future, created: float):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.key = key  # (chat_id, message_id) у правок — по нему схлопываем
+        self.future = future
+        self.created = created
+        self.attempts = 0
+        self.detached = False  # никто не ждёт результат — ошибку только печатаем
+
+
+def _seconds(retry_after) -> float:
+    # В новых версиях PTB retry_after — timedelta
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class Outbox:
+    """Rate-limited, prioritized queue of Bot API calls for one bot."""
+
+    def __init__(
+        self,
+        bot,
+        global_rate: float = SEND_GLOBAL_RATE,
+        chat_rate: float = SEND_CHAT_RATE,
+        max_pending: int = SEND_MAX_PENDING,
+        concurrency: int = SEND_CONCURRENCY,
+    ):
+        self.bot = bot
+        self.loop = asyncio.get_running_loop()
+        self.chat_rate = chat_rate
+        self._global = RateLimit(global_rate)
+        self._buckets: dict[int, RateLimit] = {}
+        self._lanes: list[deque] = [deque(), deque(), deque()]
+        self._edits: dict[tuple, _Job] = {}  # правки, которые ещё ждут отправки
+        self._space = asyncio.Semaphore(max(1, max_pending))
+        self._inflight = asyncio.Semaphore(max(1, concurrency))
+        self._running: set[asyncio.Task] = set()
+        self._active = 0  # вызовы, которые ещё идут (и могут вернуться в очередь после 429)
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.stats = {"sent": 0, "retried": 0, "coalesced": 0, "dropped": 0, "failed": 0}
+
+    # --- что отправлять ---
+
+    # С wait=False вызов только ставится в очередь: возвращается future с его
+    # результатом, а ошибка, если её никто не заберёт, печатается. Так хендлер
+    # не держит слот concurrent_updates, пока его чат ждёт своего лимита.
+
+    async def answer(self, callback_query_id: str, text: str | None = None, show_alert: bool = False, wait: bool = True):
+        """answer_callback_query in the fastest lane; returns False if it waited past ANSWER_TTL."""
+        kwargs = {"callback_query_id": callback_query_id, "text": text, "show_alert": show_alert}
+        return await self._submit(ANSWER, None, "answer_callback_query", kwargs, wait=wait)
+
+    async def edit(self, chat_id: int, message_id: int, text: str, reply_markup=None, wait: bool = True):
+        """edit_message_text; a newer edit of the same message replaces a queued one."""
+        key = (chat_id, message_id)
+        pending = self._edits.get(key)
+        if pending is not None:
+            pending.kwargs.update(text=text, reply_markup=reply_markup)
+            self.stats["coalesced"] += 1
+            return await self._result(pending, wait)
+        kwargs = {"chat_id": chat_id, "message_id": message_id, "text": text, "reply_markup": reply_markup}
+        return await self._submit(EDIT, chat_id, "edit_message_text", kwargs, key, wait)
+
+    async def send(
+        self,
+        chat_id: int,
+        text: str,
+        reply_markup=None,
+        message_thread_id: int | None = None,
+        reply_to: int | None = None,
+        wait: bool = True,
+    ):
+        """send_message in the lowest lane; returns the sent Message.
+
+        message_thread_id — тема форума, reply_to — message_id сообщения, на
+        которое отвечаем (если его успели удалить, сообщение уйдёт без цитаты).
+        """
+        kwargs = {"chat_id": chat_id, "text": text, "reply_markup": reply_markup}
+        if message_thread_id is not None:
+            kwargs["message_thread_id"] = message_thread_id
+        if reply_to is not None:
+            kwargs["reply_parameters"] = ReplyParameters(reply_to, allow_sending_without_reply=True)
+        return await self._submit(SEND, chat_id, "send_message", kwargs, wait=wait)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    async def _submit(self, lane: int, chat_id, method: str, kwargs: dict, key=None, wait: bool = True):
+        if self._closing:
+            raise RuntimeError("outbox is closed")
+        if lane != ANSWER:  # ответы на кнопки мелкие и срочные — им место не нужно
+            await self._space.acquire()
+        job = _Job(lane, chat_id, method, kwargs, key, self.loop.create_future(), self.loop.time())
+        self._lanes[lane].append(job)
+        if key is not None:
+            self._edits[key] = job
+        if self._task is None:
+            self._task = self.loop.create_task(self._dispatch(), name="outbox")
+        self._wake.set()
+        return await self._result(job, wait)
+
+    async def _result(self, job: _Job, wait: bool):
+        if wait:
+            # Отмена хендлера не отменяет уже поставленную отправку
+            return await asyncio.shield(job.future)
+        if not job.detached:
+            job.detached = True
+            job.future.add_done_callback(lambda future: self._report(job, future))
+        return job.future
+
+    @staticmethod
+    def _report(job: _Job, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            print(f"sender: {job.method} to chat {job.chat_id} failed: {future.exception()!r}")
+
+    # --- разбор очереди ---
+
+    def _bucket(self, chat_id: int, now: float) -> RateLimit:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.idle(now)}
+            bucket = self._buckets[chat_id] = RateLimit(self.chat_rate)
+        return bucket
+
+    def _next_job(self, now: float) -> tuple[_Job | None, float]:
+        """The first job whose chat is under its limit, by lane priority; otherwise (None, seconds to wait)."""
+        wait = self._global.delay(now)
+        if wait:
+            return None, wait
+        wait = float("inf")
+        answers = self._lanes[ANSWER]
+        while answers and now - answers[0].created > ANSWER_TTL:
+            self._finish(answers.popleft(), result=False)
+            self.stats["dropped"] += 1
+        for lane in self._lanes:
+            for i, job in enumerate(lane):
+                delay = 0.0 if job.chat_id is None else self._bucket(job.chat_id, now).delay(now)
+                if not delay:
+                    del lane[i]
+                    return job, 0.0
+                wait = min(wait, delay)
+        return None, wait
+
+    async def _dispatch(self) -> None:
+        while True:
+            await self._inflight.acquire()
+            while True:
+                now = self.loop.time()
+                job, wait = self._next_job(now)
+                if job is not None or (self._closing and not self.pending and not self._active):
+                    break
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), None if wait == float("inf") else wait)
+                except asyncio.TimeoutError:
+                    pass
+            if job is None:
+                self._inflight.release()
+                return
+            self._global.take()
+            if job.chat_id is not None:
+                self._bucket(job.chat_id, now).take()
+            if job.key is not None and self._edits.get(job.key) is job:
+                del self._edits[job.key]  # следующая правка этого сообщения встанет в очередь заново
+            if metrics.METRICS_ENABLED:
+                metrics.observe("outbox", LANE_NAMES[job.lane], now - job.created)
+            self._active += 1
+            task = self.loop.create_task(self._call(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _call(self, job: _Job) -> None:
+        try:
+            result = await getattr(self.bot, job.method)(**job.kwargs)
+        except RetryAfter as e:
+            job.attempts += 1
+            until = self.loop.time() + _seconds(e.retry_after)
+            if job.chat_id is not None:
+                self._bucket(job.chat_id, self.loop.time()).block(until)
+            else:
+                self._global.block(until)
+            if job.attempts > MAX_RETRIES:
+                self._finish(job, error=e)
+            else:
+                self.stats["retried"] += 1
+                self._requeue(job)
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._finish(job, result=True)  # правка совпала с тем, что уже на экране
+            else:
+                self._finish(job, error=e)
+        except Exception as e:  # noqa: BLE001 — ошибку получит тот, кто ждёт отправку
+            self._finish(job, error=e)
+        else:
+            if job.chat_id is not None:
+                self._bucket(job.chat_id, self.loop.time()).recover()
+            self._global.recover()
+            self._finish(job, result=result)
+        finally:
+            now = self.loop.time()
+            self._global.done(now)
+            if job.chat_id is not None:
+                self._bucket(job.chat_id, now).done(now)
+            self._active -= 1
+            self._inflight.release()
+            self._wake.set()
+
+    def _requeue(self, job: _Job) -> None:
+        newer = self._edits.get(job.key) if job.key is not None else None
+        if newer is not None:
+            # Пока ждали, пришла новая правка этого сообщения — старое состояние слать незачем
+            newer.future.add_done_callback(lambda f: self._copy_result(f, job))
+            return
+        self._lanes[job.lane].appendleft(job)
+        if job.key is not None:
+            self._edits[job.key] = job
+
+    def _copy_result(self, source: asyncio.Future, job: _Job) -> None:
+        if source.cancelled() or source.exception() is None:
+            self._finish(job, result=None if source.cancelled() else source.result())
+        else:
+            self._finish(job, error=source.exception())
+
+    def _finish(self, job: _Job, result=None, error: BaseException | None = None) -> None:
+        if job.lane != ANSWER:
+            self._space.release()
+        if job.future.done():
+            return
+        if metrics.METRICS_ENABLED:
+            metrics.observe("outbox_send", LANE_NAMES[job.lane], self.loop.time() - job.created, error is not None)
+        if error is not None:
+            self.stats["failed"] += 1
+            job.future.set_exception(error)
+        else:
+            if result is not False or job.lane != ANSWER:
+                self.stats["sent"] += 1
+            job.future.set_result(result)
+
+    async def close(self, timeout: float | None = 10.0) -> None:
+        """Send what is queued (at most timeout seconds, None — all of it), then stop."""
+        self._closing = True
+        self._wake.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            for lane in self._lanes:
+                while lane:
+                    self._finish(lane.popleft(), error=RuntimeError("outbox closed before sending"))
+
+
+# id(bot) -> Outbox; у бота PTB __slots__, поэтому не атрибутом
+_outboxes: dict[int, Outbox] = {}
+
+
+def get_outbox(bot, **options) -> Outbox:
+    """The Outbox of this bot in the running event loop; options go to Outbox() when it is created."""
+    outbox = _outboxes.get(id(bot))
+    if outbox is None or outbox.bot is not bot or outbox.loop is not asyncio.get_running_loop() or outbox._closing:
+        outbox = _outboxes[id(bot)] = Outbox(bot, **options)
+    return outbox
+
+
+async def close_outboxes(timeout: float | None = 10.0) -> None:
+    """Flush (at most timeout seconds each, None — until sent) and stop every Outbox.
+
+    Call before the bot's HTTP client is shut down.
+    """
+    outboxes = list(_outboxes.values())
+    _outboxes.clear()
+    for outbox in outboxes:
+        if outbox.loop is asyncio.get_running_loop():
+            await outbox.close(timeout)
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Storage for users and bets.
+
+bot.py зовёт функции этого модуля, а они передают вызов выбранному бэкенду:
+STORAGE_BACKEND=json (по умолчанию, файлы по чатам в data/chats/) или
+STORAGE_BACKEND=sqlite (data/bot.sqlite3). Перенести данные из JSON в SQLite:
+    python -m storage.migrate
+"""
+import os
+import threading
+
+from .base import DATA_DIR, INITIAL_BALANCE, StorageBackend
+from .json_backend import JsonStorage
+
+BACKENDS = ("json", "sqlite")
+
+_backend: StorageBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str, data_dir=DATA_DIR) -> StorageBackend:
+    """Build a backend by its STORAGE_BACKEND name."""
+    if name == "json":
+        return JsonStorage(data_dir)
+    if name == "sqlite":
+        from .sqlite_backend import SqliteStorage
+
+        return SqliteStorage(data_dir, os.environ.get("SQLITE_PATH") or None)
+    raise ValueError(f"Unknown STORAGE_BACKEND={name!r}, expected one of: {', '.join(BACKENDS)}")
+
+
+def get_backend() -> StorageBackend:
+    """The backend all functions below talk to (created from STORAGE_BACKEND on first use)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(os.environ.get("STORAGE_BACKEND", "json").strip().lower())
+    return _backend
+
+
+def set_backend(backend: StorageBackend) -> None:
+    """Use another backend from now on (migrations, benchmarks)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def start():
+    """Load data and start background work of the backend."""
+    get_backend().start()
+
+
+def flush():
+    get_backend().flush()
+
+
+def close():
+    """Write everything that is still pending and release files."""
+    get_backend().close()
+
+
+def get_user(chat_id: int, user_id: int, username: str = "") -> dict:
+    """Get or create user with initial balance for a specific chat."""
+    return get_backend().get_user(chat_id, user_id, username)
+
+
+def update_balance(chat_id: int, user_id: int, delta: int) -> int:
+    """Update balance by delta (positive or negative) for a specific chat. Returns new balance."""
+    return get_backend().update_balance(chat_id, user_id, delta)
+
+
+def get_balance(chat_id: int, user_id: int) -> int:
+    return get_backend().get_balance(chat_id, user_id)
+
+
+def create_bet(chat_id: int, user_id: int, description: str, rate: float, sum_rub: int) -> dict | None:
+    """Create bet for a specific chat. Deducts sum from balance. Returns bet dict or None if not enough balance."""
+    return get_backend().create_bet(chat_id, user_id, description, rate, sum_rub)
+
+
+def get_user_bets(chat_id: int, user_id: int, status: str | None = None, limit: int | None = None) -> list:
+    """Get bets for user in a specific chat, newest first, optionally filter by status (active, won, lost).
+
+    limit: вернуть только столько последних ставок (без выборки и сортировки всех).
+    """
+    return get_backend().get_user_bets(chat_id, user_id, status, limit)
+
+
+def get_user_bets_page(
+    chat_id: int, user_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+) -> tuple[list, bool, bool]:
+    """One page of user's bets, newest first: (bets, has_older, has_newer). before/after are bet ids."""
+    return get_backend().get_user_bets_page(chat_id, user_id, before, after, limit)
+
+
+def get_bet(chat_id: int, bet_id: int) -> dict | None:
+    """Get bet by ID, checking it belongs to the chat."""
+    return get_backend().get_bet(chat_id, bet_id)
+
+
+def settle_bet(
+    chat_id: int,
+    bet_id: int,
+    won: bool,
+    settled_by_user_id: int | None = None,
+    settled_by_username: str = "",
+) -> bool:
+    """Mark bet as won or lost, update balance, log who closed it. Returns True if updated."""
+    return get_backend().settle_bet(chat_id, bet_id, won, settled_by_user_id, settled_by_username)
+
+
+def get_all_users_balances(chat_id: int) -> list:
+    """List all users and balances for a specific chat (for admin/leaderboard)."""
+    return get_backend().get_all_users_balances(chat_id)
+
+
+def get_top_balances(chat_id: int, limit: int | None = None) -> list:
+    """Users of a chat sorted by balance, richest first (at most limit of them)."""
+    return get_backend().get_top_balances(chat_id, limit)
+
+
+def get_rank(chat_id: int, user_id: int) -> tuple[int, int] | None:
+    """User's (place, number of users) in the chat's balance table, or None if not registered."""
+    return get_backend().get_rank(chat_id, user_id)
+
+
+def get_leaderboard_version(chat_id: int):
+    """Changes whenever any balance in the chat changes; compare to know a cached table is stale."""
+    return get_backend().get_leaderboard_version(chat_id)
+
+
+def get_all_active_bets(chat_id: int) -> list:
+    """Get all active bets in a chat with user info. Returns list of bets with username."""
+    return get_backend().get_all_active_bets(chat_id)
+
+
+def get_active_bets_page(
+    chat_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+) -> tuple[list, bool, bool]:
+    """One page of active bets in a chat, newest first, with usernames: (bets, has_older, has_newer)."""
+    return get_backend().get_active_bets_page(chat_id, before, after, limit)
+
+
+def find_bets(
+    chat_id: int, query: str, before: int | None = None, after: int | None = None, limit: int = 10
+) -> tuple[list, bool, bool]:
+    """One page of bets whose description has every word of query, newest first, with usernames."""
+    return get_backend().find_bets(chat_id, query, before, after, limit)
+
+
+def reset_all_balances_to_initial(chat_id: int, round_no: int | None = None) -> int | None:
+    """Set every user's balance to INITIAL_BALANCE in a specific chat. Returns number of users reset.
+
+    None — раунд round_no уже закрыт (повторное подтверждение).
+    """
+    return get_backend().reset_all_balances_to_initial(chat_id, round_no)
+
+
+def get_round(chat_id: int) -> int:
+    """Number of the round in progress in a chat (a round ends with /results)."""
+    return get_backend().get_round(chat_id)
+
+
+def get_rounds(chat_id: int) -> list:
+    """Closed rounds of a chat, newest first: {"round", "closed_at", "standings"}."""
+    return get_backend().get_rounds(chat_id)
+
+
+def get_round_standings(chat_id: int, round_no: int) -> dict | None:
+    """Final standings of a closed round or None."""
+    return get_backend().get_round_standings(chat_id, round_no)
+
+
+def get_archived_bets(chat_id: int, user_id: int, round_no: int | None = None, limit: int | None = None) -> list:
+    """User's settled bets that were moved to the archive, newest first."""
+    return get_backend().get_archived_bets(chat_id, user_id, round_no, limit)
+
+
+def get_user_stats(chat_id: int, user_id: int) -> dict:
+    """User's betting statistics for the current round (win rate, ROI, streaks, ...)."""
+    return get_backend().get_user_stats(chat_id, user_id)
+
+
+def get_chat_stats(chat_id: int) -> dict:
+    """Betting statistics of the whole chat for the current round."""
+    return get_backend().get_chat_stats(chat_id)
+
+
+def rebuild_stats(chat_id: int) -> None:
+    """Recount a chat's statistics from the current round's bets."""
+    get_backend().rebuild_stats(chat_id)
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Async storage API for the bot handlers.
+
+Функции storage работают с диском и блокируют поток, поэтому здесь они
+выполняются в отдельном пуле потоков (не больше STORAGE_THREADS штук,
+не больше STORAGE_MAX_PENDING ждущих вызовов), а event loop тем временем
+обрабатывает другие апдейты. Изменения в одном чате выстраиваются в очередь
+через asyncio.Lock этого чата; разные чаты друг друга не ждут.
+"""
+import asyncio
+import functools
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+STORAGE_THREADS = int(os.environ.get("STORAGE_THREADS", "8"))
+STORAGE_MAX_PENDING = int(os.environ.get("STORAGE_MAX_PENDING", str(STORAGE_THREADS * 8)))
+
+_executor: ThreadPoolExecutor | None = None
+_pending: asyncio.Semaphore | None = None
+# Lock живёт, пока кто-то его держит или ждёт; для молчащих чатов память не копится
+_chat_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=STORAGE_THREADS, thread_name_prefix="storage")
+    return _executor
+
+
+async def _run(name: str, *args):
+    """Call storage.<name>(*args) in the storage thread pool."""
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(STORAGE_MAX_PENDING)
+    # Функцию берём по имени в момент вызова, чтобы обёртки над storage (метрики) тоже работали
+    fn = functools.partial(getattr(storage, name), *args)
+    async with _pending:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), fn)
+
+
+def chat_lock(chat_id: int) -> asyncio.Lock:
+    """Lock that serializes storage mutations of one chat."""
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[chat_id] = lock
+    return lock
+
+
+async def _mutate(chat_id: int, name: str, *args):
+    async with chat_lock(chat_id):
+        return await _run(name, chat_id, *args)
+
+
+async def start() -> None:
+    await _run("start")
+
+
+async def close() -> None:
+    """Flush storage and stop the thread pool."""
+    global _executor, _pending
+    await _run("close")
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    _pending = None
+
+
+async def get_user(chat_id: int, user_id: int, username: str = "") -> dict:
+    return await _run("get_user", chat_id, user_id, username)
+
+
+async def get_balance(chat_id: int, user_id: int) -> int:
+    return await _run("get_balance", chat_id, user_id)
+
+
+async def update_balance(chat_id: int, user_id: int, delta: int) -> int:
+    return await _mutate(chat_id, "update_balance", user_id, delta)
+
+
+async def create_bet(chat_id: int, user_id: int, description: str, rate: float, sum_rub: int) -> dict | None:
+    return await _mutate(chat_id, "create_bet", user_id, description, rate, sum_rub)
+
+
+async def get_user_bets(chat_id: int, user_id: int, status: str | None = None, limit: int | None = None) -> list:
+    return await _run("get_user_bets", chat_id, user_id, status, limit)
+
+
+async def get_user_bets_page(
+    chat_id: int, user_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+) -> tuple[list, bool, bool]:
+    return await _run("get_user_bets_page", chat_id, user_id, before, after, limit)
+
+
+async def get_bet(chat_id: int, bet_id: int) -> dict | None:
+    return await _run("get_bet", chat_id, bet_id)
+
+
+async def settle_bet(
+    chat_id: int,
+    bet_id: int,
+    won: bool,
+    settled_by_user_id: int | None = None,
+    settled_by_username: str = "",
+) -> bool:
+    return await _mutate(chat_id, "settle_bet", bet_id, won, settled_by_user_id, settled_by_username)
+
+
+async def get_all_users_balances(chat_id: int) -> list:
+    return await _run("get_all_users_balances", chat_id)
+
+
+async def get_top_balances(chat_id: int, limit: int | None = None) -> list:
+    return await _run("get_top_balances", chat_id, limit)
+
+
+async def get_rank(chat_id: int, user_id: int) -> tuple[int, int] | None:
+    return await _run("get_rank", chat_id, user_id)
+
+
+async def get_leaderboard_version(chat_id: int):
+    return await _run("get_leaderboard_version", chat_id)
+
+
+async def get_all_active_bets(chat_id: int) -> list:
+    return await _run("get_all_active_bets", chat_id)
+
+
+async def get_active_bets_page(
+    chat_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+) -> tuple[list, bool, bool]:
+    return await _run("get_active_bets_page", chat_id, before, after, limit)
+
+
+async def find_bets(
+    chat_id: int, query: str, before: int | None = None, after: int | None = None, limit: int = 10
+) -> tuple[list, bool, bool]:
+    return await _run("find_bets", chat_id, query, before, after, limit)
+
+
+async def reset_all_balances_to_initial(chat_id: int, round_no: int | None = None) -> int | None:
+    return await _mutate(chat_id, "reset_all_balances_to_initial", round_no)
+
+
+async def get_round(chat_id: int) -> int:
+    return await _run("get_round", chat_id)
+
+
+async def get_rounds(chat_id: int) -> list:
+    return await _run("get_rounds", chat_id)
+
+
+async def get_round_standings(chat_id: int, round_no: int) -> dict | None:
+    return await _run("get_round_standings", chat_id, round_no)
+
+
+async def get_archived_bets(chat_id: int, user_id: int, round_no: int | None = None, limit: int | None = None) -> list:
+    return await _run("get_archived_bets", chat_id, user_id, round_no, limit)
+
+
+async def get_user_stats(chat_id: int, user_id: int) -> dict:
+    return await _run("get_user_stats", chat_id, user_id)
+
+
+async def get_chat_stats(chat_id: int) -> dict:
+    return await _run("get_chat_stats", chat_id)
+
+
+async def rebuild_stats(chat_id: int) -> None:
+    return await _mutate(chat_id, "rebuild_stats")
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""Cold store of settled bets and final standings, per chat and round.
+
+data/chats/<chat_id>/archive/:
+    round-0003.bets.jsonl.gz       закрытые ставки раунда, только дописывается
+    round-0003.standings.json.gz   итоговая таблица и статистика раунда (пишется при /results)
+
+Рассчитанные ставки уходят из горячего набора (снимок шарда или таблица
+SQLite) сюда: когда их в чате больше STORAGE_ARCHIVE_KEEP и при закрытии
+раунда. Каждая порция дописывается gzip-членами в конец файла; gzip читает
+склеенные члены как один поток, так что файл никогда не переписывается.
+Членов в порции несколько, по MEMBER_BETS ставок: /find читает одну
+ставку, не распаковывая весь раунд.
+Раунд закрыт, если у него есть standings; текущий раунд — следующий за
+последним закрытым. Читается всё потоково и только по запросу (/history,
+/find — см. search.ArchiveSearch).
+"""
+import gzip
+import json
+import os
+import re
+import threading
+import zlib
+from pathlib import Path
+
+from .journal import dump_json, write_atomic
+
+ARCHIVE_KEEP = int(os.environ.get("STORAGE_ARCHIVE_KEEP", "500"))
+
+# Ставок в одном gzip-члене: /find читает член целиком ради одной ставки
+MEMBER_BETS = 256
+
+_FILE = re.compile(r"^round-(?P<round>\d+)\.(?P<kind>bets\.jsonl|standings\.json)\.gz$")
+
+
+class ChatArchive:
+    """Archive directory of one chat."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._round: int | None = None
+        self._first_bet_id: int | None = None
+
+    def _path(self, round_no: int, kind: str) -> Path:
+        return self.directory / f"round-{round_no:04d}.{kind}.gz"
+
+    def _closed_rounds(self) -> list[int]:
+        if not self.directory.exists():
+            return []
+        rounds = []
+        for path in self.directory.iterdir():
+            m = _FILE.match(path.name)
+            if m and m["kind"] == "standings.json":
+                rounds.append(int(m["round"]))
+        return sorted(rounds)
+
+    @property
+    def round(self) -> int:
+        """Number of the round in progress (1 for a chat that never closed one)."""
+        if self._round is None:
+            closed = self._closed_rounds()
+            self._round = closed[-1] + 1 if closed else 1
+        return self._round
+
+    @property
+    def first_bet_id(self) -> int:
+        """Id of the first bet of the round in progress (0 if the last round was closed without it)."""
+        if self._first_bet_id is None:
+            last = self.standings(self.round - 1) if self.round > 1 else None
+            self._first_bet_id = (last or {}).get("next_bet_id", 0)
+        return self._first_bet_id
+
+    def append_bets(self, bets: list) -> None:
+        """Add settled bets to the current round's file, as gzip members of up to MEMBER_BETS bets."""
+        if not bets:
+            return
+        data = b"".join(
+            gzip.compress(b"".join(dump_json(b) + b"\n" for b in bets[i:i + MEMBER_BETS]))
+            for i in range(0, len(bets), MEMBER_BETS)
+        )
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self._path(self.round, "bets.jsonl"), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close_round(self, standings: list, closed_at: str, stats: dict | None = None, next_bet_id: int = 0) -> int:
+        """Save the final table (and chat statistics) of the current round and start the next one.
+
+        next_bet_id — id, с которого пойдут ставки следующего раунда: по нему
+        статистика отличает ставки, перешедшие из прошлого раунда (first_bet_id).
+        Returns the closed round.
+        """
+        with self._lock:
+            round_no = self.round
+            data = {"round": round_no, "closed_at": closed_at, "standings": standings}
+            if stats is not None:
+                data["stats"] = stats
+            if next_bet_id:
+                data["next_bet_id"] = next_bet_id
+            self.directory.mkdir(parents=True, exist_ok=True)
+            write_atomic(self._path(round_no, "standings.json"), gzip.compress(dump_json(data)))
+            self._round = round_no + 1
+            self._first_bet_id = next_bet_id
+            return round_no
+
+    # --- чтение ---
+
+    def standings(self, round_no: int) -> dict | None:
+        """{"round", "closed_at", "standings": [{user_id, username, balance, stats}, ...], "stats"} or None.
+
+        stats (счётчики stats.py) есть только у раундов, закрытых после появления статистики.
+        """
+        path = self._path(round_no, "standings.json")
+        try:
+            with gzip.open(path, "rb") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def rounds(self) -> list[dict]:
+        """Closed rounds, newest first."""
+        return [s for s in (self.standings(r) for r in reversed(self._closed_rounds())) if s is not None]
+
+    def iter_bets(self, round_no: int):
+        """Archived bets of a round, oldest first, streamed from disk.
+
+        Порция, записанная дважды (падение между архивом и журналом), отдаётся
+        один раз; недописанный хвост последнего члена gzip пропускается.
+        """
+        seen = set()
+        try:
+            with gzip.open(self._path(round_no, "bets.jsonl"), "rb") as f:
+                for line in f:
+                    bet = json.loads(line)
+                    if bet["id"] not in seen:
+                        seen.add(bet["id"])
+                        yield bet
+        except FileNotFoundError:
+            return
+        except (EOFError, gzip.BadGzipFile, zlib.error, ValueError):
+            return
+
+    def bet_rounds(self) -> list[int]:
+        """Rounds that have archived bets, oldest first."""
+        rounds = []
+        if self.directory.exists():
+            for path in self.directory.iterdir():
+                m = _FILE.match(path.name)
+                if m and m["kind"] == "bets.jsonl":
+                    rounds.append(int(m["round"]))
+        return sorted(rounds)
+
+    def members(self, round_no: int, start: int = 0):
+        """(offset, length, bets) of every gzip member of a round's file from byte start on.
+
+        Для поиска (search.ArchiveSearch): по offset/length порцию потом можно
+        прочитать одну (read_member). Недописанный или битый член и всё после
+        него пропускаются, как в iter_bets().
+        """
+        try:
+            with open(self._path(round_no, "bets.jsonl"), "rb") as f:
+                f.seek(start)
+                data = memoryview(f.read())
+        except FileNotFoundError:
+            return
+        offset = 0
+        while offset < len(data):
+            member = zlib.decompressobj(wbits=31)  # 31: формат gzip, ровно один член
+            try:
+                raw = member.decompress(data[offset:])
+                bets = json.loads(b"[" + b",".join(raw.splitlines()) + b"]")  # весь член одним разбором
+            except (zlib.error, ValueError):
+                return
+            if not member.eof:
+                return
+            length = len(data) - offset - len(member.unused_data)
+            yield start + offset, length, bets
+            offset += length
+
+    def read_member(self, round_no: int, offset: int, length: int, ids=None) -> list:
+        """Bets of one gzip member found by members(); only those with the given ids if ids is set."""
+        with open(self._path(round_no, "bets.jsonl"), "rb") as f:
+            f.seek(offset)
+            lines = gzip.decompress(f.read(length)).splitlines()
+        if ids is not None:
+            # Ставка записана dump_json, "id" — первый ключ: чужие строки не разбираем
+            prefixes = tuple(b'{"id":%d,' % bet_id for bet_id in ids)
+            lines = [line for line in lines if line.startswith(prefixes)] or lines
+        return [json.loads(line) for line in lines]
+
+    def max_bet_id(self) -> int:
+        """Highest archived bet id (0 if none); reads the whole archive, for imports only."""
+        return max((b["id"] for r in self.bet_rounds() for b in self.iter_bets(r)), default=0)
+
+    def user_bets(self, user_id: int, round_no: int | None = None, limit: int | None = None) -> list:
+        """Archived bets of the user, newest first: one round or all, at most limit."""
+        rounds = [round_no] if round_no is not None else range(self.round, 0, -1)
+        out = []
+        for r in rounds:
+            found = [b for b in self.iter_bets(r) if b["user_id"] == user_id]
+            out.extend(reversed(found))
+            if limit is not None and len(out) >= limit:
+                return out[:limit]
+        return out
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""Storage backend interface shared by the JSON and SQLite implementations."""
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+from . import search
+from .archive import ChatArchive
+from .settle_log import SettleLog
+
+INITIAL_BALANCE = 10_000  # rubles per user
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+class StorageBackend(ABC):
+    """Everything bot.py needs from storage. All ids are scoped to a chat."""
+
+    def __init__(self, data_dir: Path = DATA_DIR):
+        self.data_dir = Path(data_dir)
+        self.settle_log = SettleLog(self.data_dir)
+        self._archives: dict[int, ChatArchive] = {}
+        self._archives_lock = threading.Lock()
+        self._archive_searches: OrderedDict[int, search.ArchiveSearch] = OrderedDict()
+
+    def _ensure_dir(self):
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+
+    # --- жизненный цикл ---
+
+    def start(self):
+        """Prepare the backend for serving (load data, start background work)."""
+        self.settle_log.start()
+
+    def flush(self):
+        """Make every change so far durable."""
+        self.settle_log.flush()
+
+    def close(self):
+        """Flush and release files/connections."""
+        self.flush()
+        self.settle_log.close()
+
+    # --- пользователи ---
+
+    @abstractmethod
+    def get_user(self, chat_id: int, user_id: int, username: str = "") -> dict:
+        """Get or create user with initial balance for a specific chat."""
+
+    @abstractmethod
+    def update_balance(self, chat_id: int, user_id: int, delta: int) -> int:
+        """Update balance by delta (positive or negative). Returns new balance."""
+
+    def get_balance(self, chat_id: int, user_id: int) -> int:
+        return self.get_user(chat_id, user_id)["balance"]
+
+    @abstractmethod
+    def get_all_users_balances(self, chat_id: int) -> list:
+        """List all users and balances for a specific chat."""
+
+    @abstractmethod
+    def get_top_balances(self, chat_id: int, limit: int | None = None) -> list:
+        """Users with balances, richest first, at most limit of them."""
+
+    @abstractmethod
+    def get_rank(self, chat_id: int, user_id: int) -> tuple[int, int] | None:
+        """(place, number of users) in the chat's balance table, None if the user isn't there."""
+
+    @abstractmethod
+    def get_leaderboard_version(self, chat_id: int):
+        """Value that changes whenever any balance in the chat changes (for caching rendered tables)."""
+
+    @abstractmethod
+    def reset_all_balances_to_initial(self, chat_id: int, round_no: int | None = None) -> int | None:
+        """Close the round (archive standings and settled bets), set every balance to INITIAL_BALANCE.
+
+        Returns number of users reset. С round_no закрывает только этот раунд
+        (номер из get_round() на момент вопроса): если он уже закрыт —
+        повторное нажатие «Да» или второй участник — ничего не делает и
+        возвращает None.
+        """
+
+    # --- ставки ---
+
+    @abstractmethod
+    def create_bet(self, chat_id: int, user_id: int, description: str, rate: float, sum_rub: int) -> dict | None:
+        """Create bet and deduct sum from balance. Returns bet dict or None if not enough balance."""
+
+    @abstractmethod
+    def get_user_bets(self, chat_id: int, user_id: int, status: str | None = None, limit: int | None = None) -> list:
+        """Get user's bets, newest first, optionally filtered by status (active, won, lost) and capped at limit."""
+
+    @abstractmethod
+    def get_user_bets_page(
+        self, chat_id: int, user_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        """One page of user's bets, newest first: (bets, has_older, has_newer).
+
+        Курсор — номер ставки: before — страница старше этого номера, after —
+        новее; без курсора — самые новые ставки.
+        """
+
+    @abstractmethod
+    def get_bet(self, chat_id: int, bet_id: int) -> dict | None:
+        """Get bet by ID, checking it belongs to the chat."""
+
+    @abstractmethod
+    def settle_bet(
+        self,
+        chat_id: int,
+        bet_id: int,
+        won: bool,
+        settled_by_user_id: int | None = None,
+        settled_by_username: str = "",
+    ) -> bool:
+        """Mark active bet as won or lost and pay out. Returns True if updated."""
+
+    @abstractmethod
+    def get_all_active_bets(self, chat_id: int) -> list:
+        """Active bets in a chat, newest first, each with the author's username."""
+
+    @abstractmethod
+    def get_active_bets_page(
+        self, chat_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        """One page of get_all_active_bets(): (bets, has_older, has_newer), cursors as in get_user_bets_page()."""
+
+    @abstractmethod
+    def find_bets(
+        self, chat_id: int, query: str, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        """Bets of the chat whose description has every word of query (search.terms()), newest first,
+        with usernames: (bets, has_older, has_newer), cursors as in get_user_bets_page().
+
+        Ищет и среди горячих ставок, и в архиве всех раундов (_find_archived).
+        """
+
+    # --- статистика (stats.py) ---
+
+    @abstractmethod
+    def get_user_stats(self, chat_id: int, user_id: int) -> dict:
+        """User's statistics for the current round: stats.summary() of the counters (zeros if no bets)."""
+
+    @abstractmethod
+    def get_chat_stats(self, chat_id: int) -> dict:
+        """Chat-wide statistics for the current round, with best_win_username and best_streak_username."""
+
+    @abstractmethod
+    def rebuild_stats(self, chat_id: int) -> None:
+        """Recount the chat's statistics from the current round's bets (in storage and in the archive)."""
+
+    # --- архив раундов ---
+
+    def _archive(self, chat_id: int) -> ChatArchive:
+        """Archive of the chat; both backends keep it in data/chats/<chat_id>/archive/."""
+        with self._archives_lock:
+            archive = self._archives.get(chat_id)
+            if archive is None:
+                archive = self._archives[chat_id] = ChatArchive(self.data_dir / "chats" / str(chat_id) / "archive")
+            return archive
+
+    def _find_archived(
+        self, chat_id: int, words: list[str], before: int | None, after: int | None, limit: int
+    ) -> tuple[list, bool, bool]:
+        """find_bets() over the chat's archive, without usernames; indexes of recent chats stay in memory."""
+        archive = self._archive(chat_id)
+        with self._archives_lock:
+            index = self._archive_searches.get(chat_id)
+            if index is None:
+                index = self._archive_searches[chat_id] = search.ArchiveSearch(archive)
+            self._archive_searches.move_to_end(chat_id)
+            while len(self._archive_searches) > search.SEARCH_ARCHIVES:
+                self._archive_searches.popitem(last=False)
+        return index.page(words, before, after, limit)
+
+    def get_round(self, chat_id: int) -> int:
+        """Number of the round in progress."""
+        return self._archive(chat_id).round
+
+    def get_rounds(self, chat_id: int) -> list:
+        """Closed rounds with their final standings, newest first."""
+        return self._archive(chat_id).rounds()
+
+    def get_round_standings(self, chat_id: int, round_no: int) -> dict | None:
+        """Final standings of a closed round, None if there is no such round."""
+        return self._archive(chat_id).standings(round_no)
+
+    def get_archived_bets(self, chat_id: int, user_id: int, round_no: int | None = None, limit: int | None = None) -> list:
+        """User's bets moved to the archive (one round or all), newest first."""
+        return self._archive(chat_id).user_bets(user_id, round_no, limit)
+
+    # --- перенос данных между бэкендами ---
+
+    @abstractmethod
+    def export_data(self) -> tuple[dict, list]:
+        """Everything as (users, bets) in the users.json / bets.json layout.
+
+        Архив (archive/) в выгрузку не входит: оба бэкенда читают его из одной папки.
+        """
+
+    @abstractmethod
+    def import_data(self, users: dict, bets: list) -> None:
+        """Load (users, bets) in the users.json / bets.json layout, replacing records with the same keys."""
+
+    def _log_settlement(self, chat_id: int, bet: dict, won: bool, settled_by_user_id, settled_by_username: str):
+        """Лог: кто и как закрыл ставку (bet — id, user_id, sum, rate и settled_at закрытой ставки)."""
+        self.settle_log.write({
+            "ts": bet.get("settled_at") or datetime.now().isoformat(),
+            "chat_id": chat_id,
+            "bet_id": bet["id"],
+            "user_id": bet["user_id"],
+            "sum": bet["sum"],
+            "rate": bet["rate"],
+            "payout": int(bet["sum"] * bet["rate"]) if won else 0,
+            "outcome": "won" if won else "lost",
+            "settled_by_user_id": settled_by_user_id,
+            "settled_by_username": settled_by_username or "",
+        })
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Binary shard snapshot (snapshot.bin) that is memory-mapped and decoded lazily.
+
+    python -m storage.binsnap                 # все снимки data/chats/*/ -> snapshot.bin
+    python -m storage.binsnap --to json       # обратно в snapshot.json
+
+Формат (little-endian):
+
+    заголовок   HEADER: magic, версия, chat_id, seq, next_id, число пользователей и ставок,
+                offset/length блока extra
+    индекс      USER_ENTRY на пользователя: user_id, balance, offset, length
+                BET_ENTRY на ставку (по возрастанию id): id, user_id, status, offset, length
+    данные      записи — компактный JSON, каждая по своему offset/length;
+                extra — JSON-объект с данными чата помимо записей (счётчики stats.py, раунд)
+
+При загрузке читается только индекс: по нему строятся by_user, active и
+таблица балансов, а сама запись разбирается при первом обращении к ней
+(LazyRecords). Нетронутые записи при следующем снимке копируются байтами
+без разбора. Журнал поверх снимка работает как раньше.
+"""
+import argparse
+import json
+import mmap
+import struct
+from collections.abc import MutableMapping
+from operator import itemgetter
+from pathlib import Path
+
+from .base import DATA_DIR
+from .journal import CorruptDataError, count_io, dump_json, write_atomic
+from .records import STATUS_CODES, Bet, User
+
+MAGIC = b"TBSN"
+VERSION = 2
+PREFIX = struct.Struct("<4sH")
+HEADER = struct.Struct("<4sHxxqQQIIQI")
+HEADER_V1 = struct.Struct("<4sHxxqQQII")  # без extra
+USER_ENTRY = struct.Struct("<qqQI")
+BET_ENTRY = struct.Struct("<qqBQI")
+
+
+class LazyRecords(MutableMapping):
+    """key -> record; records still in the mapped file are decoded (through factory) on first access.
+
+    Порядок ключей — порядок в файле, новые дописываются в конец (как у dict).
+    """
+
+    def __init__(self, buf=None, raw: dict | None = None, factory=dict):
+        self._buf = buf
+        self._factory = factory
+        self._raw = raw or {}  # key -> запись индекса (..., offset, length) ещё не разобранных
+        self._decoded: dict = {}
+        self._keys = dict.fromkeys(self._raw)
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        *_, offset, length = self._raw.pop(key)
+        record = self._decoded[key] = self._factory(json.loads(self._buf[offset:offset + length]))
+        return record
+
+    def __setitem__(self, key, record):
+        self._raw.pop(key, None)
+        self._decoded[key] = record
+        self._keys.setdefault(key)
+
+    def __delitem__(self, key):
+        del self._keys[key]
+        if self._raw.pop(key, None) is None:
+            del self._decoded[key]
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def peek(self, key):
+        """The record without keeping it decoded (a plain dict if it's still in the file)."""
+        entry = self._raw.get(key)
+        if entry is None:
+            return self._decoded[key]
+        *_, offset, length = entry
+        return json.loads(self._buf[offset:offset + length])
+
+    def encoded(self, key) -> tuple[bytes, tuple | None]:
+        """(JSON bytes, index fields) of an untouched record, (b"", None) if it was decoded."""
+        entry = self._raw.get(key)
+        if entry is None:
+            return b"", None
+        *fields, offset, length = entry
+        return self._buf[offset:offset + length], fields
+
+
+class Snapshot:
+    """A mapped snapshot.bin: header fields, the index and lazy users and bets."""
+
+    def __init__(self, mm: mmap.mmap, header: tuple, user_index: list, bet_index: list, extra: dict):
+        self._mm = mm
+        _, _, self.chat_id, self.seq, self.next_id = header[:5]
+        self.extra = extra
+        self.user_index = user_index  # (user_id, balance, offset, length)
+        self.bet_index = bet_index  # (id, user_id, status, offset, length) по возрастанию id
+        self.users = LazyRecords(mm, dict(zip(map(str, map(itemgetter(0), user_index)), user_index)), User.from_dict)
+        self.bets = LazyRecords(mm, dict(zip(map(itemgetter(0), bet_index), bet_index)), Bet.from_dict)
+
+    def close(self) -> None:
+        """Unmap the file; only after users/bets have been replaced by newer ones."""
+        self._mm.close()
+
+
+def _user_fields(user: dict) -> tuple:
+    return user["user_id"], user["balance"]
+
+
+def _bet_fields(bet: dict) -> tuple:
+    return bet["id"], bet["user_id"], STATUS_CODES[bet.get("status", "active")]
+
+
+def _entries(records, fields) -> list[tuple[bytes, tuple]]:
+    out = []
+    for key in records:
+        data, index = records.encoded(key) if isinstance(records, LazyRecords) else (b"", None)
+        if index is None:
+            record = records[key]
+            data, index = dump_json(record), fields(record)
+        out.append((data, index))
+    return out
+
+
+def encode(chat_id: int, seq: int, next_id: int, users, bets, extra: dict | None = None) -> bytes:
+    """snapshot.bin contents; users/bets may be plain dicts or LazyRecords."""
+    user_entries = _entries(users, _user_fields)
+    bet_entries = _entries(bets, _bet_fields)
+    extra_data = dump_json(extra) if extra else b""
+    offset = HEADER.size + len(user_entries) * USER_ENTRY.size + len(bet_entries) * BET_ENTRY.size
+    extra_offset = offset + sum(len(data) for data, _ in user_entries) + sum(len(data) for data, _ in bet_entries)
+    parts = [HEADER.pack(
+        MAGIC, VERSION, chat_id, seq, next_id, len(user_entries), len(bet_entries), extra_offset, len(extra_data)
+    )]
+    for entries, entry in ((user_entries, USER_ENTRY), (bet_entries, BET_ENTRY)):
+        for data, index in entries:
+            parts.append(entry.pack(*index, offset, len(data)))
+            offset += len(data)
+    parts.extend(data for data, _ in user_entries)
+    parts.extend(data for data, _ in bet_entries)
+    parts.append(extra_data)
+    return b"".join(parts)
+
+
+def read(path: Path) -> Snapshot | None:
+    """Map snapshot.bin and read its index; None if the file doesn't exist."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        size = f.seek(0, 2)
+        if size < HEADER_V1.size:
+            raise CorruptDataError(f"{path} is damaged: truncated header")
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, version = PREFIX.unpack_from(mm, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise CorruptDataError(f"{path} is not a snapshot (magic {magic!r}, version {version})")
+        header_struct = HEADER if version == VERSION else HEADER_V1
+        if size < header_struct.size:
+            raise CorruptDataError(f"{path} is damaged: truncated header")
+        header = header_struct.unpack_from(mm, 0)
+        n_users, n_bets = header[5:7]
+        extra_offset, extra_length = header[7:] if version == VERSION else (0, 0)
+        bets_start = header_struct.size + n_users * USER_ENTRY.size
+        data_start = bets_start + n_bets * BET_ENTRY.size
+        if data_start > size:
+            raise CorruptDataError(f"{path} is damaged: truncated index")
+        user_index = list(USER_ENTRY.iter_unpack(mm[header_struct.size:bets_start]))
+        bet_index = list(BET_ENTRY.iter_unpack(mm[bets_start:data_start]))
+        for entry in user_index[-1:] + bet_index[-1:]:  # записи лежат подряд, последние — в конце файла
+            if entry[-2] + entry[-1] > size:
+                raise CorruptDataError(f"{path} is damaged: records past the end of file")
+        if extra_offset + extra_length > size:
+            raise CorruptDataError(f"{path} is damaged: truncated extra")
+        extra = json.loads(mm[extra_offset:extra_offset + extra_length]) if extra_length else {}
+    except BaseException:
+        mm.close()
+        raise
+    count_io("read", data_start + extra_length, 0.0)
+    return Snapshot(mm, header, user_index, bet_index, extra)
+
+
+def write(path: Path, chat_id: int, seq: int, next_id: int, users, bets, extra: dict | None = None) -> None:
+    """Encode and atomically replace snapshot.bin."""
+    write_atomic(path, encode(chat_id, seq, next_id, users, bets, extra))
+
+
+def convert(data_dir: Path = DATA_DIR, snapshot_format: str = "bin") -> int:
+    """Rewrite every chat snapshot in the given format. Returns how many chats were converted."""
+    from .json_backend import JsonStorage
+
+    backend = JsonStorage(data_dir, snapshot_format=snapshot_format)
+    backend.start()  # заодно переносит старые data/users.json + data/bets.json по чатам
+    try:
+        chats = backend._known_chats()
+        for chat_id in chats:
+            with backend._open(chat_id) as shard:
+                shard.snapshot(force=True)
+    finally:
+        backend.close()
+    return len(chats)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--to", dest="snapshot_format", choices=("bin", "json"), default="bin")
+    args = parser.parse_args(argv)
+    chats = convert(args.data_dir, args.snapshot_format)
+    print(f"Rewrote snapshots of {chats} chats as snapshot.{args.snapshot_format}.")
+
+
+if __name__ == "__main__":
+    main()
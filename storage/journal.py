@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Append-only mutation journal and atomic snapshot files.
+
+Каждое изменение — одна строка JSON с порядковым номером seq, дописывается
+в конец текущего сегмента journal.<seq>.jsonl. Снимок (snapshot) хранит
+состояние на момент seq; при запуске читаем снимок и проигрываем записи
+журнала после него. После нового снимка старые сегменты удаляются.
+"""
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+
+# Счётчики работы с диском для metrics.py: вид -> [операций, байт, секунд].
+# read/write — чтение и запись файлов, decode/encode — разбор и сборка JSON.
+IO_STATS: dict[str, list] = {kind: [0, 0, 0.0] for kind in ("read", "write", "fsync", "decode", "encode")}
+_io_lock = threading.Lock()
+
+
+def count_io(kind: str, nbytes: int, seconds: float, ops: int = 1) -> None:
+    with _io_lock:
+        stat = IO_STATS[kind]
+        stat[0] += ops
+        stat[1] += nbytes
+        stat[2] += seconds
+
+
+def io_stats() -> dict[str, tuple[int, int, float]]:
+    """Consistent copy of IO_STATS: kind -> (operations, bytes, seconds)."""
+    with _io_lock:
+        return {kind: tuple(stat) for kind, stat in IO_STATS.items()}
+
+
+def _plain(obj):
+    # Записи из records.py (и любые другие Mapping) сохраняются как обычные объекты
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def dump_json(obj) -> bytes:
+    """Compact UTF-8 JSON, counted in IO_STATS['encode']."""
+    start = time.perf_counter()
+    data = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_plain).encode("utf-8")
+    count_io("encode", len(data), time.perf_counter() - start)
+    return data
+
+
+class CorruptDataError(Exception):
+    """A snapshot or journal on disk can't be read; refuse to start instead of losing data."""
+
+
+def write_atomic(path: Path, data: bytes, fsync: bool = True) -> None:
+    """Write to a temp file and rename over path, so readers see either old or new content."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    start = time.perf_counter()
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        written = time.perf_counter()
+        count_io("write", len(data), written - start)
+        if fsync:
+            os.fsync(f.fileno())
+            count_io("fsync", 0, time.perf_counter() - written)
+    os.replace(tmp, path)
+
+
+def read_json_file(path: Path, default=None):
+    """Parsed JSON, default if the file doesn't exist, CorruptDataError if it can't be parsed."""
+    if not path.exists():
+        return default
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        data = f.read()
+    read = time.perf_counter()
+    count_io("read", len(data), read - start)
+    try:
+        obj = json.loads(data.decode("utf-8"))
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise CorruptDataError(f"{path} is damaged: {e}") from e
+    count_io("decode", len(data), time.perf_counter() - read)
+    return obj
+
+
+class Journal:
+    """Segmented append-only log of mutation records in one directory."""
+
+    def __init__(self, directory: Path, prefix: str = "journal", fsync: bool = False):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.fsync = fsync
+        self.seq = 0  # номер последней записанной (или проигранной) записи
+        self.since_rotate = 0
+        self._file = None
+        self._segment_start = 0
+
+    def _segments(self) -> list[tuple[int, Path]]:
+        out = []
+        for path in self.directory.glob(f"{self.prefix}.*.jsonl"):
+            start = path.name[len(self.prefix) + 1:-len(".jsonl")]
+            if start.isdigit():
+                out.append((int(start), path))
+        return sorted(out)
+
+    def replay(self, after_seq: int = 0):
+        """Yield records with seq > after_seq in order. Leaves self.seq at the last record seen."""
+        self.seq = after_seq
+        segments = self._segments()
+        for n, (_, path) in enumerate(segments):
+            last_segment = n == len(segments) - 1
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                lines = f.readlines()
+            count_io("read", sum(len(line) for line in lines), time.perf_counter() - start)
+            offset = 0
+            for i, line in enumerate(lines):
+                torn = not line.endswith(b"\n")
+                start = time.perf_counter()
+                try:
+                    record = None if torn else json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    record = None
+                count_io("decode", len(line), time.perf_counter() - start)
+                if record is None:
+                    # Оборванная последняя строка — процесс упал посреди записи, её просто нет.
+                    # Отрезаем её: следующая запись откроет новый сегмент, этот перестанет
+                    # быть последним, и с обрывком внутри после нового падения не прочитался бы
+                    if last_segment and i == len(lines) - 1:
+                        print(f"storage: dropping torn record at the end of {path.name}")
+                        os.truncate(path, offset)
+                        break
+                    raise CorruptDataError(f"{path} is damaged at line {i + 1}")
+                offset += len(line)
+                if record["seq"] <= self.seq:
+                    continue
+                self.seq = record["seq"]
+                yield record
+
+    def _open_segment(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._segment_start = self.seq + 1
+        path = self.directory / f"{self.prefix}.{self._segment_start:012d}.jsonl"
+        # Файл с таким номером может остаться только с оборванной строкой — начинаем его заново
+        self._file = open(path, "wb")
+
+    def append(self, record: dict) -> dict:
+        """Number the record and write it with one small append."""
+        if self._file is None:
+            self._open_segment()
+        self.seq += 1
+        record["seq"] = self.seq
+        line = dump_json(record) + b"\n"
+        start = time.perf_counter()
+        self._file.write(line)
+        self._file.flush()
+        written = time.perf_counter()
+        count_io("write", len(line), written - start)
+        if self.fsync:
+            os.fsync(self._file.fileno())
+            count_io("fsync", 0, time.perf_counter() - written)
+        self.since_rotate += 1
+        return record
+
+    def rotate(self) -> int:
+        """Close the current segment; the next append starts a new one. Returns the last seq."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.since_rotate = 0
+        return self.seq
+
+    def drop_upto(self, seq: int) -> None:
+        """Delete closed segments that only hold records <= seq (they are in a snapshot now)."""
+        for start, path in self._segments():
+            if start <= seq and not (self._file is not None and start == self._segment_start):
+                path.unlink(missing_ok=True)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            start = time.perf_counter()
+            os.fsync(self._file.fileno())
+            count_io("fsync", 0, time.perf_counter() - start)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""JSON file storage for users and bets, one shard per chat.
+
+Каждый чат хранится отдельно в data/chats/<chat_id>/: снимок snapshot.bin
+(или snapshot.json, см. binsnap.py) и журнал journal.*.jsonl (см. shard.py). Шард загружается при первом
+обращении к чату и выгружается, если чат долго молчит или загруженных
+шардов больше max_shards. Стоимость команды зависит только от размера
+своего чата, а разные чаты не ждут друг друга — у каждого свой lock.
+
+Фоновый поток раз в snapshot_interval секунд (или когда в журнале шарда
+набралось snapshot_every записей) сохраняет снимки, уносит старые
+рассчитанные ставки в архив (archive.py) и выгружает лишнее.
+
+Шарды одного чата может вести только один процесс. Процессы бота держат
+data/storage.lock разделяемой блокировкой (воркерам кластера она не мешает:
+чаты у них разные), а перенос данных (migrate.py) — исключительной: он не
+запустится рядом с работающим ботом, а бот — рядом с ним.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from . import search
+from .archive import ARCHIVE_KEEP
+from .base import DATA_DIR, StorageBackend
+from .journal import Journal, read_json_file
+from .records import Bet, User
+from .shard import ChatShard
+
+try:
+    import fcntl
+except ImportError:  # Windows: без блокировки data_dir
+    fcntl = None
+
+SNAPSHOT_INTERVAL = float(os.environ.get("STORAGE_SNAPSHOT_INTERVAL", "60"))
+SNAPSHOT_EVERY = int(os.environ.get("STORAGE_SNAPSHOT_EVERY", "1000"))
+# fsync после каждой записи журнала: переживает и падение ОС, но медленнее
+FSYNC = os.environ.get("STORAGE_FSYNC", "0").strip().lower() in ("1", "true", "yes")
+MAX_SHARDS = int(os.environ.get("STORAGE_MAX_SHARDS", "1000"))
+SHARD_IDLE = float(os.environ.get("STORAGE_SHARD_IDLE", "1800"))  # секунд без обращений
+# bin — снимок с индексом, читается лениво через mmap; json — прежний snapshot.json.
+# Читаются оба, формат определяет, в каком виде сохраняется следующий снимок
+SNAPSHOT_FORMAT = os.environ.get("STORAGE_SNAPSHOT_FORMAT", "bin").strip().lower()
+# Данные до разбивки по чатам: переносятся в шарды при первом обращении
+LEGACY_FILES = ("snapshot.json", "users.json", "bets.json")
+
+
+class DataDirLockedError(Exception):
+    """Another process holds data_dir in a way that conflicts with this one (see JsonStorage.lock())."""
+
+
+class JsonStorage(StorageBackend):
+    """Per-chat shards of snapshot + journal, everything served from memory."""
+
+    def __init__(
+        self,
+        data_dir: Path = DATA_DIR,
+        snapshot_interval: float = SNAPSHOT_INTERVAL,
+        snapshot_every: int = SNAPSHOT_EVERY,
+        fsync: bool = FSYNC,
+        max_shards: int = MAX_SHARDS,
+        shard_idle: float = SHARD_IDLE,
+        archive_keep: int = ARCHIVE_KEEP,
+        snapshot_format: str = SNAPSHOT_FORMAT,
+    ):
+        super().__init__(data_dir)
+        self.chats_dir = self.data_dir / "chats"
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.max_shards = max_shards
+        self.shard_idle = shard_idle
+        self.archive_keep = archive_keep
+        if snapshot_format not in ("bin", "json"):
+            raise ValueError(f"unknown snapshot format {snapshot_format!r}, expected bin or json")
+        self.snapshot_format = snapshot_format
+        self._shards: OrderedDict[int, ChatShard] = OrderedDict()  # от давно использованных к недавним
+        self._shards_lock = threading.Lock()
+        self._migrated = False
+        self._lock_file = None
+        self._maintainer: threading.Thread | None = None
+        self._wake = threading.Event()
+        self._stopping = False
+
+    # --- шарды ---
+
+    def _shard_dir(self, chat_id: int) -> Path:
+        return self.chats_dir / str(chat_id)
+
+    def _get_shard(self, chat_id: int) -> ChatShard:
+        if not self._migrated:
+            self._migrate_legacy()
+        with self._shards_lock:
+            shard = self._shards.get(chat_id)
+            if shard is None:
+                shard = ChatShard(
+                    chat_id,
+                    self._shard_dir(chat_id),
+                    fsync=self.fsync,
+                    archive=self._archive(chat_id),
+                    snapshot_format=self.snapshot_format,
+                )
+                self._shards[chat_id] = shard
+                if len(self._shards) > self.max_shards:
+                    self._wake.set()
+            else:
+                self._shards.move_to_end(chat_id)
+            return shard
+
+    @contextmanager
+    def _open(self, chat_id: int):
+        """Loaded shard of the chat with its lock held."""
+        while True:
+            shard = self._get_shard(chat_id)
+            with shard.lock:
+                if shard.closed:
+                    continue  # шард только что выгрузили — берём новый
+                shard.load()
+                shard.last_used = time.monotonic()
+                yield shard
+                if shard.pending >= self.snapshot_every:
+                    self._wake.set()
+                return
+
+    def _evict(self, shard: ChatShard) -> bool:
+        """Snapshot and unload a shard unless someone is using it right now."""
+        if not shard.lock.acquire(blocking=False):
+            return False
+        try:
+            if not shard.closed:
+                shard.close()
+            with self._shards_lock:
+                if self._shards.get(shard.chat_id) is shard:
+                    del self._shards[shard.chat_id]
+        finally:
+            shard.lock.release()
+        return True
+
+    def _known_chats(self) -> list[int]:
+        """Every chat that has data on disk or in memory."""
+        chats = set()
+        if self.chats_dir.exists():
+            for path in self.chats_dir.iterdir():
+                try:
+                    chats.add(int(path.name))
+                except ValueError:
+                    pass
+        with self._shards_lock:
+            chats.update(self._shards)
+        return sorted(chats)
+
+    def lock(self, exclusive: bool = False) -> None:
+        """Lock data_dir/storage.lock: shared for the bot, exclusive for migrate; no-op if already locked.
+
+        Первое обращение к шардам берёт разделяемую блокировку само.
+        """
+        if self._lock_file is not None or fcntl is None:
+            return
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        f = open(self.data_dir / "storage.lock", "ab")
+        try:
+            fcntl.flock(f, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            holder = "the bot" if exclusive else "a migration (python -m storage.migrate)"
+            raise DataDirLockedError(f"{self.data_dir} is in use by {holder}; stop it first") from None
+        self._lock_file = f
+
+    def _unlock(self) -> None:
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def legacy_files(self) -> list[Path]:
+        """Old single-file data in data_dir that the first use of the backend moves into shards."""
+        files = [self.data_dir / name for name in LEGACY_FILES]
+        return [path for path in files if path.exists()] + sorted(self.data_dir.glob("journal.*.jsonl"))
+
+    def _migrate_legacy(self) -> None:
+        """Split the old single-file data (users.json/bets.json or snapshot.json + journal) into shards."""
+        with self._shards_lock:
+            if self._migrated:
+                return
+            self.lock()
+            legacy_snapshot, legacy_users, legacy_bets = (self.data_dir / name for name in LEGACY_FILES)
+            snapshot = read_json_file(legacy_snapshot)
+            if snapshot is not None:
+                users, bets, seq = snapshot["users"], snapshot["bets"], snapshot["seq"]
+            else:
+                users, bets, seq = read_json_file(legacy_users, {}), read_json_file(legacy_bets, []), 0
+            journal = Journal(self.data_dir)
+            records = list(journal.replay(seq))
+            if users or bets or records:
+                shards: dict[int, ChatShard] = {}
+
+                def shard_for(chat_id):
+                    if chat_id not in shards:
+                        shards[chat_id] = ChatShard(
+                            chat_id, self._shard_dir(chat_id), fsync=self.fsync, snapshot_format=self.snapshot_format
+                        )
+                        shards[chat_id].loaded = True
+                    return shards[chat_id]
+
+                for chat_key, chat_users in users.items():
+                    shard_for(int(chat_key)).users = {user_key: User.from_dict(u) for user_key, u in chat_users.items()}
+                for bet in bets:
+                    shard_for(bet["chat_id"]).bets[bet["id"]] = Bet.from_dict(bet)
+                for shard in shards.values():
+                    shard.reindex()
+                for record in records:
+                    shard_for(record["chat_id"]).apply(record)
+                for shard in shards.values():
+                    shard.snapshot(force=True)
+                    shard.close()
+                print(f"storage: moved {len(shards)} chats from {self.data_dir} into {self.chats_dir}")
+            for segment in self.data_dir.glob("journal.*.jsonl"):
+                segment.unlink()
+            for legacy in (legacy_snapshot, legacy_users, legacy_bets):
+                if legacy.exists():
+                    legacy.replace(legacy.with_name(legacy.name + ".bak"))
+            self._migrated = True
+
+    # --- фоновое обслуживание ---
+
+    def maintain(self) -> None:
+        """Archive old settled bets, snapshot shards, unload idle and least recently used ones."""
+        with self._shards_lock:
+            shards = list(self._shards.values())
+        now = time.monotonic()
+        over_limit = len(shards) - self.max_shards
+        for shard in shards:  # от давно использованных к недавним
+            if over_limit > 0 or now - shard.last_used > self.shard_idle:
+                if self._evict(shard):
+                    over_limit -= 1
+                    continue
+            with shard.lock:
+                if not shard.closed and shard.loaded:
+                    shard.archive_settled(self.archive_keep)
+                    shard.snapshot()
+
+    def _maintain_loop(self):
+        while not self._stopping:
+            self._wake.wait(self.snapshot_interval)
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                self.maintain()
+            except OSError as e:
+                print(f"storage: snapshot failed: {e}")
+
+    def start(self):
+        """Migrate old data if needed and start the background snapshot thread."""
+        self._migrate_legacy()  # и блокировка data_dir: занят — не запускаемся вовсе
+        super().start()
+        if self._maintainer is not None and self._maintainer.is_alive():
+            return
+        self._stopping = False
+        self._maintainer = threading.Thread(target=self._maintain_loop, name="storage-snapshot", daemon=True)
+        self._maintainer.start()
+
+    def flush(self):
+        """Push journal writes of every loaded shard through to the disk."""
+        super().flush()
+        with self._shards_lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            with shard.lock:
+                if not shard.closed:
+                    shard.flush()
+
+    def close(self):
+        """Stop the background thread, snapshot and unload every shard."""
+        self._stopping = True
+        self._wake.set()
+        if self._maintainer is not None:
+            self._maintainer.join()
+            self._maintainer = None
+        with self._shards_lock:
+            shards = list(self._shards.values())
+            self._shards.clear()
+        for shard in shards:
+            with shard.lock:
+                if not shard.closed:
+                    shard.close()
+        self.settle_log.close()
+        self._unlock()
+        self._migrated = False  # при повторном использовании блокировка берётся заново
+
+    # --- пользователи ---
+
+    def get_user(self, chat_id: int, user_id: int, username: str = "") -> dict:
+        with self._open(chat_id) as shard:
+            return shard.get_user(user_id, username)
+
+    def update_balance(self, chat_id: int, user_id: int, delta: int) -> int:
+        with self._open(chat_id) as shard:
+            return shard.update_balance(user_id, delta)
+
+    def get_all_users_balances(self, chat_id: int) -> list:
+        with self._open(chat_id) as shard:
+            return shard.get_all_users_balances()
+
+    def get_top_balances(self, chat_id: int, limit: int | None = None) -> list:
+        with self._open(chat_id) as shard:
+            return shard.get_top_balances(limit)
+
+    def get_rank(self, chat_id: int, user_id: int) -> tuple[int, int] | None:
+        with self._open(chat_id) as shard:
+            return shard.get_rank(user_id)
+
+    def get_leaderboard_version(self, chat_id: int):
+        with self._open(chat_id) as shard:
+            return shard.leaderboard.version
+
+    def reset_all_balances_to_initial(self, chat_id: int, round_no: int | None = None) -> int | None:
+        with self._open(chat_id) as shard:
+            return shard.reset_all_balances(datetime.now().isoformat(), round_no)
+
+    # --- ставки ---
+
+    def create_bet(self, chat_id: int, user_id: int, description: str, rate: float, sum_rub: int) -> dict | None:
+        with self._open(chat_id) as shard:
+            return shard.create_bet(user_id, description, rate, sum_rub)
+
+    def get_user_bets(self, chat_id: int, user_id: int, status: str | None = None, limit: int | None = None) -> list:
+        with self._open(chat_id) as shard:
+            return shard.get_user_bets(user_id, status, limit)
+
+    def get_user_bets_page(
+        self, chat_id: int, user_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        with self._open(chat_id) as shard:
+            return shard.get_user_bets_page(user_id, before, after, limit)
+
+    def get_bet(self, chat_id: int, bet_id: int) -> dict | None:
+        with self._open(chat_id) as shard:
+            bet = shard.find_bet(bet_id)
+            return bet.to_dict() if bet else None
+
+    def settle_bet(
+        self,
+        chat_id: int,
+        bet_id: int,
+        won: bool,
+        settled_by_user_id: int | None = None,
+        settled_by_username: str = "",
+    ) -> bool:
+        with self._open(chat_id) as shard:
+            settled_at = datetime.now().isoformat()
+            if not shard.settle_bet(bet_id, won, settled_at, settled_by_user_id, settled_by_username):
+                return False
+            bet = shard.find_bet(bet_id).to_dict()
+        self._log_settlement(chat_id, bet, won, settled_by_user_id, settled_by_username)
+        return True
+
+    def get_all_active_bets(self, chat_id: int) -> list:
+        with self._open(chat_id) as shard:
+            return shard.get_all_active_bets()
+
+    def get_active_bets_page(
+        self, chat_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        with self._open(chat_id) as shard:
+            return shard.get_active_bets_page(before, after, limit)
+
+    def find_bets(
+        self, chat_id: int, query: str, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        words = search.terms(query)
+        if not words:
+            return [], False, False
+        # Сначала горячие, потом архив: ставка, уехавшая в архив между ними, найдётся там
+        with self._open(chat_id) as shard:
+            hot = shard.find_bets(words, before, after, limit)
+        bets, older, newer = search.merge_pages(hot, self._find_archived(chat_id, words, before, after, limit), after, limit)
+        if any("username" not in b for b in bets):
+            with self._open(chat_id) as shard:
+                for b in bets:
+                    if "username" not in b:
+                        user = shard.users.get(str(b["user_id"]))
+                        b["username"] = user.username if user else ""
+        return bets, older, newer
+
+    # --- статистика ---
+
+    def get_user_stats(self, chat_id: int, user_id: int) -> dict:
+        with self._open(chat_id) as shard:
+            return shard.get_user_stats(user_id)
+
+    def get_chat_stats(self, chat_id: int) -> dict:
+        with self._open(chat_id) as shard:
+            return shard.get_chat_stats()
+
+    def rebuild_stats(self, chat_id: int) -> None:
+        with self._open(chat_id) as shard:
+            shard.rebuild_stats()
+
+    # --- перенос данных ---
+
+    def export_data(self) -> tuple[dict, list]:
+        # Старые users.json/bets.json сначала раскладываем по шардам, иначе чатов ещё нет
+        self._migrate_legacy()
+        users, bets = {}, []
+        for chat_id in self._known_chats():
+            with self._open(chat_id) as shard:
+                if shard.users:
+                    users[str(chat_id)] = {user_key: u.to_dict() for user_key, u in shard.users.items()}
+                bets.extend(b.to_dict() for b in shard.bets.values())
+        return users, bets
+
+    def import_data(self, users: dict, bets: list) -> None:
+        by_chat: dict[int, list] = {}
+        for b in bets:
+            by_chat.setdefault(b["chat_id"], []).append(b)
+        for chat_id in {int(k) for k in users} | set(by_chat):
+            with self._open(chat_id) as shard:
+                # Импорт не журналируется построчно: сразу сохраняем снимок шарда целиком
+                shard.import_data(users.get(str(chat_id), {}), by_chat.get(chat_id, []))
+                shard.snapshot(force=True)
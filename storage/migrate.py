@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Copy users and bets from one storage backend to another.
+
+    python -m storage.migrate                  # data/users.json + data/bets.json -> data/bot.sqlite3
+    python -m storage.migrate --from sqlite --to json   # обратно, если нужно откатиться
+
+Бота на время переноса нужно остановить: JSON-бэкенд ведёт шарды чатов
+одним процессом, а второй процесс дописал бы и сжал бы их журналы поверх
+работающего бота. Поэтому перенос берёт data/storage.lock исключительной
+блокировкой (JsonStorage.lock()) и не начнётся, пока бот запущен. Записи с
+теми же ключами заменяются, так что повторный запуск ничего не дублирует.
+"""
+import argparse
+from pathlib import Path
+
+from . import BACKENDS, DATA_DIR, create_backend
+from .json_backend import DataDirLockedError, JsonStorage
+
+
+class MigrationError(Exception):
+    """The source looks like it has data but nothing came out of it; the target is left untouched."""
+
+
+def migrate(source: str, target: str, data_dir: Path = DATA_DIR) -> tuple[int, int]:
+    """Copy everything from source backend to target. Returns (users, bets) copied."""
+    src = create_backend(source, data_dir)
+    dst = create_backend(target, data_dir)
+    try:
+        for backend in (src, dst):
+            if isinstance(backend, JsonStorage):
+                backend.lock(exclusive=True)
+        # export_data() переименует старые файлы в .bak, поэтому смотрим на них заранее
+        legacy = src.legacy_files() if isinstance(src, JsonStorage) else []
+        users, bets = src.export_data()
+        if legacy and not users and not bets:
+            names = ", ".join(path.name for path in legacy)
+            raise MigrationError(f"{data_dir} has {names}, but nothing was exported from {source}")
+        dst.import_data(users, bets)
+    finally:
+        src.close()
+        dst.close()
+    return sum(len(chat_users) for chat_users in users.values()), len(bets)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="source", choices=BACKENDS, default="json")
+    parser.add_argument("--to", dest="target", choices=BACKENDS, default="sqlite")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    args = parser.parse_args(argv)
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+    try:
+        users, bets = migrate(args.source, args.target, args.data_dir)
+    except (MigrationError, DataDirLockedError) as e:
+        raise SystemExit(f"Migration failed: {e}") from e
+    print(f"Copied {users} users and {bets} bets from {args.source} to {args.target}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Compact in-memory bets and users for the JSON backend.
+
+Ставка-словарь с десятком строковых ключей занимает в памяти сотни байт.
+Bet и User — записи с __slots__ (без __dict__ на каждый объект), статус
+хранится кодом, время закрытия — целым числом микросекунд, а одинаковые
+значения (id участников, суммы, коэффициенты, ники) — одним общим объектом.
+Снаружи это по-прежнему read-only Mapping с теми же ключами, что у словаря:
+bet["status"], bet.get("settled_at"), dict(bet) работают как раньше, а
+dump_json сохраняет запись как обычный объект. Копию-словарь быстрее
+всего даёт to_dict(). Меняются записи только из ChatShard.apply():
+bet.settle() и user.balance.
+"""
+import sys
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+
+STATUSES = ("active", "won", "lost")
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+ACTIVE = STATUS_CODES["active"]
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# Общие объекты для повторяющихся чисел (id участников, суммы, коэффициенты).
+# Отдельные словари по типам: иначе 2 и 2.0 — один ключ, и коэффициент стал бы целым.
+# Различных значений не больше, чем ставок, так что кэш не растёт быстрее данных
+_ints: dict[int, int] = {}
+_floats: dict[float, float] = {}
+
+
+def share(value):
+    """The same object for equal ints, floats or strings."""
+    kind = type(value)
+    if kind is int:
+        return _ints.setdefault(value, value)
+    if kind is float:
+        return _floats.setdefault(value, value)
+    if kind is str:
+        return sys.intern(value)
+    return value
+
+
+def pack_time(value):
+    """ISO time from datetime.isoformat() -> microseconds since epoch; anything else is kept as is."""
+    if not isinstance(value, str):
+        return value
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if dt.tzinfo is not None or dt.isoformat() != value:
+        return value  # не восстановится байт в байт — храним строкой
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def unpack_time(value):
+    if isinstance(value, int):
+        return (_EPOCH + value * _MICROSECOND).isoformat()
+    return value
+
+
+_BET_KEYS = ("id", "chat_id", "user_id", "description", "rate", "sum", "status")
+_SETTLED_KEYS = ("settled_at", "settled_by_user_id", "settled_by_username")
+
+
+class Bet(Mapping):
+    """One bet; reads like the bet dict, settled_* keys exist only once it's settled."""
+
+    __slots__ = (
+        "id", "chat_id", "user_id", "description", "rate", "sum",
+        "status_code", "_settled_at", "settled_by_user_id", "settled_by_username",
+    )
+
+    def __init__(self, bet_id: int, chat_id: int, user_id: int, description: str, rate: float, sum_rub: int):
+        self.id = bet_id
+        self.chat_id = _ints.setdefault(chat_id, chat_id)
+        self.user_id = _ints.setdefault(user_id, user_id)
+        self.description = description
+        self.rate = _floats.setdefault(rate, rate) if type(rate) is float else rate
+        self.sum = _ints.setdefault(sum_rub, sum_rub)
+        self.status_code = ACTIVE
+        self._settled_at = None
+        self.settled_by_user_id = None
+        self.settled_by_username = None
+
+    @classmethod
+    def from_dict(cls, d: Mapping) -> "Bet":
+        bet = cls(d["id"], d["chat_id"], d["user_id"], d["description"], d["rate"], d["sum"])
+        status = d.get("status", "active")
+        if status != "active":
+            bet.settle(status == "won", d.get("settled_at"), d.get("settled_by_user_id"), d.get("settled_by_username"))
+        return bet
+
+    def settle(self, won: bool, settled_at, settled_by_user_id, settled_by_username) -> None:
+        self.status_code = STATUS_CODES["won" if won else "lost"]
+        self._settled_at = pack_time(settled_at)
+        self.settled_by_user_id = share(settled_by_user_id)
+        self.settled_by_username = share(settled_by_username)
+
+    @property
+    def status(self) -> str:
+        return STATUSES[self.status_code]
+
+    @property
+    def settled_at(self):
+        return unpack_time(self._settled_at)
+
+    def to_dict(self) -> dict:
+        d = {
+            "id": self.id,
+            "chat_id": self.chat_id,
+            "user_id": self.user_id,
+            "description": self.description,
+            "rate": self.rate,
+            "sum": self.sum,
+            "status": STATUSES[self.status_code],
+        }
+        if self.status_code != ACTIVE:
+            d["settled_at"] = unpack_time(self._settled_at)
+            d["settled_by_user_id"] = self.settled_by_user_id
+            d["settled_by_username"] = self.settled_by_username
+        return d
+
+    def __getitem__(self, key):
+        if key in _BET_KEYS or (key in _SETTLED_KEYS and self.status_code != ACTIVE):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from _BET_KEYS
+        if self.status_code != ACTIVE:
+            yield from _SETTLED_KEYS
+
+    def __len__(self):
+        return len(_BET_KEYS) + (len(_SETTLED_KEYS) if self.status_code != ACTIVE else 0)
+
+    def __repr__(self):
+        return f"Bet({self.to_dict()!r})"
+
+
+_USER_KEYS = ("user_id", "username", "balance")
+
+
+class User(Mapping):
+    """One participant of a chat; reads like {"user_id", "username", "balance"}."""
+
+    __slots__ = ("user_id", "username", "balance")
+
+    def __init__(self, user_id: int, username: str, balance: int):
+        self.user_id = share(user_id)
+        self.username = share(username or "")
+        self.balance = balance
+
+    @classmethod
+    def from_dict(cls, d: Mapping) -> "User":
+        return cls(d["user_id"], d.get("username", ""), d["balance"])
+
+    def to_dict(self) -> dict:
+        return {"user_id": self.user_id, "username": self.username, "balance": self.balance}
+
+    def __getitem__(self, key):
+        if key in _USER_KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(_USER_KEYS)
+
+    def __len__(self):
+        return len(_USER_KEYS)
+
+    def __repr__(self):
+        return f"User({self.to_dict()!r})"
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Word search over bet descriptions (/find): tokenizer and per-chat inverted index.
+
+Описание режется на слова: регистр и «ё» не важны, у русских слов
+отрезается падежное окончание («Спартака», «Спартаку» -> «спартак»), у
+английских — простые -s/-es/-ies, -ed, -ing. Стемминг грубый, зато
+одинаковый для ставок и для запроса, поэтому «спартак» находит «Победа
+Спартака». Ищем ставки, где есть все слова запроса, новые — первыми.
+
+SearchIndex — слово -> номера ставок по возрастанию (номера в чате только
+растут, новые дописываются в конец), списки — array, по 8 байт на номер.
+Горячие ставки JSON-бэкенд индексирует в памяти шарда, SQLite — в таблице
+bet_terms с теми же словами (terms()). Архив (archive.py) у обоих общий, и
+поиск по нему тоже: ArchiveSearch. Страницы двух половин склеивает merge_pages().
+"""
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from functools import lru_cache
+from itertools import islice
+
+# Сколько чатов держат в памяти индекс своего архива (последние, где искали)
+SEARCH_ARCHIVES = int(os.environ.get("STORAGE_SEARCH_ARCHIVES", "16"))
+
+_WORD = re.compile(r"[^\W_]+")
+_CYRILLIC = re.compile(r"[а-я]")
+
+# Окончания существительных и прилагательных (отрезается самое длинное). Глагольных
+# нет: «-ла», «-ет» съели бы основу у «Реала», «билета»
+_RU_ENDINGS = frozenset(
+    {
+        "иями", "ями", "ами", "ией", "иях", "иям", "ием",
+        "ого", "его", "ому", "ему", "ими", "ыми",
+        "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ую", "юю", "ою", "ею",
+        "ым", "им", "ом", "ем", "ых", "их", "ам", "ям", "ах", "ях", "ов", "ев", "ье", "ья", "ью", "ия", "ию", "ии",
+        "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    }
+)
+_RU_ENDING_LENGTHS = sorted({len(e) for e in _RU_ENDINGS}, reverse=True)
+_RU_REFLEXIVE = ("ся", "сь")
+MIN_STEM = 3  # короче основу не режем: «том», «гол» остаются как есть
+
+
+def _stem_ru(word: str) -> str:
+    for suffix in _RU_REFLEXIVE:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            word = word[:-len(suffix)]
+            break
+    for n in _RU_ENDING_LENGTHS:
+        if len(word) - n >= MIN_STEM and word[-n:] in _RU_ENDINGS:
+            return word[:-n]
+    return word
+
+
+def _stem_en(word: str) -> str:
+    if word.endswith("'s"):
+        word = word[:-2]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("sses"):
+        return word[:-2]
+    for suffix in ("ing", "ed"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            word = word[:-len(suffix)]
+            # winning -> win, но не sell -> sel
+            return word[:-1] if word[-1] == word[-2] and word[-1] not in "lsz" else word
+    if word.endswith("es") and word[-3:-2] in ("s", "x", "z", "h") and len(word) > 4:
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+# Слов в описаниях ставок немного и они повторяются — основу считаем один раз
+@lru_cache(maxsize=1 << 16)
+def stem(word: str) -> str:
+    """Normalized word: already lowercased, ё replaced."""
+    if word.isdigit():
+        return word
+    return _stem_ru(word) if _CYRILLIC.search(word) else _stem_en(word)
+
+
+def terms(text: str) -> list[str]:
+    """Distinct search terms of a text, in order of appearance."""
+    words = _WORD.findall(text.lower().replace("ё", "е"))
+    return list(dict.fromkeys(stem(word) for word in words))
+
+
+def _contains(ids: list, bet_id: int) -> bool:
+    i = bisect_left(ids, bet_id)
+    return i < len(ids) and ids[i] == bet_id
+
+
+def _walk(first: list, rest: list, i: int, step: int):
+    """Ids of first that are in every list of rest, from position i in direction step."""
+    while 0 <= i < len(first):
+        bet_id = first[i]
+        if all(_contains(ids, bet_id) for ids in rest):
+            yield bet_id
+        i += step
+
+
+class SearchIndex:
+    """term -> ascending ids of the chat's bets whose description has it."""
+
+    def __init__(self):
+        self.postings: dict[str, array] = {}
+
+    @classmethod
+    def build(cls, items) -> "SearchIndex":
+        """Index of (bet_id, description) pairs."""
+        index = cls()
+        for bet_id, description in items:
+            index.add(bet_id, description)
+        return index
+
+    def add(self, bet_id: int, description: str) -> None:
+        for term in terms(description):
+            ids = self.postings.get(term)
+            if ids is None:
+                self.postings[term] = array("q", (bet_id,))
+            elif ids[-1] < bet_id:
+                ids.append(bet_id)
+            elif not _contains(ids, bet_id):
+                insort(ids, bet_id)
+
+    def remove(self, items) -> None:
+        """Drop (bet_id, description) pairs, e.g. bets moved to the archive."""
+        gone: dict[str, set] = {}
+        for bet_id, description in items:
+            for term in terms(description):
+                gone.setdefault(term, set()).add(bet_id)
+        for term, bet_ids in gone.items():
+            left = array("q", (bet_id for bet_id in self.postings.get(term, ()) if bet_id not in bet_ids))
+            if left:
+                self.postings[term] = left
+            else:
+                self.postings.pop(term, None)
+
+    def page(self, query: list[str], before: int | None, after: int | None, limit: int) -> tuple[list, bool, bool]:
+        """One page of ids having every query term, newest first: (ids, has_older, has_newer).
+
+        Курсоры — как у shard._page(). Идём по самому короткому списку и
+        проверяем остальные бинарным поиском, пока не наберём страницу.
+        """
+        lists = sorted((self.postings.get(term, ()) for term in query), key=len)
+        if not lists or not lists[0]:
+            return [], False, False
+        first, rest = lists[0], lists[1:]
+        if after is not None:
+            lo = bisect_right(first, after)
+            ids = list(islice(_walk(first, rest, lo, 1), limit + 1))
+            older = next(_walk(first, rest, lo - 1, -1), None) is not None
+            return ids[:limit][::-1], older, len(ids) > limit
+        hi = bisect_left(first, before) if before is not None else len(first)
+        ids = list(islice(_walk(first, rest, hi - 1, -1), limit + 1))
+        newer = next(_walk(first, rest, hi, 1), None) is not None
+        return ids[:limit], len(ids) > limit, newer
+
+
+class ArchiveSearch:
+    """SearchIndex over a chat's archive plus the gzip member each archived bet is in.
+
+    Архив только дописывается, поэтому перед каждым запросом индекс догоняет
+    новые члены файлов (refresh) — трогать его при архивации не нужно. Файлы
+    закрытых раундов больше не меняются, их не перечитываем. Для страницы
+    читаются только члены с её ставками.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.index = SearchIndex()
+        self.lock = threading.Lock()
+        self._members: list[tuple[int, int, int]] = []  # (раунд, offset, length)
+        self._ids = array("q")  # номера архивных ставок по возрастанию
+        self._member_of = array("I")  # и номер члена в _members для каждой
+        self._indexed: dict[int, int] = {}  # раунд -> сколько байт его файла уже в индексе
+        self._final: set[int] = set()  # закрытые раунды, прочитанные до конца
+
+    def refresh(self) -> None:
+        unordered = False
+        for round_no in self.archive.bet_rounds():
+            if round_no in self._final:
+                continue
+            current = self.archive.round
+            for offset, length, bets in self.archive.members(round_no, self._indexed.get(round_no, 0)):
+                member = len(self._members)
+                self._members.append((round_no, offset, length))
+                for bet in bets:
+                    unordered = unordered or bool(self._ids and self._ids[-1] > bet["id"])
+                    self._ids.append(bet["id"])
+                    self._member_of.append(member)
+                    self.index.add(bet["id"], bet["description"])
+                self._indexed[round_no] = offset + length
+            if round_no < current:
+                self._final.add(round_no)
+        if unordered:  # закрытую позже старую ставку архив дописал после более новых
+            pairs = sorted(zip(self._ids, self._member_of))
+            self._ids = array("q", (bet_id for bet_id, _ in pairs))
+            self._member_of = array("I", (member for _, member in pairs))
+
+    def _load(self, ids: list) -> list:
+        wanted: dict[int, set] = {}
+        for bet_id in ids:
+            wanted.setdefault(self._member_of[bisect_left(self._ids, bet_id)], set()).add(bet_id)
+        found = {}
+        for member, bet_ids in wanted.items():
+            for bet in self.archive.read_member(*self._members[member], bet_ids):
+                if bet["id"] in bet_ids:
+                    found.setdefault(bet["id"], bet)
+        return [found[bet_id] for bet_id in ids if bet_id in found]
+
+    def page(self, query: list[str], before: int | None, after: int | None, limit: int) -> tuple[list, bool, bool]:
+        """Archived bets having every query term, newest first: (bets, has_older, has_newer)."""
+        with self.lock:
+            self.refresh()
+            ids, older, newer = self.index.page(query, before, after, limit)
+            return self._load(ids), older, newer
+
+
+def merge_pages(hot: tuple, cold: tuple, after: int | None, limit: int) -> tuple[list, bool, bool]:
+    """One page out of the same page of the hot bets and of the archive.
+
+    Ставка, которая как раз переезжает в архив, может попасть в обе — берём горячую.
+    """
+    bets = {b["id"]: b for b in cold[0]}
+    bets.update((b["id"], b) for b in hot[0])
+    ids = sorted(bets, reverse=True)
+    older, newer = hot[1] or cold[1], hot[2] or cold[2]
+    if after is not None:
+        # Обе половины дали ближайшие к after сверху — оставляем самые старые из них
+        newer = newer or len(ids) > limit
+        ids = ids[-limit:]
+    else:
+        older = older or len(ids) > limit
+        ids = ids[:limit]
+    return [bets[bet_id] for bet_id in ids], older, newer
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Settlement audit log: buffered JSON lines with rotation and gzip, plus a streaming reader.
+
+Каждое закрытие ставки — одна строка JSON в data/settlements.jsonl. Строки
+копятся в памяти и дописываются пачкой раз в SETTLE_LOG_FLUSH_INTERVAL
+секунд, когда набралось SETTLE_LOG_BUFFER строк и при остановке бота.
+Это журнал для разбора «кто что закрыл», а не источник данных: балансы
+и ставки живут в storage, так что при падении теряются максимум последние
+секунды лога, но не деньги.
+
+Когда файл перерастает SETTLE_LOG_MAX_BYTES или наступает новый день, он
+переименовывается в settlements.<дата первой строки>.<n>.jsonl и сжимается
+в .jsonl.gz в фоне. Читает всё это settle_report.py.
+"""
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import date
+from pathlib import Path
+
+SETTLE_LOG_FLUSH_INTERVAL = float(os.environ.get("SETTLE_LOG_FLUSH_INTERVAL", "2"))
+SETTLE_LOG_BUFFER = int(os.environ.get("SETTLE_LOG_BUFFER", "256"))
+SETTLE_LOG_MAX_BYTES = int(os.environ.get("SETTLE_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+# Новый файл каждый день (0 — только по размеру)
+SETTLE_LOG_DAILY = os.environ.get("SETTLE_LOG_DAILY", "1").strip().lower() in ("1", "true", "yes")
+# Имя файла без .jsonl; у процессов кластера свой: settlements-w0, settlements-w1, ... (см. cluster.py)
+SETTLE_LOG_PREFIX = os.environ.get("SETTLE_LOG_PREFIX", "settlements")
+
+# Закрытый файл: <prefix>.<дата первой строки>.<n>.jsonl, после сжатия .jsonl.gz
+ROTATED_NAME = re.compile(r"^(?P<prefix>.+)\.(?P<day>\d{4}-\d{2}-\d{2})\.(?P<n>\d+)\.jsonl(?:\.gz)?$")
+
+
+class SettleLog:
+    """Buffered, rotating writer of settlement records (one JSON object per line)."""
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str = SETTLE_LOG_PREFIX,
+        flush_interval: float = SETTLE_LOG_FLUSH_INTERVAL,
+        buffer_lines: int = SETTLE_LOG_BUFFER,
+        max_bytes: int = SETTLE_LOG_MAX_BYTES,
+        daily: bool = SETTLE_LOG_DAILY,
+    ):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.path = self.directory / f"{prefix}.jsonl"
+        self.flush_interval = flush_interval
+        self.buffer_lines = buffer_lines
+        self.max_bytes = max_bytes
+        self.daily = daily
+        self._buffer: list[bytes] = []
+        self._buffer_lock = threading.Lock()
+        self._file_lock = threading.Lock()  # запись в файл и ротация
+        self._file = None
+        self._size = 0
+        self._day: str | None = None  # дата первой строки текущего файла
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def write(self, record: dict) -> None:
+        """Queue one record; it reaches the disk on the next flush."""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._buffer_lock:
+            self._buffer.append(line)
+            full = len(self._buffer) >= self.buffer_lines
+        if full:
+            if self._thread is not None:
+                self._wake.set()
+            else:
+                self.flush()
+
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        self._day = None
+        if self._size:
+            with open(self.path, "rb") as f:
+                first = f.readline()
+            try:
+                self._day = json.loads(first)["ts"][:10]
+            except (ValueError, KeyError, TypeError):
+                self._day = date.fromtimestamp(self.path.stat().st_mtime).isoformat()
+
+    def _rotate(self) -> None:
+        """Close the current file and rename it; compression happens in compress_rotated()."""
+        self._file.close()
+        self._file = None
+        day = self._day or date.today().isoformat()
+        n = 1
+        while any((self.directory / f"{self.prefix}.{day}.{n}.jsonl{ext}").exists() for ext in ("", ".gz")):
+            n += 1
+        self.path.replace(self.directory / f"{self.prefix}.{day}.{n}.jsonl")
+
+    def flush(self) -> None:
+        """Write buffered lines, rotating the file first if it is too big or from another day."""
+        with self._buffer_lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
+        with self._file_lock:
+            today = date.today().isoformat()
+            if self._file is None:
+                self._open()
+            if self._size and (self._size >= self.max_bytes or (self.daily and self._day != today)):
+                self._rotate()
+                self._open()
+            if self._day is None:
+                self._day = today
+            data = b"".join(lines)
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+
+    def compress_rotated(self) -> None:
+        """Gzip rotated files that are still plain text."""
+        for path in sorted(self.directory.glob(f"{self.prefix}.*.jsonl")):
+            if not ROTATED_NAME.match(path.name):
+                continue
+            gz = path.with_name(path.name + ".gz")
+            tmp = gz.with_name(gz.name + ".tmp")
+            with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            tmp.replace(gz)
+            path.unlink()
+
+    def _loop(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                self.compress_rotated()
+            except OSError as e:
+                print(f"settle log: write failed: {e}")
+
+    def start(self) -> None:
+        """Flush on a timer in a background thread (without it every buffer_lines records flush inline)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="settle-log", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self.compress_rotated()
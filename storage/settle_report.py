@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Streaming reader and CLI for the settlement log: totals per chat, user, settler or day.
+
+Файлы читаются по строке, сжатые — прямо из gzip, так что память не
+зависит от размера лога. Файлы, целиком лежащие вне --since/--until,
+не открываются вовсе. Старый текстовый settlements.log тоже понимается.
+Логи процессов кластера (settlements-w0, settlements-w1, ...) читаются
+вместе с общим и сливаются по времени.
+
+    python -m storage.settle_report --since 2026-09-01 --until 2026-09-30 --by user
+    python -m storage.settle_report --chat -1001234567890 --list
+"""
+import argparse
+import gzip
+import heapq
+import json
+import re
+from collections import defaultdict
+from datetime import date, datetime
+from pathlib import Path
+
+from .base import DATA_DIR
+from .settle_log import ROTATED_NAME
+
+LEGACY_NAME = "settlements.log"
+_LEGACY_LINE = re.compile(
+    r"^(?P<ts>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \| chat_id=(?P<chat_id>-?\d+) \| bet_id=(?P<bet_id>\d+) \| "
+    r"user_id=(?P<user_id>\S+) \| (?P<who>.*?) \| outcome=(?P<outcome>\w+)$"
+)
+
+
+def _first_day(path: Path) -> str:
+    with open(path, "rb") as f:
+        try:
+            return json.loads(f.readline())["ts"][:10]
+        except (ValueError, KeyError, TypeError):
+            return ""
+
+
+def log_files(directory: Path = DATA_DIR, prefix: str = "settlements") -> list[tuple[str, Path]]:
+    """(day of the first line, path) of every log file, oldest first: legacy .log, rotated, current."""
+    directory = Path(directory)
+    files = []
+    legacy = directory / LEGACY_NAME
+    if LEGACY_NAME == f"{prefix}.log" and legacy.exists():
+        files.append(("", legacy))
+    rotated: dict[tuple[str, int], Path] = {}
+    for path in directory.glob(f"{prefix}.*.jsonl*"):
+        m = ROTATED_NAME.match(path.name)
+        if not m or m["prefix"] != prefix:
+            continue
+        key = (m["day"], int(m["n"]))
+        # Пока файл сжимается, на миг есть и .jsonl, и .jsonl.gz — берём один
+        if key not in rotated or path.suffix == ".gz":
+            rotated[key] = path
+    files += [(key[0], rotated[key]) for key in sorted(rotated)]
+    current = directory / f"{prefix}.jsonl"
+    if current.exists():
+        files.append((_first_day(current), current))
+    return files
+
+
+def parse_legacy_line(line: str) -> dict | None:
+    """Record from an old 'date | chat_id=.. | bet_id=.. | user_id=.. | @who | outcome=..' line."""
+    m = _LEGACY_LINE.match(line.strip())
+    if not m:
+        return None
+    settled_by = int(m["user_id"]) if m["user_id"].lstrip("-").isdigit() else None
+    who = m["who"]
+    return {
+        "ts": m["ts"].replace(" ", "T"),
+        "chat_id": int(m["chat_id"]),
+        "bet_id": int(m["bet_id"]),
+        "outcome": m["outcome"],
+        "settled_by_user_id": settled_by,
+        "settled_by_username": who[1:] if who.startswith("@") else "",
+    }
+
+
+def _open_text(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def log_prefixes(directory: Path = DATA_DIR, prefix: str = "settlements") -> list[str]:
+    """prefix itself plus the per-worker prefixes (prefix-w0, prefix-w1, ...) found in the directory."""
+    worker = re.compile(rf"^{re.escape(prefix)}-w\d+$")
+    found = {path.name.split(".", 1)[0] for path in Path(directory).glob(f"{prefix}-w*.jsonl*")}
+    return [prefix] + sorted(p for p in found if worker.match(p))
+
+
+def iter_records(directory: Path = DATA_DIR, since: date | None = None, until: date | None = None, prefix: str = "settlements"):
+    """Stream records from all log files, oldest first, one line in memory at a time.
+
+    Файлы, которые целиком вне [since, until], даже не открываются: у каждого
+    файла в имени дата первой строки.
+    """
+    streams = [_iter_prefix(directory, since, until, p) for p in log_prefixes(directory, prefix)]
+    if len(streams) == 1:
+        return streams[0]
+    return heapq.merge(*streams, key=lambda r: r["ts"])
+
+
+def _iter_prefix(directory: Path, since: date | None, until: date | None, prefix: str):
+    since_s = since.isoformat() if since else ""
+    until_s = until.isoformat() if until else ""
+    files = log_files(directory, prefix)
+    for i, (day, path) in enumerate(files):
+        if until_s and day and day > until_s:
+            break
+        next_day = files[i + 1][0] if i + 1 < len(files) else ""
+        if since_s and next_day and next_day < since_s:
+            continue  # все строки файла раньше начала следующего, а тот ещё до since
+        with _open_text(path) as f:
+            for line in f:
+                if path.name == LEGACY_NAME:
+                    record = parse_legacy_line(line)
+                else:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        record = None  # оборванная строка после падения
+                if record is None:
+                    continue
+                ts_day = record["ts"][:10]
+                if (since_s and ts_day < since_s) or (until_s and ts_day > until_s):
+                    continue
+                yield record
+
+
+def _key(record: dict, by: str):
+    if by == "chat":
+        return record["chat_id"]
+    if by == "day":
+        return record["ts"][:10]
+    if by == "settler":
+        return record.get("settled_by_username") or record.get("settled_by_user_id")
+    # user — автор ставки; в старом формате его нет, но закрывать можно только свои ставки
+    return record.get("user_id", record.get("settled_by_user_id"))
+
+
+def aggregate(records, by: str) -> dict:
+    """key -> {settled, won, lost, staked, paid} in one pass."""
+    totals: dict = defaultdict(lambda: {"settled": 0, "won": 0, "lost": 0, "staked": 0, "paid": 0})
+    for record in records:
+        row = totals[_key(record, by)]
+        row["settled"] += 1
+        row["won" if record["outcome"] == "won" else "lost"] += 1
+        row["staked"] += record.get("sum", 0)
+        row["paid"] += record.get("payout", 0)
+    return dict(totals)
+
+
+def _parse_day(text: str) -> date:
+    return datetime.strptime(text, "%Y-%m-%d").date()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Settlement log analytics (streams rotated and gzipped files).")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--prefix", default="settlements", help="log file name prefix")
+    parser.add_argument("--since", type=_parse_day, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--until", type=_parse_day, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--chat", type=int, help="only this chat_id")
+    parser.add_argument("--user", type=int, help="only bets of / settled by this user_id")
+    parser.add_argument("--by", choices=("chat", "user", "settler", "day"), default="chat")
+    parser.add_argument("--list", action="store_true", help="print matching records instead of totals")
+    args = parser.parse_args(argv)
+
+    records = iter_records(args.data_dir, args.since, args.until, args.prefix)
+    if args.chat is not None:
+        records = (r for r in records if r["chat_id"] == args.chat)
+    if args.user is not None:
+        records = (r for r in records if args.user in (r.get("user_id"), r.get("settled_by_user_id")))
+    if args.list:
+        for r in records:
+            who = f"@{r['settled_by_username']}" if r.get("settled_by_username") else r.get("settled_by_user_id")
+            print(f"{r['ts']} chat={r['chat_id']} bet=#{r['bet_id']} {r['outcome']} by {who}")
+        return
+    totals = aggregate(records, args.by)
+    print(f"{args.by:>20} {'settled':>8} {'won':>6} {'lost':>6} {'staked':>12} {'paid':>12}")
+    for key in sorted(totals, key=str):
+        t = totals[key]
+        print(f"{key!s:>20} {t['settled']:>8} {t['won']:>6} {t['lost']:>6} {t['staked']:>12,} {t['paid']:>12,}")
+
+
+if __name__ == "__main__":
+    main()
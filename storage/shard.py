@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+"""One chat's users and bets: its own snapshot, journal and lock.
+
+Все методы, кроме load(), вызываются с захваченным shard.lock —
+за этим следит JsonStorage.
+
+Ставки и участники в памяти — компактные записи Bet и User (records.py),
+наружу отдаются обычные словари (to_dict()).
+
+Поверх ставок держим индексы, чтобы не перебирать и не сортировать всё:
+bets (id -> ставка), by_user (user_id -> id его ставок по возрастанию),
+active (id активных ставок по возрастанию) и next_id. Номера ставок в чате
+только растут, поэтому новые id просто дописываются в конец списков.
+Индексы обновляются в apply() и перестраиваются при загрузке (reindex
+или прямо из индекса snapshot.bin).
+Так же поддерживается таблица балансов leaderboard (см. leaderboard.py).
+
+Снимок — snapshot.bin (binsnap.py, по умолчанию) или snapshot.json: из
+бинарного при загрузке читается только индекс, а ставки и пользователи
+разбираются при первом обращении.
+
+Поисковый индекс /find (search.py) строится при первом поиске после
+загрузки шарда — из описаний, не разбирая записи snapshot.bin целиком, —
+и дальше обновляется в apply(): новые ставки добавляются, ушедшие в архив
+удаляются. В снимок он не попадает.
+
+Счётчики для /stats (stats.py) лежат в self.stats — {"chat": ..., "users":
+{str(user_id): ...}} — и сохраняются в снимке. None значит, что их ещё не
+считали (старые данные, импорт): тогда их пересчитывает ensure_stats()
+и записывает в журнал одной записью.
+
+Рассчитанные ставки сверх keep и все рассчитанные при закрытии раунда
+уезжают в архив чата (archive.py) — в памяти и в снимке остаются активные
+ставки и свежие закрытые.
+
+self.round — раунд, к которому относятся балансы и счётчики. Закрытие
+раунда пишется в три шага: запись журнала round (какой раунд закрываем),
+итоги в архив, запись reset. Если процесс упал после итогов, но до reset,
+архив уже в следующем раунде, а self.round — нет: load() доделывает сброс.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from pathlib import Path
+
+from . import binsnap, search, stats
+from .archive import ChatArchive
+from .base import INITIAL_BALANCE
+from .journal import Journal, dump_json, read_json_file, write_atomic
+from .leaderboard import Leaderboard
+from .records import ACTIVE, Bet, User
+
+SNAPSHOT_VERSION = 3
+
+
+def _page(ids: list, before: int | None, after: int | None, limit: int) -> tuple[list, bool, bool]:
+    """One page of an ascending id list, newest first: (ids, has_older, has_newer).
+
+    before — страница сразу перед этим id (листаем в прошлое), after — сразу
+    после него (обратно к новым), ни то ни другое — самые новые.
+    """
+    if after is not None:
+        lo = bisect_right(ids, after)
+        hi = min(len(ids), lo + limit)
+    else:
+        hi = bisect_left(ids, before) if before is not None else len(ids)
+        lo = max(0, hi - limit)
+    return ids[lo:hi][::-1], lo > 0, hi < len(ids)
+
+
+class ChatShard:
+    """In-memory state of a single chat, loaded from data/chats/<chat_id>/."""
+
+    def __init__(
+        self,
+        chat_id: int,
+        directory: Path,
+        fsync: bool = False,
+        archive: ChatArchive | None = None,
+        snapshot_format: str = "bin",
+    ):
+        self.chat_id = chat_id
+        self.directory = Path(directory)
+        self.archive = archive or ChatArchive(self.directory / "archive")
+        self.snapshot_file = self.directory / "snapshot.json"
+        self.binary_file = self.directory / "snapshot.bin"
+        self.snapshot_format = snapshot_format
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.closed = False
+        self.last_used = time.monotonic()
+        self.users: dict[str, User] = {}  # str(user_id) -> User
+        self.bets: dict[int, Bet] = {}
+        self.by_user: dict[int, list[int]] = {}
+        self.active: list[int] = []
+        self.next_id = 1
+        self.leaderboard = Leaderboard()
+        self.stats: dict | None = None
+        self.round: int | None = None
+        self.search: search.SearchIndex | None = None
+        self._journal = Journal(self.directory, fsync=fsync)
+        self._snapshot_seq = 0
+        self._mapped: binsnap.Snapshot | None = None
+
+    # --- загрузка, журнал и снимки ---
+
+    def load(self) -> None:
+        """Read the shard snapshot and replay its journal (no-op once loaded)."""
+        if self.loaded:
+            return
+        mapped = binsnap.read(self.binary_file)
+        snapshot = read_json_file(self.snapshot_file)
+        # Оба файла бывают, если упали посреди смены формата: берём более свежий
+        if mapped is not None and snapshot is not None and snapshot["seq"] > mapped.seq:
+            mapped.close()
+            mapped = None
+        seq = 0
+        if mapped is not None:
+            self._use_mapped(mapped)
+            self.stats = mapped.extra.get("stats")
+            self.round = mapped.extra.get("round")
+            seq = mapped.seq
+        else:
+            if snapshot is not None:
+                self.users = {user_key: User.from_dict(u) for user_key, u in snapshot["users"].items()}
+                self.bets = {b["id"]: Bet.from_dict(b) for b in snapshot["bets"]}
+                self.next_id, seq = snapshot["next_id"], snapshot["seq"]
+                self.stats = snapshot.get("stats")
+                self.round = snapshot.get("round")
+            self.reindex()
+        for record in self._journal.replay(seq):
+            self.apply(record)
+        self._snapshot_seq = seq
+        self.loaded = True
+        if self.round is None:  # данные до учёта раунда: балансы — текущего
+            self.round = self.archive.round
+        elif self.round < self.archive.round:
+            print(f"storage: chat {self.chat_id}: finishing the reset of round {self.round} cut short by a crash")
+            self.write({"op": "reset", "round": self.round})
+
+    def _use_mapped(self, mapped: binsnap.Snapshot) -> None:
+        """Take users/bets from a mapped snapshot and indexes straight from its index."""
+        self.by_user = {}
+        for entry in mapped.bet_index:
+            self.by_user.setdefault(entry[1], []).append(entry[0])
+        self.active = [entry[0] for entry in mapped.bet_index if entry[2] == ACTIVE]
+        self.next_id = max(mapped.next_id, mapped.bet_index[-1][0] + 1 if mapped.bet_index else 1)
+        self.leaderboard.rebuild((user_id, balance) for user_id, balance, _, _ in mapped.user_index)
+        self._remap(mapped)
+
+    def _remap(self, mapped: binsnap.Snapshot) -> None:
+        self.users, self.bets = mapped.users, mapped.bets
+        self._unmap()
+        self._mapped = mapped
+
+    def _unmap(self) -> None:
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+    def reindex(self) -> None:
+        """Rebuild by_user, active, next_id and the leaderboard from self.bets and self.users."""
+        self.bets = dict(sorted(self.bets.items()))
+        self.by_user = {}
+        self.active = []
+        for bet_id, bet in self.bets.items():
+            self.by_user.setdefault(bet.user_id, []).append(bet_id)
+            if bet.status_code == ACTIVE:
+                self.active.append(bet_id)
+        self.next_id = max(self.next_id, max(self.bets, default=0) + 1)
+        self.leaderboard.rebuild((u.user_id, u.balance) for u in self.users.values())
+
+    @property
+    def dirty(self) -> bool:
+        return self._journal.seq != self._snapshot_seq
+
+    @property
+    def pending(self) -> int:
+        """Journal records written since the last snapshot."""
+        return self._journal.since_rotate
+
+    def write(self, record: dict) -> None:
+        """Journal the mutation, then apply it to memory."""
+        self._journal.append(record)
+        self.apply(record)
+
+    def apply(self, r: dict) -> None:
+        """Apply one journal record to the in-memory state (same code for live writes and replay)."""
+        op = r["op"]
+        if op == "user":
+            self.users[str(r["user_id"])] = User(r["user_id"], r["username"], INITIAL_BALANCE)
+            self.leaderboard.update(r["user_id"], INITIAL_BALANCE)
+        elif op == "balance":
+            self._add_balance(r["user_id"], r["delta"])
+        elif op == "bet":
+            bet = Bet.from_dict(r["bet"])
+            self.bets[bet.id] = bet
+            self.by_user.setdefault(bet.user_id, []).append(bet.id)
+            self.active.append(bet.id)
+            self.next_id = max(self.next_id, bet.id + 1)
+            self._add_balance(bet.user_id, -bet.sum)
+            if self.stats is not None:
+                stats.add_bet(self._user_stats(bet.user_id), self.stats["chat"], bet.sum)
+            if self.search is not None:
+                self.search.add(bet.id, bet.description)
+        elif op == "settle":
+            bet = self.bets[r["bet_id"]]
+            i = bisect_left(self.active, bet.id)
+            if i < len(self.active) and self.active[i] == bet.id:
+                del self.active[i]
+            bet.settle(r["won"], r["settled_at"], r["settled_by_user_id"], r["settled_by_username"])
+            payout = stats.payout(bet, r["won"])
+            if r["won"]:
+                self._add_balance(bet.user_id, payout)
+            if self.stats is not None:
+                user = self._user_stats(bet.user_id)
+                stats.add_settlement(user, self.stats["chat"], bet.user_id, bet.sum, payout, r["won"])
+        elif op == "archive":
+            archived = set(r["bet_ids"])
+            owners = set()
+            removed = []
+            for bet_id in r["bet_ids"]:
+                bet = self.bets.pop(bet_id, None)
+                if bet is not None:
+                    owners.add(bet.user_id)
+                    removed.append((bet_id, bet.description))
+            if self.search is not None:
+                self.search.remove(removed)
+            for user_id in owners:
+                left = [bet_id for bet_id in self.by_user.get(user_id, ()) if bet_id not in archived]
+                if left:
+                    self.by_user[user_id] = left
+                else:
+                    self.by_user.pop(user_id, None)
+        elif op == "round":
+            self.round = r["round"]
+        elif op == "reset":
+            for u in self.users.values():
+                u.balance = INITIAL_BALANCE
+            self.leaderboard.rebuild((u.user_id, INITIAL_BALANCE) for u in self.users.values())
+            self.stats = {"chat": stats.new_chat(), "users": {}}
+            self.round = r["round"] + 1 if "round" in r else None
+        elif op == "stats":
+            self.stats = r["stats"]
+        else:
+            raise ValueError(f"unknown journal op {op!r}")
+
+    def _add_balance(self, user_id: int, delta: int) -> None:
+        u = self.users.get(str(user_id))
+        if u is not None:
+            u.balance = max(0, u.balance + delta)
+            self.leaderboard.update(user_id, u.balance)
+
+    def _user_stats(self, user_id: int) -> dict:
+        return self.stats["users"].setdefault(str(user_id), stats.new_user())
+
+    def find_bet(self, bet_id: int) -> Bet | None:
+        return self.bets.get(bet_id)
+
+    def snapshot(self, force: bool = False) -> None:
+        """Save the shard as snapshot.bin (or snapshot.json) and drop the journal it covers."""
+        if not self.loaded or (not self.dirty and not force):
+            return
+        seq = self._journal.rotate()
+        if self.snapshot_format == "bin":
+            extra = {key: value for key, value in (("stats", self.stats), ("round", self.round)) if value is not None}
+            binsnap.write(self.binary_file, self.chat_id, seq, self.next_id, self.users, self.bets, extra)
+            # Тот же набор записей, но нетронутые теперь читаются из нового файла
+            self._remap(binsnap.read(self.binary_file))
+            stale = self.snapshot_file
+        else:
+            if self._mapped is not None:
+                self.users, self.bets = dict(self.users), dict(self.bets)
+                self._unmap()
+            data = {
+                "version": SNAPSHOT_VERSION,
+                "chat_id": self.chat_id,
+                "seq": seq,
+                "next_id": self.next_id,
+                "users": self.users,
+                "bets": list(self.bets.values()),
+                "stats": self.stats,
+                "round": self.round,
+            }
+            write_atomic(self.snapshot_file, dump_json(data))
+            stale = self.binary_file
+        stale.unlink(missing_ok=True)
+        self._journal.drop_upto(seq)
+        self._snapshot_seq = seq
+
+    def flush(self) -> None:
+        self._journal.flush()
+
+    def close(self) -> None:
+        """Final snapshot; the shard must not be used afterwards."""
+        self.snapshot()
+        self._journal.close()
+        self._unmap()
+        self.closed = True
+
+    # --- операции над чатом ---
+
+    def get_user(self, user_id: int, username: str = "") -> dict:
+        user = self.users.get(str(user_id))
+        if user is None:
+            self.write({"op": "user", "user_id": user_id, "username": username or ""})
+            user = self.users[str(user_id)]
+        return user.to_dict()
+
+    def update_balance(self, user_id: int, delta: int) -> int:
+        user = self.users.get(str(user_id))
+        if user is None:
+            return 0
+        self.write({"op": "balance", "user_id": user_id, "delta": delta})
+        return user.balance
+
+    def get_all_users_balances(self) -> list:
+        return [
+            {"user_id": int(k), "username": v.username, "balance": v.balance}
+            for k, v in self.users.items()
+        ]
+
+    def get_top_balances(self, limit: int | None = None) -> list:
+        return [
+            {"user_id": user_id, "username": self.users[str(user_id)].username, "balance": balance}
+            for user_id, balance in self.leaderboard.top(limit)
+        ]
+
+    def get_rank(self, user_id: int) -> tuple[int, int] | None:
+        place = self.leaderboard.rank(user_id)
+        return (place, len(self.leaderboard)) if place else None
+
+    def archive_settled(self, keep: int) -> int:
+        """Move the oldest settled bets to the archive so at most keep stay here. Returns how many moved."""
+        extra = len(self.bets) - len(self.active) - keep
+        if extra <= 0:
+            return 0
+        bet_ids = []
+        for bet_id, bet in self.bets.items():  # по возрастанию id
+            if bet.status_code != ACTIVE:
+                bet_ids.append(bet_id)
+                if len(bet_ids) == extra:
+                    break
+        # Сначала архив, потом журнал: после падения между ними ставки просто уйдут в архив ещё раз
+        self.archive.append_bets([self.bets[bet_id] for bet_id in bet_ids])
+        self.write({"op": "archive", "bet_ids": bet_ids})
+        return len(bet_ids)
+
+    def reset_all_balances(self, closed_at: str, round_no: int | None = None) -> int | None:
+        """Close round round_no (the current one if None); None if it is already closed."""
+        if self.round < self.archive.round:
+            # Итоги уже в архиве, сброс не дошёл до журнала: подтверждение его и доделывает
+            self.write({"op": "reset", "round": self.round})
+            return len(self.users)
+        if round_no is not None and round_no != self.round:
+            return None  # повторное нажатие «Да» или старый вопрос
+        if not self.users:
+            return 0
+        self.ensure_stats()
+        users = self.stats["users"]
+        standings = [
+            dict(row, stats=users.get(str(row["user_id"]), stats.new_user())) for row in self.get_top_balances()
+        ]
+        self.write({"op": "round", "round": self.round})
+        self.archive_settled(0)
+        self.archive.close_round(standings, closed_at, self.stats["chat"], self.next_id)
+        self.write({"op": "reset", "round": self.round})
+        return len(self.users)
+
+    # --- статистика ---
+
+    def rebuild_stats(self) -> None:
+        """Recount the round's statistics from its bets: in memory plus the round's archive."""
+        bets = {b["id"]: b for b in self.archive.iter_bets(self.archive.round)}
+        bets.update(self.bets)
+        users, chat = stats.rebuild((bets[bet_id] for bet_id in sorted(bets)), self.archive.first_bet_id)
+        # Одной записью журнала: при повторе после падения получится то же самое
+        self.write({"op": "stats", "stats": {"chat": chat, "users": {str(k): v for k, v in users.items()}}})
+
+    def ensure_stats(self) -> None:
+        if self.stats is None:
+            self.rebuild_stats()
+
+    def get_user_stats(self, user_id: int) -> dict:
+        self.ensure_stats()
+        return stats.summary(self.stats["users"].get(str(user_id)) or stats.new_user())
+
+    def get_chat_stats(self) -> dict:
+        self.ensure_stats()
+        out = stats.summary(self.stats["chat"])
+        for key in ("best_win_user", "best_streak_user"):
+            user = self.users.get(str(out[key])) if out[key] else None
+            out[key.replace("_user", "_username")] = user.username if user else ""
+        return out
+
+    def create_bet(self, user_id: int, description: str, rate: float, sum_rub: int) -> dict | None:
+        balance = self.get_user(user_id)["balance"]
+        if sum_rub <= 0 or sum_rub > balance:
+            return None
+        bet = {
+            "id": self.next_id,
+            "chat_id": self.chat_id,
+            "user_id": user_id,
+            "description": description,
+            "rate": rate,
+            "sum": sum_rub,
+            "status": "active",  # active | won | lost
+        }
+        # Одна запись журнала: ставка и списание суммы не могут разойтись после падения
+        self.write({"op": "bet", "bet": bet})
+        return dict(bet)
+
+    def get_user_bets(self, user_id: int, status: str | None = None, limit: int | None = None) -> list:
+        # by_user уже по возрастанию id: идём с конца и останавливаемся на limit
+        bets = (self.bets[bet_id] for bet_id in reversed(self.by_user.get(user_id, ())))
+        if status:
+            bets = (b for b in bets if b.status == status)
+        return [b.to_dict() for b in islice(bets, limit)]
+
+    def settle_bet(self, bet_id: int, won: bool, settled_at: str, settled_by_user_id, settled_by_username: str) -> bool:
+        bet = self.find_bet(bet_id)
+        if bet is None or bet.status_code != ACTIVE:
+            return False
+        self.write({
+            "op": "settle",
+            "bet_id": bet_id,
+            "won": won,
+            "settled_at": settled_at,
+            "settled_by_user_id": settled_by_user_id,
+            "settled_by_username": settled_by_username or "",
+        })
+        return True
+
+    def get_user_bets_page(self, user_id: int, before: int | None, after: int | None, limit: int) -> tuple[list, bool, bool]:
+        ids, older, newer = _page(self.by_user.get(user_id, []), before, after, limit)
+        return [self.bets[bet_id].to_dict() for bet_id in ids], older, newer
+
+    def _with_username(self, bet_ids) -> list:
+        # Копии, чтобы username не попал в сохранённые ставки
+        active_bets = [self.bets[bet_id].to_dict() for bet_id in bet_ids]
+        # Добавляем username к каждой ставке
+        for bet in active_bets:
+            user = self.users.get(str(bet["user_id"]))
+            bet["username"] = user.username if user else ""
+        return active_bets
+
+    def get_all_active_bets(self) -> list:
+        return self._with_username(reversed(self.active))
+
+    def get_active_bets_page(self, before: int | None, after: int | None, limit: int) -> tuple[list, bool, bool]:
+        ids, older, newer = _page(self.active, before, after, limit)
+        return self._with_username(ids), older, newer
+
+    def _search_index(self) -> search.SearchIndex:
+        if self.search is None:
+            # peek: у snapshot.bin не оставляем разобранными все ставки ради одних описаний
+            bets = self.bets
+            peek = bets.peek if isinstance(bets, binsnap.LazyRecords) else bets.__getitem__
+            self.search = search.SearchIndex.build((bet_id, peek(bet_id)["description"]) for bet_id in bets)
+        return self.search
+
+    def find_bets(self, query: list[str], before: int | None, after: int | None, limit: int) -> tuple[list, bool, bool]:
+        ids, older, newer = self._search_index().page(query, before, after, limit)
+        return self._with_username(ids), older, newer
+
+    def import_data(self, users: dict, bets: list) -> None:
+        """Replace users/bets with the same keys; the caller snapshots afterwards."""
+        self.users.update({str(user_key): User.from_dict(u) for user_key, u in users.items()})
+        self.bets.update({b["id"]: Bet.from_dict(b) for b in bets})
+        self.reindex()
+        self.stats = None  # пересчитаются по новым ставкам при первом запросе
+        self.search = None
+        # Номера из архива тоже заняты (данные могли прийти из другого бэкенда без них)
+        self.next_id = max(self.next_id, self.archive.max_bet_id() + 1)
@@ -0,0 +1,700 @@
+# -*- coding: utf-8 -*-
+"""SQLite storage: real tables and indexes instead of scanning whole JSON files.
+
+База в режиме WAL, поэтому чтения не ждут записей. Каждый поток получает своё
+соединение; создание и закрытие ставки — одна транзакция BEGIN IMMEDIATE,
+так что проверка баланса и списание не разъезжаются.
+
+Рассчитанные ставки сверх archive_keep и все рассчитанные при закрытии
+раунда переносятся в архив чата (archive.py) и удаляются из таблицы.
+Чтобы номера удалённых ставок не выдались снова, chats.next_bet_id
+помнит следующий свободный номер.
+
+Счётчики /stats (stats.py) — таблицы user_stats и chat_stats, меняются
+в той же транзакции, что и ставка. Нет строки в chat_stats — счётчики
+чата ещё не считали, их пересчитает первый запрос.
+
+Поиск /find — таблица bet_terms (chat_id, слово, номер ставки) с теми же
+словами, что у JSON-бэкенда (search.terms()); пишется вместе со ставкой и
+чистится при переносе в архив. В базе, созданной до поиска, слова
+раскладываются при запуске.
+
+chats.round — раунд, к которому относятся балансы (0 — ещё не записан,
+тогда текущий по архиву). Его записывают отдельной транзакцией до того,
+как итоги уйдут в архив, а сброс балансов идёт следующей. Если процесс
+упал между итогами и COMMIT сброса, start() видит chats.round позади
+архива и доделывает сброс.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from . import search, stats
+from .archive import ARCHIVE_KEEP
+from .base import DATA_DIR, INITIAL_BALANCE, StorageBackend
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    chat_id  INTEGER NOT NULL,
+    user_id  INTEGER NOT NULL,
+    username TEXT    NOT NULL DEFAULT '',
+    balance  INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS bets (
+    chat_id             INTEGER NOT NULL,
+    id                  INTEGER NOT NULL,
+    user_id             INTEGER NOT NULL,
+    description         TEXT    NOT NULL,
+    rate                REAL    NOT NULL,
+    sum                 INTEGER NOT NULL,
+    status              TEXT    NOT NULL DEFAULT 'active',
+    settled_at          TEXT,
+    settled_by_user_id  INTEGER,
+    settled_by_username TEXT,
+    PRIMARY KEY (chat_id, id)
+);
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id     INTEGER PRIMARY KEY,
+    lb_version  INTEGER NOT NULL DEFAULT 0,
+    next_bet_id INTEGER NOT NULL DEFAULT 1,
+    round       INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS user_stats (
+    chat_id        INTEGER NOT NULL,
+    user_id        INTEGER NOT NULL,
+    bets           INTEGER NOT NULL DEFAULT 0,
+    staked         INTEGER NOT NULL DEFAULT 0,
+    won            INTEGER NOT NULL DEFAULT 0,
+    lost           INTEGER NOT NULL DEFAULT 0,
+    settled_staked INTEGER NOT NULL DEFAULT 0,
+    returned       INTEGER NOT NULL DEFAULT 0,
+    best_win       INTEGER NOT NULL DEFAULT 0,
+    streak         INTEGER NOT NULL DEFAULT 0,
+    best_streak    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS chat_stats (
+    chat_id          INTEGER PRIMARY KEY,
+    bets             INTEGER NOT NULL DEFAULT 0,
+    staked           INTEGER NOT NULL DEFAULT 0,
+    won              INTEGER NOT NULL DEFAULT 0,
+    lost             INTEGER NOT NULL DEFAULT 0,
+    settled_staked   INTEGER NOT NULL DEFAULT 0,
+    returned         INTEGER NOT NULL DEFAULT 0,
+    best_win         INTEGER NOT NULL DEFAULT 0,
+    best_win_user    INTEGER NOT NULL DEFAULT 0,
+    best_streak      INTEGER NOT NULL DEFAULT 0,
+    best_streak_user INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS bet_terms (
+    chat_id INTEGER NOT NULL,
+    term    TEXT    NOT NULL,
+    bet_id  INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, term, bet_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS users_chat_balance ON users (chat_id, balance DESC, user_id);
+CREATE INDEX IF NOT EXISTS bets_chat_user_status ON bets (chat_id, user_id, status);
+CREATE INDEX IF NOT EXISTS bets_chat_user_id ON bets (chat_id, user_id, id);
+DROP INDEX IF EXISTS bets_chat_status;
+CREATE INDEX IF NOT EXISTS bets_chat_status_id ON bets (chat_id, status, id);
+"""
+
+# Проверять, не пора ли в архив, после каждых N закрытых в чате ставок
+ARCHIVE_CHECK_EVERY = 100
+
+# Колонки chats, которых нет в базах старых версий
+CHATS_COLUMNS = ("next_bet_id INTEGER NOT NULL DEFAULT 1", "round INTEGER NOT NULL DEFAULT 0")
+
+USER_STATS = ", ".join(stats.USER_FIELDS)
+CHAT_STATS = ", ".join(stats.CHAT_FIELDS)
+BET_COLUMNS = "id, chat_id, user_id, description, rate, sum, status, settled_at, settled_by_user_id, settled_by_username"
+BETS_WITH_USERNAME = (
+    "SELECT b.id, b.chat_id, b.user_id, b.description, b.rate, b.sum, b.status, "
+    "b.settled_at, b.settled_by_user_id, b.settled_by_username, COALESCE(u.username, '') AS username "
+    "FROM bets b LEFT JOIN users u ON u.chat_id = b.chat_id AND u.user_id = b.user_id"
+)
+
+
+def _term_rows(chat_id: int, bet_id: int, description: str) -> list[tuple]:
+    return [(chat_id, term, bet_id) for term in search.terms(description)]
+
+
+def _bet_from_row(row) -> dict:
+    """Row -> dict in the same shape the JSON backend returns."""
+    bet = {
+        "id": row["id"],
+        "chat_id": row["chat_id"],
+        "user_id": row["user_id"],
+        "description": row["description"],
+        "rate": row["rate"],
+        "sum": row["sum"],
+        "status": row["status"],
+    }
+    if row["status"] != "active":
+        bet["settled_at"] = row["settled_at"]
+        bet["settled_by_user_id"] = row["settled_by_user_id"]
+        bet["settled_by_username"] = row["settled_by_username"] or ""
+    return bet
+
+
+class SqliteStorage(StorageBackend):
+    """Users and bets in one SQLite database file."""
+
+    def __init__(self, data_dir: Path = DATA_DIR, path: Path | None = None, archive_keep: int = ARCHIVE_KEEP):
+        super().__init__(data_dir)
+        self.path = Path(path) if path else self.data_dir / "bot.sqlite3"
+        self.archive_keep = archive_keep
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._settled_since_check: dict[int, int] = {}
+        self._settled_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None: транзакциями управляем сами через _tx()
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(chats)")}
+            for column in CHATS_COLUMNS:
+                if column.split()[0] not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE chats ADD COLUMN {column}")
+                    except sqlite3.OperationalError:
+                        pass  # колонку только что добавило соединение другого потока
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        """Write transaction that takes the database write lock up front."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def start(self):
+        super().start()
+        self._conn()
+        self._index_terms()
+        self._finish_resets()
+
+    def _finish_resets(self) -> None:
+        """Reset balances of chats whose round was archived but not reset (a crash in between)."""
+        rows = self._conn().execute("SELECT chat_id, round FROM chats WHERE round > 0").fetchall()
+        for r in rows:
+            if r["round"] < self._archive(r["chat_id"]).round:
+                print(f"storage: chat {r['chat_id']}: finishing the reset of round {r['round']} cut short by a crash")
+                with self._tx() as conn:
+                    self._reset_round(conn, r["chat_id"], r["round"])
+
+    def _index_terms(self) -> None:
+        """Fill bet_terms for bets stored before search existed (once: the table is empty only then)."""
+        with self._tx() as conn:
+            if conn.execute("SELECT 1 FROM bet_terms LIMIT 1").fetchone() is not None:
+                return
+            rows = conn.execute("SELECT chat_id, id, description FROM bets").fetchall()
+            conn.executemany(
+                "INSERT OR IGNORE INTO bet_terms (chat_id, term, bet_id) VALUES (?, ?, ?)",
+                [t for r in rows for t in _term_rows(r["chat_id"], r["id"], r["description"])],
+            )
+
+    def close(self):
+        self.settle_log.close()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    # --- пользователи ---
+
+    def _bump_leaderboard(self, conn, chat_id: int) -> None:
+        """Balances of the chat changed: invalidate cached tables (same transaction as the change)."""
+        conn.execute(
+            "INSERT INTO chats (chat_id, lb_version) VALUES (?, 1) "
+            "ON CONFLICT (chat_id) DO UPDATE SET lb_version = lb_version + 1",
+            (chat_id,),
+        )
+
+    def _get_or_create_user(self, conn, chat_id: int, user_id: int, username: str = "") -> dict:
+        row = conn.execute(
+            "SELECT user_id, username, balance FROM users WHERE chat_id = ? AND user_id = ?",
+            (chat_id, user_id),
+        ).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO users (chat_id, user_id, username, balance) VALUES (?, ?, ?, ?)",
+                (chat_id, user_id, username or "", INITIAL_BALANCE),
+            )
+            self._bump_leaderboard(conn, chat_id)
+            return {"user_id": user_id, "username": username or "", "balance": INITIAL_BALANCE}
+        return dict(row)
+
+    def get_user(self, chat_id: int, user_id: int, username: str = "") -> dict:
+        row = self._conn().execute(
+            "SELECT user_id, username, balance FROM users WHERE chat_id = ? AND user_id = ?",
+            (chat_id, user_id),
+        ).fetchone()
+        if row is not None:
+            return dict(row)
+        with self._tx() as conn:
+            return self._get_or_create_user(conn, chat_id, user_id, username)
+
+    def _add_balance(self, conn, chat_id: int, user_id: int, delta: int) -> int:
+        row = conn.execute(
+            "UPDATE users SET balance = MAX(0, balance + ?) WHERE chat_id = ? AND user_id = ? RETURNING balance",
+            (delta, chat_id, user_id),
+        ).fetchone()
+        if row is None:
+            return 0
+        self._bump_leaderboard(conn, chat_id)
+        return row["balance"]
+
+    def update_balance(self, chat_id: int, user_id: int, delta: int) -> int:
+        with self._tx() as conn:
+            return self._add_balance(conn, chat_id, user_id, delta)
+
+    def get_all_users_balances(self, chat_id: int) -> list:
+        rows = self._conn().execute(
+            "SELECT user_id, username, balance FROM users WHERE chat_id = ?", (chat_id,)
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get_top_balances(self, chat_id: int, limit: int | None = None) -> list:
+        rows = self._conn().execute(
+            "SELECT user_id, username, balance FROM users WHERE chat_id = ? "
+            "ORDER BY balance DESC, user_id LIMIT ?",
+            (chat_id, -1 if limit is None else limit),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get_rank(self, chat_id: int, user_id: int) -> tuple[int, int] | None:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT balance FROM users WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).fetchone()
+        if row is None:
+            return None
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM users WHERE chat_id = ? AND (balance > ? OR (balance = ? AND user_id < ?))",
+            (chat_id, row["balance"], row["balance"], user_id),
+        ).fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM users WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+        return ahead + 1, total
+
+    def get_leaderboard_version(self, chat_id: int):
+        row = self._conn().execute("SELECT lb_version FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row["lb_version"] if row else 0
+
+    def _hot_round(self, conn, chat_id: int) -> int:
+        """chats.round, written down (from the archive) if it wasn't yet."""
+        row = conn.execute("SELECT round FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is not None and row["round"]:
+            return row["round"]
+        round_no = self._archive(chat_id).round
+        conn.execute(
+            "INSERT INTO chats (chat_id, round) VALUES (?, ?) ON CONFLICT (chat_id) DO UPDATE SET round = excluded.round",
+            (chat_id, round_no),
+        )
+        return round_no
+
+    def _reset_round(self, conn, chat_id: int, round_no: int) -> int:
+        """Balances and statistics of a closed round_no back to the start; the chat moves to the next round."""
+        count = conn.execute("UPDATE users SET balance = ? WHERE chat_id = ?", (INITIAL_BALANCE, chat_id)).rowcount
+        self._bump_leaderboard(conn, chat_id)
+        conn.execute("DELETE FROM user_stats WHERE chat_id = ?", (chat_id,))
+        self._save_stats(conn, chat_id, {}, stats.new_chat())
+        conn.execute("UPDATE chats SET round = ? WHERE chat_id = ?", (round_no + 1, chat_id))
+        return count
+
+    def reset_all_balances_to_initial(self, chat_id: int, round_no: int | None = None) -> int | None:
+        archive = self._archive(chat_id)
+        # Раунд записываем до итогов в архиве: по нему start() узнает недоделанный сброс
+        with self._tx() as conn:
+            hot = self._hot_round(conn, chat_id)
+            if hot < archive.round:
+                # Итоги уже в архиве, сброс не дошёл до базы: подтверждение его и доделывает
+                return self._reset_round(conn, chat_id, hot)
+        if round_no is not None and round_no != hot:
+            return None  # повторное нажатие «Да» или старый вопрос
+        standings = self.get_top_balances(chat_id)
+        if not standings:
+            return 0
+        self._ensure_stats(chat_id)
+        conn = self._conn()
+        users = {
+            r["user_id"]: {field: r[field] for field in stats.USER_FIELDS}
+            for r in conn.execute(f"SELECT user_id, {USER_STATS} FROM user_stats WHERE chat_id = ?", (chat_id,))
+        }
+        chat = dict(conn.execute(f"SELECT {CHAT_STATS} FROM chat_stats WHERE chat_id = ?", (chat_id,)).fetchone())
+        standings = [dict(row, stats=users.get(row["user_id"], stats.new_user())) for row in standings]
+        self._archive_settled(chat_id, 0)
+        archive.close_round(standings, datetime.now().isoformat(), chat, self._next_bet_id(conn, chat_id))
+        with self._tx() as conn:
+            return self._reset_round(conn, chat_id, hot)
+
+    # --- ставки ---
+
+    def _next_bet_id(self, conn, chat_id: int) -> int:
+        return conn.execute(
+            "SELECT MAX((SELECT COALESCE(MAX(id), 0) + 1 FROM bets WHERE chat_id = ?), "
+            "COALESCE((SELECT next_bet_id FROM chats WHERE chat_id = ?), 1))",
+            (chat_id, chat_id),
+        ).fetchone()[0]
+
+    def create_bet(self, chat_id: int, user_id: int, description: str, rate: float, sum_rub: int) -> dict | None:
+        with self._tx() as conn:
+            balance = self._get_or_create_user(conn, chat_id, user_id)["balance"]
+            if sum_rub <= 0 or sum_rub > balance:
+                return None
+            bet_id = self._next_bet_id(conn, chat_id)
+            conn.execute(
+                "INSERT INTO bets (chat_id, id, user_id, description, rate, sum, status) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'active')",
+                (chat_id, bet_id, user_id, description, rate, sum_rub),
+            )
+            conn.executemany(
+                "INSERT INTO bet_terms (chat_id, term, bet_id) VALUES (?, ?, ?)", _term_rows(chat_id, bet_id, description)
+            )
+            self._add_balance(conn, chat_id, user_id, -sum_rub)
+            counters = self._load_stats(conn, chat_id, user_id)
+            if counters is not None:
+                stats.add_bet(*counters, sum_rub)
+                self._save_stats(conn, chat_id, {user_id: counters[0]}, counters[1])
+        return {
+            "id": bet_id,
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "description": description,
+            "rate": rate,
+            "sum": sum_rub,
+            "status": "active",
+        }
+
+    def get_user_bets(self, chat_id: int, user_id: int, status: str | None = None, limit: int | None = None) -> list:
+        query = f"SELECT {BET_COLUMNS} FROM bets WHERE chat_id = ? AND user_id = ?"
+        params = [chat_id, user_id]
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [_bet_from_row(r) for r in self._conn().execute(query, params)]
+
+    def _page(
+        self, select: str, where: str, params: list, before, after, limit: int, source: str = "bets b", key: str = "b.id"
+    ) -> tuple[list, bool, bool]:
+        """One page by bet id (column key of source), newest first; both directions walk an index on (..., id)."""
+        conn = self._conn()
+        if after is not None:
+            rows = conn.execute(
+                f"{select} WHERE {where} AND {key} > ? ORDER BY {key} LIMIT ?", [*params, after, limit + 1]
+            ).fetchall()
+            newer = len(rows) > limit
+            rows = rows[:limit][::-1]
+            older = conn.execute(
+                f"SELECT 1 FROM {source} WHERE {where} AND {key} <= ? LIMIT 1", [*params, after]
+            ).fetchone()
+        else:
+            query, args = f"{select} WHERE {where}", list(params)
+            if before is not None:
+                query += f" AND {key} < ?"
+                args.append(before)
+            rows = conn.execute(query + f" ORDER BY {key} DESC LIMIT ?", [*args, limit + 1]).fetchall()
+            older = len(rows) > limit
+            rows = rows[:limit]
+            newer = before is not None and conn.execute(
+                f"SELECT 1 FROM {source} WHERE {where} AND {key} >= ? LIMIT 1", [*params, before]
+            ).fetchone()
+        return rows, bool(older), bool(newer)
+
+    def get_user_bets_page(
+        self, chat_id: int, user_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        rows, older, newer = self._page(
+            f"SELECT {BET_COLUMNS} FROM bets b", "b.chat_id = ? AND b.user_id = ?", [chat_id, user_id],
+            before, after, limit,
+        )
+        return [_bet_from_row(r) for r in rows], older, newer
+
+    def get_bet(self, chat_id: int, bet_id: int) -> dict | None:
+        row = self._conn().execute(
+            f"SELECT {BET_COLUMNS} FROM bets WHERE chat_id = ? AND id = ?", (chat_id, bet_id)
+        ).fetchone()
+        return _bet_from_row(row) if row else None
+
+    def settle_bet(
+        self,
+        chat_id: int,
+        bet_id: int,
+        won: bool,
+        settled_by_user_id: int | None = None,
+        settled_by_username: str = "",
+    ) -> bool:
+        with self._tx() as conn:
+            settled_at = datetime.now().isoformat()
+            row = conn.execute(
+                "UPDATE bets SET status = ?, settled_at = ?, settled_by_user_id = ?, settled_by_username = ? "
+                "WHERE chat_id = ? AND id = ? AND status = 'active' RETURNING user_id, sum, rate",
+                (
+                    "won" if won else "lost",
+                    settled_at,
+                    settled_by_user_id,
+                    settled_by_username or "",
+                    chat_id,
+                    bet_id,
+                ),
+            ).fetchone()
+            if row is None:
+                return False
+            payout = stats.payout(row, won)
+            if won:
+                self._add_balance(conn, chat_id, row["user_id"], payout)
+            counters = self._load_stats(conn, chat_id, row["user_id"])
+            if counters is not None:
+                stats.add_settlement(*counters, row["user_id"], row["sum"], payout, won)
+                self._save_stats(conn, chat_id, {row["user_id"]: counters[0]}, counters[1])
+        bet = {"id": bet_id, "user_id": row["user_id"], "sum": row["sum"], "rate": row["rate"], "settled_at": settled_at}
+        self._log_settlement(chat_id, bet, won, settled_by_user_id, settled_by_username)
+        with self._settled_lock:
+            n = self._settled_since_check.get(chat_id, 0) + 1
+            self._settled_since_check[chat_id] = 0 if n >= ARCHIVE_CHECK_EVERY else n
+        if n >= ARCHIVE_CHECK_EVERY:
+            self._archive_settled(chat_id, self.archive_keep)
+        return True
+
+    def _archive_settled(self, chat_id: int, keep: int) -> int:
+        """Move the oldest settled bets of the chat to the archive so at most keep stay. Returns how many moved."""
+        with self._tx() as conn:
+            rows = conn.execute(
+                f"SELECT {BET_COLUMNS} FROM bets WHERE chat_id = ? AND status != 'active' "
+                "ORDER BY id DESC LIMIT -1 OFFSET ?",
+                (chat_id, keep),
+            ).fetchall()
+            if not rows:
+                return 0
+            bets = [_bet_from_row(r) for r in reversed(rows)]
+            # Внутри транзакции: если она откатится, ставки уйдут в архив ещё раз, а читатель пропустит повтор
+            self._archive(chat_id).append_bets(bets)
+            conn.execute(
+                "INSERT INTO chats (chat_id, next_bet_id) SELECT ?, MAX(id) + 1 FROM bets WHERE chat_id = ? "
+                "ON CONFLICT (chat_id) DO UPDATE SET next_bet_id = MAX(next_bet_id, excluded.next_bet_id)",
+                (chat_id, chat_id),
+            )
+            conn.executemany("DELETE FROM bets WHERE chat_id = ? AND id = ?", [(chat_id, b["id"]) for b in bets])
+            conn.executemany(
+                "DELETE FROM bet_terms WHERE chat_id = ? AND term = ? AND bet_id = ?",
+                [t for b in bets for t in _term_rows(chat_id, b["id"], b["description"])],
+            )
+        return len(bets)
+
+    def get_all_active_bets(self, chat_id: int) -> list:
+        rows = self._conn().execute(
+            f"{BETS_WITH_USERNAME} WHERE b.chat_id = ? AND b.status = 'active' ORDER BY b.id DESC", (chat_id,)
+        ).fetchall()
+        return [dict(_bet_from_row(r), username=r["username"]) for r in rows]
+
+    def get_active_bets_page(
+        self, chat_id: int, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        rows, older, newer = self._page(
+            BETS_WITH_USERNAME, "b.chat_id = ? AND b.status = 'active'", [chat_id], before, after, limit
+        )
+        return [dict(_bet_from_row(r), username=r["username"]) for r in rows], older, newer
+
+    def find_bets(
+        self, chat_id: int, query: str, before: int | None = None, after: int | None = None, limit: int = 10
+    ) -> tuple[list, bool, bool]:
+        words = search.terms(query)
+        if not words:
+            return [], False, False
+        # Сначала горячие, потом архив: ставка, уехавшая в архив между ними, найдётся там
+        hot = self._find_hot(chat_id, words, before, after, limit)
+        bets, older, newer = search.merge_pages(hot, self._find_archived(chat_id, words, before, after, limit), after, limit)
+        missing = {b["user_id"] for b in bets if "username" not in b}
+        if missing:
+            names = dict(self._conn().execute(
+                f"SELECT user_id, username FROM users WHERE chat_id = ? AND user_id IN ({', '.join('?' * len(missing))})",
+                [chat_id, *missing],
+            ).fetchall())
+            for b in bets:
+                b.setdefault("username", names.get(b["user_id"], ""))
+        return bets, older, newer
+
+    def _find_hot(
+        self, chat_id: int, words: list[str], before: int | None, after: int | None, limit: int
+    ) -> tuple[list, bool, bool]:
+        """find_bets() over the bets table through bet_terms."""
+        conn = self._conn()
+        # Ведём по самому редкому слову, остальные проверяем по первичному ключу bet_terms
+        counts = {
+            word: conn.execute(
+                "SELECT COUNT(*) FROM bet_terms WHERE chat_id = ? AND term = ?", (chat_id, word)
+            ).fetchone()[0]
+            for word in words
+        } if len(words) > 1 else {words[0]: 1}
+        if not all(counts.values()):
+            return [], False, False
+        first, *rest = sorted(words, key=counts.get)
+        where = "t.chat_id = ? AND t.term = ?" + (
+            " AND EXISTS (SELECT 1 FROM bet_terms x WHERE x.chat_id = t.chat_id AND x.term = ? AND x.bet_id = t.bet_id)"
+            * len(rest)
+        )
+        rows, older, newer = self._page(
+            "SELECT t.bet_id FROM bet_terms t", where, [chat_id, first, *rest], before, after, limit,
+            source="bet_terms t", key="t.bet_id",
+        )
+        ids = [r["bet_id"] for r in rows]
+        if not ids:
+            return [], older, newer
+        found = {
+            r["id"]: dict(_bet_from_row(r), username=r["username"])
+            for r in conn.execute(
+                f"{BETS_WITH_USERNAME} WHERE b.chat_id = ? AND b.id IN ({', '.join('?' * len(ids))})", [chat_id, *ids]
+            )
+        }
+        return [found[bet_id] for bet_id in ids if bet_id in found], older, newer
+
+    # --- статистика ---
+
+    def _load_stats(self, conn, chat_id: int, user_id: int) -> tuple[dict, dict] | None:
+        """(user counters, chat counters), None if the chat's statistics were never counted."""
+        chat = conn.execute(f"SELECT {CHAT_STATS} FROM chat_stats WHERE chat_id = ?", (chat_id,)).fetchone()
+        if chat is None:
+            return None
+        user = conn.execute(
+            f"SELECT {USER_STATS} FROM user_stats WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).fetchone()
+        return (dict(user) if user else stats.new_user()), dict(chat)
+
+    def _save_stats(self, conn, chat_id: int, users: dict, chat: dict) -> None:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO user_stats (chat_id, user_id, {USER_STATS}) "
+            f"VALUES (?, ?{', ?' * len(stats.USER_FIELDS)})",
+            [(chat_id, user_id, *(u[f] for f in stats.USER_FIELDS)) for user_id, u in users.items()],
+        )
+        conn.execute(
+            f"INSERT OR REPLACE INTO chat_stats (chat_id, {CHAT_STATS}) VALUES (?{', ?' * len(stats.CHAT_FIELDS)})",
+            (chat_id, *(chat[f] for f in stats.CHAT_FIELDS)),
+        )
+
+    def rebuild_stats(self, chat_id: int) -> None:
+        with self._tx() as conn:
+            # Архив читаем внутри транзакции: иначе ставки, ушедшие туда между чтениями, потерялись бы
+            bets = {b["id"]: b for b in self._archive(chat_id).iter_bets(self._archive(chat_id).round)}
+            for r in conn.execute(f"SELECT {BET_COLUMNS} FROM bets WHERE chat_id = ? ORDER BY id", (chat_id,)):
+                bets[r["id"]] = _bet_from_row(r)
+            users, chat = stats.rebuild((bets[bet_id] for bet_id in sorted(bets)), self._archive(chat_id).first_bet_id)
+            conn.execute("DELETE FROM user_stats WHERE chat_id = ?", (chat_id,))
+            self._save_stats(conn, chat_id, users, chat)
+
+    def _ensure_stats(self, chat_id: int) -> None:
+        row = self._conn().execute("SELECT 1 FROM chat_stats WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            self.rebuild_stats(chat_id)
+
+    def get_user_stats(self, chat_id: int, user_id: int) -> dict:
+        self._ensure_stats(chat_id)
+        user, _ = self._load_stats(self._conn(), chat_id, user_id)
+        return stats.summary(user)
+
+    def get_chat_stats(self, chat_id: int) -> dict:
+        self._ensure_stats(chat_id)
+        conn = self._conn()
+        _, chat = self._load_stats(conn, chat_id, 0)
+        out = stats.summary(chat)
+        for key in ("best_win_user", "best_streak_user"):
+            row = conn.execute(
+                "SELECT username FROM users WHERE chat_id = ? AND user_id = ?", (chat_id, out[key])
+            ).fetchone()
+            out[key.replace("_user", "_username")] = row["username"] if row else ""
+        return out
+
+    # --- перенос данных ---
+
+    def export_data(self) -> tuple[dict, list]:
+        conn = self._conn()
+        users: dict = {}
+        for r in conn.execute("SELECT chat_id, user_id, username, balance FROM users"):
+            users.setdefault(str(r["chat_id"]), {})[str(r["user_id"])] = {
+                "user_id": r["user_id"],
+                "username": r["username"],
+                "balance": r["balance"],
+            }
+        bets = [_bet_from_row(r) for r in conn.execute(f"SELECT {BET_COLUMNS} FROM bets ORDER BY chat_id, id")]
+        return users, bets
+
+    def import_data(self, users: dict, bets: list) -> None:
+        with self._tx() as conn:
+            for chat_key in users:
+                self._bump_leaderboard(conn, int(chat_key))
+            # Статистику этих чатов пересчитает первый запрос — уже по новым ставкам
+            for chat_id in {int(k) for k in users} | {b["chat_id"] for b in bets}:
+                conn.execute("DELETE FROM user_stats WHERE chat_id = ?", (chat_id,))
+                conn.execute("DELETE FROM chat_stats WHERE chat_id = ?", (chat_id,))
+            # Номера из архива тоже заняты (данные могли прийти из другого бэкенда без них)
+            for chat_id in {int(k) for k in users} | {b["chat_id"] for b in bets}:
+                archived = self._archive(chat_id).max_bet_id()
+                if archived:
+                    conn.execute(
+                        "INSERT INTO chats (chat_id, next_bet_id) VALUES (?, ?) "
+                        "ON CONFLICT (chat_id) DO UPDATE SET next_bet_id = MAX(next_bet_id, excluded.next_bet_id)",
+                        (chat_id, archived + 1),
+                    )
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (chat_id, user_id, username, balance) VALUES (?, ?, ?, ?)",
+                [
+                    (int(chat_key), int(user_key), u.get("username", "") or "", u["balance"])
+                    for chat_key, chat_users in users.items()
+                    for user_key, u in chat_users.items()
+                ],
+            )
+            # Слова заменяемых ставок — по их старым описаниям
+            replaced = []
+            for b in bets:
+                row = conn.execute(
+                    "SELECT description FROM bets WHERE chat_id = ? AND id = ?", (b["chat_id"], b["id"])
+                ).fetchone()
+                if row is not None:
+                    replaced += _term_rows(b["chat_id"], b["id"], row["description"])
+            conn.executemany("DELETE FROM bet_terms WHERE chat_id = ? AND term = ? AND bet_id = ?", replaced)
+            conn.executemany(
+                "INSERT OR IGNORE INTO bet_terms (chat_id, term, bet_id) VALUES (?, ?, ?)",
+                [t for b in bets for t in _term_rows(b["chat_id"], b["id"], b["description"])],
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO bets ({BET_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        b["id"],
+                        b["chat_id"],
+                        b["user_id"],
+                        b["description"],
+                        b["rate"],
+                        b["sum"],
+                        b.get("status", "active"),
+                        b.get("settled_at"),
+                        b.get("settled_by_user_id"),
+                        b.get("settled_by_username"),
+                    )
+                    for b in bets
+                ],
+            )
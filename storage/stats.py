@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Running betting statistics per user and per chat (for /stats and /chatstats).
+
+Счётчики обновляются при создании и закрытии ставки (add_bet,
+add_settlement) — это O(1), историю не перебираем. rebuild() пересчитывает
+их по ставкам текущего раунда: при первом запросе в чате, где счётчиков ещё
+нет (данные до появления статистики, импорт), или по rebuild_stats().
+На /results счётчики уходят в архив вместе с итоговой таблицей и
+обнуляются — статистика считается по раунду, как и балансы. Ставка,
+сделанная до /results и закрытая после, считается так же, как деньги по ней:
+поставлена — в старом раунде, выиграна или проиграна (и выплата) — в новом.
+rebuild() узнаёт такие ставки по id меньше первого id раунда.
+
+Оба бэкенда хранят одни и те же словари:
+    игрок  USER_FIELDS: ставок, поставлено, выиграно/проиграно, поставлено в
+           закрытых, возвращено выплатами, лучший выигрыш (чистый), текущая серия
+           (+N побед / -N поражений подряд), лучшая серия побед
+    чат    CHAT_FIELDS: те же суммы плюс лучший выигрыш и лучшая серия с user_id
+"""
+USER_FIELDS = ("bets", "staked", "won", "lost", "settled_staked", "returned", "best_win", "streak", "best_streak")
+CHAT_FIELDS = (
+    "bets", "staked", "won", "lost", "settled_staked", "returned",
+    "best_win", "best_win_user", "best_streak", "best_streak_user",
+)
+
+
+def new_user() -> dict:
+    return dict.fromkeys(USER_FIELDS, 0)
+
+
+def new_chat() -> dict:
+    return dict.fromkeys(CHAT_FIELDS, 0)
+
+
+def add_bet(user: dict, chat: dict, sum_rub: int) -> None:
+    """A bet was placed."""
+    for s in (user, chat):
+        s["bets"] += 1
+        s["staked"] += sum_rub
+
+
+def add_settlement(user: dict, chat: dict, user_id: int, sum_rub: int, payout: int, won: bool) -> None:
+    """A bet of user_id was settled; payout is 0 for a lost bet."""
+    for s in (user, chat):
+        s["won" if won else "lost"] += 1
+        s["settled_staked"] += sum_rub
+        s["returned"] += payout
+    if won:
+        user["streak"] = user["streak"] + 1 if user["streak"] > 0 else 1
+        user["best_streak"] = max(user["best_streak"], user["streak"])
+        user["best_win"] = max(user["best_win"], payout - sum_rub)
+        if payout - sum_rub > chat["best_win"]:
+            chat["best_win"], chat["best_win_user"] = payout - sum_rub, user_id
+        if user["streak"] > chat["best_streak"]:
+            chat["best_streak"], chat["best_streak_user"] = user["streak"], user_id
+    else:
+        user["streak"] = user["streak"] - 1 if user["streak"] < 0 else -1
+
+
+def payout(bet: dict, won: bool) -> int:
+    return int(bet["sum"] * bet["rate"]) if won else 0
+
+
+def rebuild(bets, first_bet_id: int = 0) -> tuple[dict, dict]:
+    """(user_id -> counters, chat counters) from the round's bets, settlements replayed in time order.
+
+    Bets with id below first_bet_id were placed in an earlier round: only their settlement counts.
+    """
+    users: dict[int, dict] = {}
+    chat = new_chat()
+    settled = []
+    for bet in bets:
+        user = users.setdefault(bet["user_id"], new_user())
+        if bet["id"] >= first_bet_id:
+            add_bet(user, chat, bet["sum"])
+        if bet.get("status") in ("won", "lost"):
+            settled.append(bet)
+    settled.sort(key=lambda b: (b.get("settled_at") or "", b["id"]))
+    for bet in settled:
+        won = bet["status"] == "won"
+        add_settlement(users[bet["user_id"]], chat, bet["user_id"], bet["sum"], payout(bet, won), won)
+    return users, chat
+
+
+def summary(counters: dict) -> dict:
+    """Counters plus derived numbers: settled, profit, win_rate and roi (percent, None without settled bets)."""
+    out = dict(counters)
+    settled = counters["won"] + counters["lost"]
+    out["settled"] = settled
+    out["profit"] = counters["returned"] - counters["settled_staked"]
+    out["win_rate"] = round(counters["won"] * 100 / settled, 1) if settled else None
+    out["roi"] = round(out["profit"] * 100 / counters["settled_staked"], 1) if counters["settled_staked"] else None
+    return out
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""Shared helpers for the storage tests: python -m pytest -q from the repository root."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from storage.json_backend import JsonStorage  # noqa: E402
+
+
+def crash(backend: JsonStorage) -> None:
+    """Drop a JSON backend the way a killed process would: no snapshots, journal files just closed."""
+    with backend._shards_lock:
+        shards = list(backend._shards.values())
+        backend._shards.clear()
+    for shard in shards:
+        shard._journal.rotate()
+        shard._unmap()
+        shard.closed = True
+    backend.settle_log.close()
+    backend._unlock()
+
+
+@pytest.fixture
+def json_storage(tmp_path):
+    """Fresh JSON backend in a temporary data directory (no background thread)."""
+    backend = JsonStorage(tmp_path, snapshot_interval=3600)
+    yield backend
+    backend.close()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Crash recovery of the JSON backend: snapshot plus journal replay."""
+import pytest
+
+from storage.journal import CorruptDataError
+from storage.json_backend import JsonStorage
+
+from conftest import crash
+
+CHAT = -100
+
+
+def _state(backend) -> tuple:
+    users = sorted(backend.get_all_users_balances(CHAT), key=lambda u: u["user_id"])
+    bets = backend.get_user_bets(CHAT, 1) + backend.get_user_bets(CHAT, 2)
+    return users, sorted(bets, key=lambda b: b["id"])
+
+
+def _play(backend) -> None:
+    backend.get_user(CHAT, 1, "alice")
+    backend.get_user(CHAT, 2, "bob")
+    first = backend.create_bet(CHAT, 1, "Победа Спартака", 2.0, 500)
+    backend.create_bet(CHAT, 2, "Тотал больше 2.5", 1.5, 1000)
+    backend.settle_bet(CHAT, first["id"], True, 2, "bob")
+    backend.update_balance(CHAT, 2, -300)
+
+
+def _segments(data_dir):
+    return sorted((data_dir / "chats" / str(CHAT)).glob("journal.*.jsonl"))
+
+
+def test_journal_replays_after_crash(tmp_path):
+    backend = JsonStorage(tmp_path)
+    _play(backend)
+    before = _state(backend)
+    crash(backend)
+    assert not list((tmp_path / "chats" / str(CHAT)).glob("snapshot.*"))
+
+    reopened = JsonStorage(tmp_path)
+    try:
+        assert _state(reopened) == before
+        assert before[0][0]["balance"] == 10_000 - 500 + 1000
+        # Номера продолжаются с последней записи журнала
+        assert reopened.create_bet(CHAT, 1, "Ещё одна", 3.0, 100)["id"] == 3
+    finally:
+        reopened.close()
+
+
+def test_journal_after_snapshot_replays_on_top_of_it(tmp_path):
+    backend = JsonStorage(tmp_path)
+    backend.get_user(CHAT, 1, "alice")
+    backend.get_user(CHAT, 2, "bob")
+    backend.create_bet(CHAT, 1, "До снимка", 2.0, 100)
+    backend.maintain()  # снимок, журнал до него удалён
+    backend.create_bet(CHAT, 2, "После снимка", 2.0, 200)
+    before = _state(backend)
+    crash(backend)
+
+    reopened = JsonStorage(tmp_path)
+    try:
+        assert _state(reopened) == before
+    finally:
+        reopened.close()
+
+
+def test_torn_last_record_is_dropped(tmp_path):
+    backend = JsonStorage(tmp_path)
+    _play(backend)
+    before = _state(backend)
+    crash(backend)
+    with open(_segments(tmp_path)[-1], "ab") as f:
+        f.write(b'{"op":"balance","user_id":1,"de')  # процесс упал посреди записи
+
+    reopened = JsonStorage(tmp_path)
+    try:
+        assert _state(reopened) == before
+        # Следующая запись не склеивается с оборванной строкой
+        reopened.update_balance(CHAT, 1, 5)
+        expected = before[0][0]["balance"] + 5
+    finally:
+        reopened.close()
+    again = JsonStorage(tmp_path)
+    try:
+        assert again.get_balance(CHAT, 1) == expected
+    finally:
+        again.close()
+
+
+def test_damaged_record_in_the_middle_refuses_to_load(tmp_path):
+    backend = JsonStorage(tmp_path)
+    _play(backend)
+    crash(backend)
+    segment = _segments(tmp_path)[-1]
+    lines = segment.read_bytes().splitlines(keepends=True)
+    lines[1] = b"not json\n"
+    segment.write_bytes(b"".join(lines))
+
+    reopened = JsonStorage(tmp_path)
+    with pytest.raises(CorruptDataError):
+        reopened.get_user(CHAT, 1)
+    crash(reopened)
+
+
+def test_torn_record_survives_a_second_crash(tmp_path):
+    backend = JsonStorage(tmp_path)
+    _play(backend)
+    crash(backend)
+    with open(_segments(tmp_path)[-1], "ab") as f:
+        f.write(b'{"op":"balance","user_id":1,"de')
+
+    reopened = JsonStorage(tmp_path)
+    reopened.update_balance(CHAT, 1, 5)  # пишется уже в новый сегмент
+    before = _state(reopened)
+    crash(reopened)
+    assert len(_segments(tmp_path)) == 2
+
+    again = JsonStorage(tmp_path)
+    try:
+        assert _state(again) == before
+    finally:
+        again.close()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""python -m storage.migrate between the JSON and SQLite backends."""
+import json
+
+import pytest
+
+from storage.json_backend import DataDirLockedError, JsonStorage
+from storage.migrate import MigrationError, migrate
+from storage.sqlite_backend import SqliteStorage
+
+LEGACY_USERS = {
+    "-100": {
+        "1": {"user_id": 1, "username": "alice", "balance": 9500},
+        "2": {"user_id": 2, "username": "bob", "balance": 11000},
+    },
+    "-200": {"1": {"user_id": 1, "username": "alice", "balance": 10000}},
+}
+LEGACY_BETS = [
+    {"id": 1, "chat_id": -100, "user_id": 1, "description": "Победа Спартака", "rate": 2.0, "sum": 500,
+     "status": "active"},
+    {"id": 2, "chat_id": -100, "user_id": 2, "description": "Тотал больше 2.5", "rate": 2.0, "sum": 1000,
+     "status": "won", "settled_at": "2024-05-01T12:00:00", "settled_by_user_id": 1, "settled_by_username": "alice"},
+    {"id": 3, "chat_id": -200, "user_id": 1, "description": "Ничья", "rate": 3.0, "sum": 100,
+     "status": "lost", "settled_at": "2024-05-02T12:00:00", "settled_by_user_id": 1, "settled_by_username": "alice"},
+]
+
+
+def _write_legacy(data_dir) -> None:
+    (data_dir / "users.json").write_text(json.dumps(LEGACY_USERS), encoding="utf-8")
+    (data_dir / "bets.json").write_text(json.dumps(LEGACY_BETS), encoding="utf-8")
+
+
+def _exported(backend) -> tuple[dict, list]:
+    try:
+        users, bets = backend.export_data()
+    finally:
+        backend.close()
+    return users, sorted(bets, key=lambda b: (b["chat_id"], b["id"]))
+
+
+def test_legacy_json_files_to_sqlite(tmp_path):
+    _write_legacy(tmp_path)
+    assert migrate("json", "sqlite", tmp_path) == (3, 3)
+
+    users, bets = _exported(SqliteStorage(tmp_path))
+    assert users == LEGACY_USERS
+    assert bets == sorted(LEGACY_BETS, key=lambda b: (b["chat_id"], b["id"]))
+    # Старые файлы разложены по шардам и отложены в .bak
+    assert (tmp_path / "users.json.bak").exists() and not (tmp_path / "users.json").exists()
+
+
+def test_sqlite_to_json_and_back(tmp_path):
+    sqlite = SqliteStorage(tmp_path)
+    sqlite.start()
+    sqlite.get_user(-100, 1, "alice")
+    sqlite.get_user(-100, 2, "bob")
+    bet = sqlite.create_bet(-100, 1, "Победа Спартака", 2.0, 500)
+    sqlite.create_bet(-100, 2, "Тотал больше 2.5", 1.5, 1000)
+    sqlite.settle_bet(-100, bet["id"], True, 2, "bob")
+    expected = _exported(sqlite)
+
+    assert migrate("sqlite", "json", tmp_path) == (2, 2)
+    assert _exported(JsonStorage(tmp_path)) == expected
+    (tmp_path / "bot.sqlite3").unlink()
+    assert migrate("json", "sqlite", tmp_path) == (2, 2)
+    assert _exported(SqliteStorage(tmp_path)) == expected
+
+
+def test_legacy_files_that_export_nothing_fail_loudly(tmp_path, monkeypatch):
+    _write_legacy(tmp_path)
+    monkeypatch.setattr(JsonStorage, "export_data", lambda self: ({}, []))
+    with pytest.raises(MigrationError, match="users.json"):
+        migrate("json", "sqlite", tmp_path)
+    assert _exported(SqliteStorage(tmp_path)) == ({}, [])
+
+
+def test_migrate_refuses_to_run_next_to_the_bot(tmp_path):
+    bot = JsonStorage(tmp_path)
+    bot.start()
+    bot.get_user(-100, 1, "alice")
+    try:
+        with pytest.raises(DataDirLockedError):
+            migrate("json", "sqlite", tmp_path)
+    finally:
+        bot.close()
+    assert migrate("json", "sqlite", tmp_path) == (1, 0)
+    # Пока идёт перенос, бот не запустится
+    migration = JsonStorage(tmp_path)
+    migration.lock(exclusive=True)
+    try:
+        with pytest.raises(DataDirLockedError):
+            JsonStorage(tmp_path).start()
+    finally:
+        migration.close()
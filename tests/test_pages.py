@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Paged lists (/bets, /active, /find): flipping to the same page sends no edit."""
+import asyncio
+
+import pytest
+
+import bot
+import sender
+from bench import fakes
+
+BETS = [
+    {"id": 7, "user_id": 1, "username": "alice", "description": "Победа Спартака", "rate": 2.0, "sum": 500, "status": "active"},
+    {"id": 5, "user_id": 2, "username": "", "description": "Тотал больше 2.5", "rate": 1.5, "sum": 1000, "status": "active"},
+]
+PAGES = {
+    "bets": lambda: bot._format_bets_message(BETS, True, False, 1),
+    "active": lambda: bot._format_active_message(BETS, True, True),
+    "find": lambda: bot._format_find_message("Спартак", BETS, False, True),
+}
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_rerendered_page_matches_its_sent_text(page):
+    text, keyboard = PAGES[page]()
+    # Telegram хранит текст без пробелов и переводов строки по краям
+    assert text == text.strip()
+
+    async def run():
+        stub = fakes.StubBot()
+        update = fakes.callback(stub, -100, 1, "active_b5", text.strip())
+        update.callback_query.message.reply_markup = keyboard
+        await bot._edit_if_changed(fakes.FakeContext(stub), update.callback_query, *PAGES[page]())
+        await sender.close_outboxes()
+        return stub.calls
+
+    assert asyncio.run(run()) == []
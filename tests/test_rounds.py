@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Closing a round (/results → «Да»): once per round, and finished after a crash."""
+import pytest
+
+from storage.archive import ChatArchive
+from storage.json_backend import JsonStorage
+from storage.sqlite_backend import SqliteStorage
+
+from conftest import crash
+
+CHAT = -100
+
+
+def _open(kind, data_dir):
+    backend = JsonStorage(data_dir) if kind == "json" else SqliteStorage(data_dir)
+    backend.start()
+    return backend
+
+
+def _drop(backend):
+    if isinstance(backend, JsonStorage):
+        crash(backend)
+    else:
+        backend.close()
+
+
+def _play(backend):
+    backend.get_user(CHAT, 1, "alice")
+    backend.get_user(CHAT, 2, "bob")
+    bet = backend.create_bet(CHAT, 1, "Победа Спартака", 2.0, 500)
+    backend.settle_bet(CHAT, bet["id"], True, 2, "bob")
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_second_confirmation_of_the_same_round_does_nothing(kind, tmp_path):
+    backend = _open(kind, tmp_path)
+    try:
+        _play(backend)
+        round_no = backend.get_round(CHAT)
+        assert backend.reset_all_balances_to_initial(CHAT, round_no) == 2
+        backend.update_balance(CHAT, 1, 700)
+        assert backend.reset_all_balances_to_initial(CHAT, round_no) is None
+        assert backend.get_round(CHAT) == round_no + 1
+        assert [r["round"] for r in backend.get_rounds(CHAT)] == [round_no]
+        assert backend.get_balance(CHAT, 1) == 10_700
+    finally:
+        backend.close()
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_reset_cut_short_after_the_standings_is_finished_on_restart(kind, tmp_path, monkeypatch):
+    backend = _open(kind, tmp_path)
+    _play(backend)
+    round_no = backend.get_round(CHAT)
+    closed = []
+
+    def close_round_and_die(self, *args, **kwargs):
+        closed.append(original(self, *args, **kwargs))
+        raise KeyboardInterrupt  # процесс убит сразу после записи итогов
+
+    original = ChatArchive.close_round
+    monkeypatch.setattr(ChatArchive, "close_round", close_round_and_die)
+    with pytest.raises(KeyboardInterrupt):
+        backend.reset_all_balances_to_initial(CHAT, round_no)
+    monkeypatch.setattr(ChatArchive, "close_round", original)
+    assert closed == [round_no]
+    _drop(backend)
+
+    reopened = _open(kind, tmp_path)
+    try:
+        assert reopened.get_round(CHAT) == round_no + 1
+        assert {u["balance"] for u in reopened.get_all_users_balances(CHAT)} == {10_000}
+        assert reopened.get_chat_stats(CHAT)["bets"] == 0
+        # Итоги раунда сохранены до сброса, а вопрос о нём уже устарел
+        assert reopened.get_round_standings(CHAT, round_no)["standings"][0]["balance"] == 10_500
+        assert reopened.reset_all_balances_to_initial(CHAT, round_no) is None
+    finally:
+        reopened.close()
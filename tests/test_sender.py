@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Outbox (sender.py) against the flood-limited stub bot of the benchmarks."""
+import asyncio
+
+import bot
+import sender
+from bench import fakes, loadtest
+
+
+def test_reply_keeps_the_topic_and_quotes_the_command_in_groups():
+    async def run():
+        stub = fakes.StubBot()
+        update = fakes.command(stub, -100, 1, "/help")
+        update.message.message_thread_id, update.message.is_topic_message = 7, True
+        await bot._reply(update, fakes.FakeContext(stub), "в тему")
+        private = fakes.command(stub, 1, 1, "/help")
+        private.effective_chat.type = "private"
+        await bot._reply(private, fakes.FakeContext(stub), "в личку")
+        await sender.close_outboxes()
+        return stub.calls, update.message.message_id
+
+    calls, command_id = asyncio.run(run())
+    (_, group), (_, private) = calls
+    assert group["message_thread_id"] == 7
+    assert group["reply_parameters"].message_id == command_id
+    assert "message_thread_id" not in private and "reply_parameters" not in private
+
+
+def test_metrics_file_has_the_outbox_histograms(monkeypatch):
+    monkeypatch.setattr(sender.metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(sender.metrics, "_histograms", {})
+
+    async def run():
+        stub = fakes.StubBot()
+        await sender.get_outbox(stub).send(-100, "привет")
+        await sender.close_outboxes()
+
+    asyncio.run(run())
+    text = sender.metrics.render()
+    assert 'betbot_outbox_wait_seconds_count{lane="send"} 1' in text
+    assert 'betbot_outbox_send_seconds_count{lane="send"} 1' in text
+    assert 'betbot_outbox_send_errors_total{lane="send"} 0' in text
+
+
+def test_outbox_stays_within_the_same_limits_as_telegram():
+    report = asyncio.run(loadtest.run(
+        "json", chats=20, users=5, bets=20, rate=30, duration=1, concurrency=32,
+        mix=loadtest.DEFAULT_MIX, api_latency=0.01, chat_limit=1, global_limit=10,
+    ))
+    assert report["api_calls"] > 20
+    assert report["rejected_429"] == 0
+
+
+def test_handlers_do_not_wait_for_a_rate_limited_chat(capsys):
+    async def broken(**kwargs):
+        raise RuntimeError("network is down")
+
+    async def run():
+        stub = fakes.StubBot()
+        sender.get_outbox(stub, chat_rate=1)
+        update = fakes.command(stub, -100, 1, "/help")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for n in range(3):
+            await bot._reply(update, fakes.FakeContext(stub), f"ответ {n}")
+        queued_in = loop.time() - started
+        offline = fakes.StubBot()
+        offline.send_message = broken
+        await bot._reply(fakes.command(offline, -200, 1, "/help"), fakes.FakeContext(offline), "не дойдёт")
+        await sender.close_outboxes(timeout=None)
+        return queued_in, len(stub.calls)
+
+    queued_in, sent = asyncio.run(run())
+    # Лимит — одно сообщение в секунду, а все три ответа встали в очередь сразу
+    assert queued_in < 0.5
+    assert sent == 3
+    assert "send_message to chat -200 failed: RuntimeError('network is down')" in capsys.readouterr().out
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Running /stats counters against stats.rebuild() over the same bets, across /results."""
+import pytest
+
+from storage.json_backend import JsonStorage
+from storage.sqlite_backend import SqliteStorage
+
+from conftest import crash
+
+CHAT = -100
+USERS = (1, 2, 3)
+
+
+def _open(kind, data_dir):
+    backend = JsonStorage(data_dir) if kind == "json" else SqliteStorage(data_dir)
+    backend.start()
+    return backend
+
+
+def _counters(backend):
+    return [backend.get_user_stats(CHAT, user_id) for user_id in USERS], backend.get_chat_stats(CHAT)
+
+
+def _assert_matches_rebuild(backend):
+    running = _counters(backend)
+    backend.rebuild_stats(CHAT)
+    assert _counters(backend) == running
+    return running
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_counters_match_rebuild_across_a_reset(kind, tmp_path):
+    backend = _open(kind, tmp_path)
+    try:
+        for user_id in USERS:
+            backend.get_user(CHAT, user_id, f"user{user_id}")
+        first = [backend.create_bet(CHAT, user_id, f"матч {user_id}", 1.5 + user_id, 100 * user_id) for user_id in USERS]
+        backend.settle_bet(CHAT, first[0]["id"], True, 2, "user2")
+        backend.settle_bet(CHAT, first[1]["id"], False, 1, "user1")
+        _assert_matches_rebuild(backend)
+
+        # Ставка user3 переходит во второй раунд активной и закрывается уже в нём
+        assert backend.reset_all_balances_to_initial(CHAT, backend.get_round(CHAT)) == len(USERS)
+        second = backend.create_bet(CHAT, 1, "реванш", 3.0, 250)
+        backend.settle_bet(CHAT, first[2]["id"], True, 1, "user1")
+        backend.settle_bet(CHAT, second["id"], False, 2, "user2")
+
+        users, chat = _assert_matches_rebuild(backend)
+        assert (chat["bets"], chat["won"], chat["lost"]) == (1, 1, 1)
+        assert users[2]["bets"] == 0 and users[2]["won"] == 1
+        assert chat["best_win_user"] == 3 and chat["best_win"] == int(300 * 4.5) - 300
+    finally:
+        backend.close()
+
+
+def test_counters_match_rebuild_after_a_crash(tmp_path):
+    backend = _open("json", tmp_path)
+    for user_id in USERS:
+        backend.get_user(CHAT, user_id, f"user{user_id}")
+    carried = backend.create_bet(CHAT, 3, "финал", 2.0, 300)
+    backend.reset_all_balances_to_initial(CHAT)
+    backend.settle_bet(CHAT, carried["id"], True, 1, "user1")
+    running = _counters(backend)
+    crash(backend)
+
+    backend = _open("json", tmp_path)
+    try:
+        assert _counters(backend) == running
+        _assert_matches_rebuild(backend)
+    finally:
+        backend.close()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Webhook server: no unauthenticated updates from outside this machine."""
+import asyncio
+
+import pytest
+
+import webhook
+
+
+async def _ignore(data):
+    pass
+
+
+def test_refuses_to_listen_publicly_without_secret():
+    server = webhook.WebhookServer(_ignore, host="0.0.0.0", port=0, secret="")
+    with pytest.raises(SystemExit, match="WEBHOOK_SECRET"):
+        asyncio.run(server.start())
+
+
+def test_loopback_without_secret_and_public_with_secret_start():
+    async def run(host, secret):
+        server = webhook.WebhookServer(_ignore, host=host, port=0, secret=secret)
+        await server.start()
+        await server.stop()
+
+    asyncio.run(run("127.0.0.1", ""))
+    asyncio.run(run("0.0.0.0", "s3cret"))
+
+
+def test_update_without_the_secret_is_rejected():
+    server = webhook.WebhookServer(_ignore, path="/telegram", secret="s3cret")
+    status, _, _ = server._dispatch("POST", "/telegram", {}, b"{}")
+    assert status == 403
+    status, _, _ = server._dispatch("POST", "/telegram", {webhook.SECRET_HEADER: "s3cret"}, b"{}")
+    assert status == 200
+
+
+def test_secret_is_generated_when_the_bot_registers_the_webhook(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", "")
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", "https://example.com/telegram")
+    assert len(webhook.server_secret()) >= 32
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", "")
+    assert webhook.server_secret() == ""
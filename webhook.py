@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""Webhook mode: a small HTTP server that takes updates from Telegram into a bounded queue.
+
+Telegram присылает каждый апдейт POST-запросом на WEBHOOK_URL. Сервер
+сразу кладёт его в очередь (не больше WEBHOOK_QUEUE_SIZE штук) и отвечает
+200, а WEBHOOK_WORKERS задач разбирают очередь и вызывают обработчик. Если
+очередь полна, отвечаем 503 с Retry-After — Telegram повторит апдейт позже,
+а не положит бота. При остановке новые апдейты не принимаются, а очередь
+дорабатывается до конца.
+
+Без секрета (WEBHOOK_SECRET) апдейт мог бы прислать кто угодно, кто видит
+порт, — например, нажать «Сыграло» за другого игрока. Поэтому без него
+сервер слушает только loopback. Если WEBHOOK_SECRET не задан, а webhook
+регистрирует сам бот (WEBHOOK_URL), секрет придумывается при запуске и
+передаётся Telegram в set_webhook.
+
+Проверить локально без Telegram (бот запущен с BOT_MODE=webhook):
+
+    python webhook.py post updates.jsonl --url http://127.0.0.1:8080/telegram --secret <WEBHOOK_SECRET>
+"""
+import argparse
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import signal
+import sys
+import time
+import traceback
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+# Railway и похожие хостинги сами задают порт в PORT
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT") or os.environ.get("PORT") or "8080")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", os.environ.get("BOT_CONCURRENT_UPDATES", "32")))
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY = 1024 * 1024
+KEEPALIVE_TIMEOUT = 75
+RETRY_AFTER = 1
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+def is_loopback(host: str) -> bool:
+    """Whether host only accepts connections from this machine ("" and 0.0.0.0 mean every interface)."""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def server_secret() -> str:
+    """WEBHOOK_SECRET, or a random one when the bot registers WEBHOOK_URL itself (pass it to set_webhook)."""
+    if WEBHOOK_SECRET or not WEBHOOK_URL:
+        return WEBHOOK_SECRET
+    return secrets.token_urlsafe(32)
+
+
+class WebhookServer:
+    """HTTP endpoint + bounded queue + worker tasks; on_update(update_json) does the actual work."""
+
+    def __init__(
+        self,
+        on_update,
+        host: str = WEBHOOK_LISTEN,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        workers: int = WEBHOOK_WORKERS,
+        health=None,
+    ):
+        self.on_update = on_update
+        self.health = health  # () -> dict: что ещё показать в /healthz
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.workers = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        # Счётчики для /healthz
+        self.stats = {"received": 0, "rejected": 0, "processed": 0, "failed": 0}
+        self._server: asyncio.AbstractServer | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._closing = False
+
+    async def start(self) -> None:
+        if not self.secret and not is_loopback(self.host):
+            raise SystemExit(
+                f"Set WEBHOOK_SECRET (or WEBHOOK_URL, then a secret is generated) to listen on {self.host or '*'}: "
+                "without it anyone who can reach the port can send the bot forged updates"
+            )
+        self._tasks = [asyncio.create_task(self._worker(), name=f"webhook-worker-{i}") for i in range(self.workers)]
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # если слушали порт 0
+        print(f"Webhook listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self) -> None:
+        """Stop accepting updates, finish everything already queued, stop the workers."""
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        # Открытые keep-alive соединения закрываем сами, иначе wait_closed будет их ждать
+        for writer in list(self._connections):
+            writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            data = await self.queue.get()
+            try:
+                await self.on_update(data)
+                self.stats["processed"] += 1
+            except Exception:  # noqa: BLE001 — один плохой апдейт не должен останавливать воркер
+                self.stats["failed"] += 1
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def accept(self, body: bytes) -> tuple[int, dict, bytes]:
+        """Queue one update body; (status, extra headers, response body)."""
+        if self._closing:
+            return 503, {"Retry-After": str(RETRY_AFTER)}, b"shutting down"
+        try:
+            data = json.loads(body)
+        except (ValueError, UnicodeDecodeError):
+            return 400, {}, b"bad json"
+        if not isinstance(data, dict):
+            return 400, {}, b"update must be an object"
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Обратное давление: Telegram повторит апдейт, а очередь не растёт без предела
+            self.stats["rejected"] += 1
+            return 503, {"Retry-After": str(RETRY_AFTER)}, b"queue is full"
+        self.stats["received"] += 1
+        return 200, {}, b"ok"
+
+    def _dispatch(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        if path == "/healthz":
+            state = {"status": "closing" if self._closing else "ok", "queued": self.queue.qsize(), **self.stats}
+            if self.health is not None:
+                state.update(self.health())
+            return (503 if self._closing else 200), {"Content-Type": "application/json"}, json.dumps(state).encode()
+        if path != self.path:
+            return 404, {}, b"not found"
+        if method != "POST":
+            return 405, {"Allow": "POST"}, b"use POST"
+        if self.secret and not hmac.compare_digest(headers.get(SECRET_HEADER, ""), self.secret):
+            return 403, {}, b"wrong secret token"
+        return self.accept(body)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while not self._closing:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {}, b"too large", keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, extra, payload = self._dispatch(method, target.split("?", 1)[0], headers, body)
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, extra, payload, keep_alive and not self._closing)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, headers: dict, body: bytes, keep_alive: bool) -> None:
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Length: {len(body)}"]
+        head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        head += [f"{name}: {value}" for name, value in headers.items()]
+        if "Content-Type" not in headers:
+            head.append("Content-Type: text/plain")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+async def wait_for_stop_signal() -> None:
+    """Return on SIGINT/SIGTERM (on Windows Ctrl+C cancels the main task instead)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await stop.wait()
+
+
+async def _run_application(app, allowed_updates) -> None:
+    from telegram import Update
+
+    async def on_update(data: dict) -> None:
+        await app.process_update(Update.de_json(data, app.bot))
+
+    # Без run_polling/run_webhook жизненный цикл Application проходим сами, в том же порядке
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    secret = server_secret()
+    server = WebhookServer(on_update, secret=secret)
+    try:
+        await server.start()
+        if WEBHOOK_URL:
+            await app.bot.set_webhook(WEBHOOK_URL, secret_token=secret, allowed_updates=allowed_updates)
+        else:
+            print("WEBHOOK_URL is not set: webhook is not registered in Telegram, only local POSTs will arrive")
+        print("Bot running in webhook mode. Press Ctrl+C to stop.")
+        await wait_for_stop_signal()
+    finally:
+        await server.stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def run_application(app, allowed_updates=None) -> None:
+    """Run a built telegram Application behind WebhookServer until SIGINT/SIGTERM."""
+    try:
+        asyncio.run(_run_application(app, allowed_updates))
+    except KeyboardInterrupt:
+        pass
+
+
+def _read_updates(path: Path) -> list[dict]:
+    """Updates from a .json file (one update or a list) or .jsonl (one per line)."""
+    text = path.read_text(encoding="utf-8").strip()
+    if text.startswith("["):
+        return json.loads(text)
+    try:
+        return [json.loads(text)]
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def post_updates(path: Path, url: str, secret: str = "") -> None:
+    """POST recorded updates one by one, like Telegram does; retries on 503."""
+    for data in _read_updates(path):
+        request = urllib.request.Request(url, data=json.dumps(data).encode("utf-8"), method="POST")
+        request.add_header("Content-Type", "application/json")
+        if secret:
+            request.add_header(SECRET_HEADER, secret)
+        while True:
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    print(data.get("update_id"), response.status)
+                break
+            except urllib.error.HTTPError as e:
+                print(data.get("update_id"), e.code, e.read().decode("utf-8", "replace"))
+                if e.code != 503:
+                    break
+                time.sleep(int(e.headers.get("Retry-After") or RETRY_AFTER))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Send recorded updates to a running webhook server.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    post = sub.add_parser("post", help="POST updates from a .json/.jsonl file")
+    post.add_argument("file", type=Path)
+    post.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    post.add_argument("--secret", default=WEBHOOK_SECRET)
+    args = parser.parse_args(argv)
+    if args.command == "post":
+        post_updates(args.file, args.url, args.secret)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])